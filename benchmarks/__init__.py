@@ -0,0 +1 @@
+"""Benchmarks for mock-alchemy."""
@@ -0,0 +1,41 @@
+"""Benchmarks of comparing SQLAlchemy expressions in mock-alchemy."""
+from typing import Any
+from unittest import mock
+
+from sqlalchemy import and_
+from sqlalchemy import or_
+
+from mock_alchemy.comparison import ExpressionMatcher
+from mock_alchemy.mocking import UnorderedCall
+from mock_alchemy.mocking import sqlalchemy_call
+from tests.common import SomeClass
+
+
+def test_expression_matcher_eq(benchmark: Any) -> None:
+    """Benchmarks comparing the same expressions again."""
+    expr = and_(SomeClass.pk1 == 1, or_(SomeClass.name == "a", SomeClass.pk2 > 2))
+    other = and_(SomeClass.pk1 == 1, or_(SomeClass.name == "a", SomeClass.pk2 > 2))
+    matcher = ExpressionMatcher(expr)
+    assert benchmark(matcher.__eq__, other)
+
+
+def test_expression_matcher_eq_new(benchmark: Any) -> None:
+    """Benchmarks comparing newly built expressions."""
+
+    def compare() -> bool:
+        expr = and_(SomeClass.pk1 == 1, SomeClass.name == "a")
+        return ExpressionMatcher(expr) == and_(
+            SomeClass.pk1 == 1, SomeClass.name == "a"
+        )
+
+    assert benchmark(compare)
+
+
+def test_unordered_call_eq(benchmark: Any) -> None:
+    """Benchmarks comparing calls with many arguments in a different order."""
+    criteria = [SomeClass.pk1 == i for i in range(50)]
+    call = sqlalchemy_call(
+        mock.call.filter(*criteria), with_name=True, base_call=UnorderedCall
+    )
+    other = mock.call.filter(*criteria[::-1])
+    assert benchmark(call.__eq__, other)
@@ -0,0 +1,88 @@
+"""Benchmarks of mocking SQLAlchemy sessions in mock-alchemy."""
+from typing import Any
+from typing import List
+from unittest import mock
+
+import pytest
+
+from mock_alchemy.mocking import AlchemyMagicMock
+from mock_alchemy.mocking import UnifiedAlchemyMagicMock
+from tests.common import Model
+
+
+@pytest.mark.parametrize("entries", [10, 100, 1000])
+def test_get_data(benchmark: Any, entries: int) -> None:
+    """Benchmarks looking up the data of a query among many fixture entries."""
+    s = UnifiedAlchemyMagicMock(
+        data=[
+            (
+                [mock.call.query(Model), mock.call.filter(Model.pk1 == i)],
+                [Model(pk1=i)],
+            )
+            for i in range(entries)
+        ]
+    )
+
+    def query() -> List[Any]:
+        return s.query(Model).filter(Model.pk1 == entries // 2).all()
+
+    assert benchmark(query)[0].pk1 == entries // 2
+
+
+def test_unify_long_chain(benchmark: Any) -> None:
+    """Benchmarks unifying the calls of a query with many filters."""
+    s = UnifiedAlchemyMagicMock(max_history=1000)
+    s.add_all([Model(pk1=i, name=str(i)) for i in range(10)])
+    criteria = [Model.pk1 != i for i in range(100)]
+
+    def query() -> List[Any]:
+        q = s.query(Model)
+        for i in criteria:
+            q = q.filter(i)
+        return q.all()
+
+    assert benchmark(query) == []
+
+
+def test_add_all(benchmark: Any) -> None:
+    """Benchmarks adding many objects to a session."""
+
+    def setup() -> Any:
+        objs = [Model(pk1=i, name=str(i)) for i in range(100000)]
+        return (UnifiedAlchemyMagicMock(), objs), {}
+
+    def add_all(s: UnifiedAlchemyMagicMock, objs: List[Model]) -> None:
+        s.add_all(objs)
+
+    benchmark.pedantic(add_all, setup=setup, rounds=5)
+
+
+@pytest.mark.parametrize("method", ["query", "session"])
+def test_get(benchmark: Any, method: str) -> None:
+    """Benchmarks getting objects by primary key among many objects."""
+    s = UnifiedAlchemyMagicMock()
+    s.add_all([Model(pk1=i, name=str(i)) for i in range(100000)])
+
+    def get() -> Model:
+        if method == "query":
+            return s.query(Model).get(50000)
+        return s.get(Model, 50000)
+
+    assert benchmark(get).pk1 == 50000
+
+
+@pytest.mark.parametrize(
+    "method", ["assert_called_with", "assert_any_call", "assert_has_calls"]
+)
+def test_asserts(benchmark: Any, method: str) -> None:
+    """Benchmarks asserting calls on a long call history."""
+    s = AlchemyMagicMock()
+    for i in range(10000):
+        s.filter(Model.pk1 == i)
+    if method == "assert_called_with":
+        args = (Model.pk1 == 9999,)
+    elif method == "assert_any_call":
+        args = (Model.pk1 == 0,)
+    else:
+        args = ([mock.call(Model.pk1 == 0), mock.call(Model.pk1 == 1)],)
+    benchmark(getattr(s.filter, method), *args)
@@ -145,6 +145,17 @@ def coverage(session: Session) -> None:
     session.run("coverage", *args)
 
 
+@session(python="3.11")
+def benchmarks(session: Session) -> None:
+    """Run the benchmarks and compare them with the previous run."""
+    args = session.posargs
+    if not args and any(Path(".benchmarks").glob("*/*.json")):
+        args = ["--benchmark-compare", "--benchmark-compare-fail=mean:20%"]
+    session.install(".")
+    session.install("pytest", "pytest-benchmark")
+    session.run("pytest", "benchmarks", "--benchmark-autosave", *args)
+
+
 @session(python=python_versions)
 def typeguard(session: Session) -> None:
     """Runtime type checking using Typeguard."""
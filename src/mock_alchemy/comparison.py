@@ -5,17 +5,45 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import itertools
+import threading
+from collections import OrderedDict
+from collections import namedtuple
 from collections.abc import Mapping
+from functools import lru_cache
 from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import FrozenSet
+from typing import Hashable
 from typing import Optional
+from typing import Tuple
 from unittest import mock
 
 import sqlalchemy
 from packaging import version
 from sqlalchemy import func
 from sqlalchemy import select
+from sqlalchemy.dialects import registry
+from sqlalchemy.schema import Column
+from sqlalchemy.sql import elements
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.annotation import Annotated
+from sqlalchemy.sql.elements import BinaryExpression
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.sql.elements import BooleanClauseList
+from sqlalchemy.sql.elements import ClauseList
+from sqlalchemy.sql.elements import ColumnClause
+from sqlalchemy.sql.elements import False_
+from sqlalchemy.sql.elements import Grouping
+from sqlalchemy.sql.elements import Label
+from sqlalchemy.sql.elements import Null
+from sqlalchemy.sql.elements import True_
+from sqlalchemy.sql.elements import UnaryExpression
+from sqlalchemy.sql.elements import _anonymous_label
+from sqlalchemy.sql.expression import TableClause
 from sqlalchemy.sql.expression import column
 from sqlalchemy.sql.expression import or_
+from sqlalchemy.types import TypeEngine
 
 from .utils import match_type
 
@@ -31,9 +59,462 @@ ALCHEMY_TYPES = (
     ALCHEMY_FUNC_TYPE,
     ALCHEMY_LABEL_TYPE,
 )
+_HAS_CACHE_KEYS = False
 if version.parse(sqlalchemy.__version__) >= version.parse("1.4.0"):
     ALCHEMY_SELECT_TYPE = type(select(column("")))
     ALCHEMY_TYPES += (ALCHEMY_SELECT_TYPE,)
+    _HAS_CACHE_KEYS = True
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class CompileCache(object):
+    """Bounded cache of compiled SQLAlchemy expressions.
+
+    Compiling an expression is by far the most expensive part of comparing
+    or representing it. Since SQLAlchemy expressions are immutable, the
+    compiled SQL string and its parameters are remembered per expression
+    object so that each expression is compiled only once.
+
+    Expressions are keyed by identity along with the dialect they are
+    compiled for, given as a ``Dialect`` or the name of one. The cache keeps
+    a reference to every cached expression so that its ``id()`` cannot be
+    reused while cached, and evicts the least recently used expression once
+    ``maxsize`` is exceeded.
+    The cache is guarded by a lock so that it can be shared by threads.
+
+    Attributes:
+        maxsize: The maximum number of expressions to keep compiled.
+        hits: The number of lookups answered from the cache.
+        misses: The number of lookups which required compiling, by all
+            threads.
+
+    For example::
+
+        >>> cache = CompileCache(maxsize=2)
+        >>> c = column('column')
+        >>> e = c == 5
+        >>> cache.compile(e)
+        ('"column" = :column_1', {'column_1': 5})
+        >>> _ = cache.compile(e)
+        >>> cache.info()
+        CacheInfo(hits=1, misses=1, maxsize=2, currsize=1)
+        >>> cache.compile(e, 'postgresql')
+        ('"column" = %(column_1)s', {'column_1': 5})
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        """Creates an empty CompileCache."""
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[Hashable, Tuple[Any, Any, Tuple[str, Dict[str, Any]]]]
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def compile(self, expr: Any, dialect: Any = None) -> Tuple[str, Dict[str, Any]]:
+        """Compiles an expression or gets its cached compiled form.
+
+        Args:
+            expr: The SQLAlchemy expression to compile.
+            dialect: The dialect or name of the dialect to compile for or
+                ``None`` for the default dialect.
+
+        Returns:
+            A tuple of the compiled SQL string and the bound parameters.
+        """
+        if isinstance(dialect, str):
+            dialect = _load_dialect(dialect)
+        key = id(expr) if dialect is None else (id(expr), id(dialect))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return cached[2]
+            self.misses += 1
+        self._local.misses = self.thread_misses() + 1
+
+        compiled = expr.compile(dialect=dialect)
+        value = (str(compiled), compiled.params)
+        with self._lock:
+            self._cache[key] = (expr, dialect, value)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return value
+
+    def thread_misses(self) -> int:
+        """Gets the number of lookups of the current thread which required compiling.
+
+        Unlike ``misses``, the count is kept per thread and is never reset,
+        hence the compiles caused by an operation are the difference of the
+        counts before and after it, whichever threads use the cache meanwhile.
+
+        Returns:
+            The number of misses of the current thread.
+        """
+        misses: int = getattr(self._local, "misses", 0)
+        return misses
+
+    def info(self) -> CacheInfo:
+        """Gets the hit and miss statistics of the cache."""
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._cache))
+
+    def clear(self) -> None:
+        """Empties the cache and resets its statistics."""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+compile_cache = CompileCache()
+
+
+@lru_cache(maxsize=None)
+def _load_dialect(name: str) -> Any:
+    """Gets the dialect with the given name such as ``postgresql``.
+
+    Args:
+        name: The name of the dialect as used in database URLs.
+
+    Returns:
+        The dialect which is the same object for the same name.
+
+    For example::
+
+        >>> _load_dialect('sqlite').name
+        'sqlite'
+        >>> _load_dialect('sqlite') is _load_dialect('sqlite')
+        True
+    """
+    return registry.load(name)()
+
+
+def _freeze(value: Any) -> Hashable:
+    """Converts a bound parameter value into a hashable equivalent."""
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(_freeze(i) for i in value)
+    if isinstance(value, Mapping):
+        return type(value), frozenset((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    frozen: Hashable = value
+    hash(frozen)
+    return frozen
+
+
+def fingerprint(expr: Any, dialect: Any = None) -> Hashable:
+    """Gets the structural fingerprint of an expression.
+
+    Computes a hashable value which is equal for two expressions exactly
+    when ``ExpressionMatcher`` considers them equal. For SQLAlchemy expressions
+    it consists of the expression type, the compiled SQL skeleton and the
+    bound parameter values. Nested lists, tuples and mappings are
+    fingerprinted recursively.
+
+    Args:
+        expr: The expression to fingerprint.
+        dialect: The dialect or name of the dialect to compile for. Defaults
+            to the dialect of the expression if it is an ``ExpressionMatcher``.
+
+    Returns:
+        A hashable fingerprint of the expression.
+
+    Raises:
+        TypeError: If the expression is or contains ``mock.ANY`` or values
+            which are not hashable, as such expressions can only be
+            compared pairwise.
+
+    For example::
+
+        >>> c = column('column')
+        >>> fingerprint(c == 5) == fingerprint(c == 5)
+        True
+        >>> fingerprint(c == 5) == fingerprint(c == 10)
+        False
+        >>> fingerprint(c.label('foo')) == fingerprint(c.label('bar'))
+        True
+        >>> fingerprint([mock.ANY])
+        Traceback (most recent call last):
+        ...
+        TypeError: mock.ANY cannot be fingerprinted
+    """
+    if isinstance(expr, PrettyExpression):
+        if dialect is None:
+            dialect = expr.dialect
+        expr = expr.expr
+
+    if isinstance(expr, type(mock.ANY)):
+        raise TypeError("mock.ANY cannot be fingerprinted")
+
+    if isinstance(expr, ALCHEMY_TYPES):
+        sql, params = compile_cache.compile(expr, dialect)
+        return type(expr), sql, _freeze(params)
+
+    if isinstance(expr, (list, tuple)):
+        items = list(expr)
+        # comparison pads the shorter sequence with None hence
+        # trailing None values do not affect equality
+        while items and items[-1] is None:
+            items.pop()
+        return type(expr), tuple(fingerprint(i, dialect) for i in items)
+
+    if isinstance(expr, Mapping):
+        return type(expr), frozenset(
+            (k, fingerprint(v, dialect)) for k, v in expr.items()
+        )
+
+    hash(expr)
+    return type(expr), expr
+
+
+def _operators(*names: str) -> FrozenSet[Any]:
+    """Gets the operators with any of the given names in this SQLAlchemy."""
+    return frozenset(getattr(operators, i) for i in names if hasattr(operators, i))
+
+
+# operators which always render the same way and never collide
+# with each other in the compiled SQL
+_BINARY_OPERATORS = _operators(
+    "eq",
+    "ne",
+    "lt",
+    "le",
+    "gt",
+    "ge",
+    "is_",
+    "is_not",
+    "isnot",
+    "in_op",
+    "not_in_op",
+    "notin_op",
+    "like_op",
+    "not_like_op",
+    "notlike_op",
+    "ilike_op",
+    "not_ilike_op",
+    "notilike_op",
+    "between_op",
+    "not_between_op",
+    "notbetween_op",
+)
+_UNARY_OPERATORS = _operators("inv") | {None}
+_UNARY_MODIFIERS = _operators(
+    "asc_op",
+    "desc_op",
+    "nulls_first_op",
+    "nullsfirst_op",
+    "nulls_last_op",
+    "nullslast_op",
+) | {None}
+_LIST_OPERATORS = _operators("and_", "or_", "comma_op")
+
+
+def _unannotated(cls: type) -> type:
+    """Gets the class an annotated SQLAlchemy class was derived from."""
+    if issubclass(cls, Annotated):
+        return cls.__bases__[-1]
+    return cls
+
+
+def _structure(expr: Any) -> Optional[Tuple[Any, ...]]:
+    """Gets the structure of an expression made of simple constructs.
+
+    Walks binary and unary expressions, clause lists, groupings, columns
+    and bound parameters into nested tuples of operators, column names and
+    parameter names and values. Two such structures are equal exactly when
+    the expressions compile to the same SQL with the same parameters, which
+    makes comparing them much cheaper than compiling. Labels are skipped
+    since their names are not rendered.
+
+    Args:
+        expr: The SQLAlchemy expression to walk.
+
+    Returns:
+        The structure of the expression or None if it contains constructs
+        which can only be compared by compiling them.
+
+    For example::
+
+        >>> c = column('column')
+        >>> _structure(c.label('foo') == 5) == _structure(c == 5)
+        False
+        >>> _structure(c.label('foo')) == _structure(c.label('bar'))
+        True
+        >>> _structure(func.lower(c) == 'foo') is None
+        True
+    """
+    walk = _STRUCTURES.get(_unannotated(type(expr)))
+    if walk is None:
+        return None
+    return walk(expr)
+
+
+def _binary_structure(expr: Any) -> Optional[Tuple[Any, ...]]:
+    """Gets the structure of a binary expression."""
+    if expr.operator not in _BINARY_OPERATORS:
+        return None
+    left = _structure(expr.left)
+    if left is None:
+        return None
+    right = _structure(expr.right)
+    if right is None:
+        return None
+    modifiers = tuple(sorted(expr.modifiers.items()))
+    return "binary", expr.operator, modifiers, left, right
+
+
+def _unary_structure(expr: Any) -> Optional[Tuple[Any, ...]]:
+    """Gets the structure of a unary expression such as ordering."""
+    if expr.operator not in _UNARY_OPERATORS:
+        return None
+    if expr.modifier not in _UNARY_MODIFIERS:
+        return None
+    element = _structure(expr.element)
+    if element is None:
+        return None
+    return "unary", expr.operator, expr.modifier, element
+
+
+def _clause_list_structure(expr: Any) -> Optional[Tuple[Any, ...]]:
+    """Gets the structure of a clause list such as ``and_`` or ``or_``."""
+    if expr.operator not in _LIST_OPERATORS:
+        return None
+    structure = ["list", expr.operator]
+    for clause in expr.clauses:
+        item = _structure(clause)
+        if item is None:
+            return None
+        if item[0] == "list" and (len(item) == 2 or item[1] is expr.operator):
+            # nested lists with the same operator and empty lists
+            # render the same as if they were flattened
+            structure.extend(item[2:])
+        else:
+            structure.append(item)
+    return tuple(structure)
+
+
+def _grouping_structure(expr: Any) -> Optional[Tuple[Any, ...]]:
+    """Gets the structure of a parenthesized expression."""
+    element = _structure(expr.element)
+    if element is None:
+        return None
+    return "group", element
+
+
+def _label_structure(expr: Any) -> Optional[Tuple[Any, ...]]:
+    """Gets the structure of a label which is that of its element."""
+    return _structure(expr.element)
+
+
+def _column_structure(expr: Any) -> Optional[Tuple[Any, ...]]:
+    """Gets the structure of a column from its name and table."""
+    if expr.is_literal:
+        # literal names are compiled verbatim rather than quoted as needed
+        return None
+    table = expr.table
+    if table is not None:
+        if not isinstance(table, TableClause):
+            return None
+        table = (
+            table.name,
+            getattr(table.name, "quote", None),
+            getattr(table, "schema", None),
+        )
+    name = expr.name
+    return "column", name, getattr(name, "quote", None), table
+
+
+def _bind_structure(expr: Any) -> Optional[Tuple[Any, ...]]:
+    """Gets the structure of a bound parameter from its name and value."""
+    if expr.callable is not None:
+        return None
+    has_bind_expression = getattr(expr.type, "_has_bind_expression", None)
+    if has_bind_expression is None:
+        has_bind_expression = (
+            type(expr.type).bind_expression is not TypeEngine.bind_expression
+        )
+    if has_bind_expression:
+        return None
+    # anonymous names are rendered without their unique id and numbered
+    # i.e. %(1234 column)s is compiled to column_1 which could also be
+    # the name of a named parameter hence those are left to compiling
+    if not isinstance(expr.key, _anonymous_label):
+        return None
+    return (
+        "bind",
+        expr.key.split(" ", 1)[1][:-2],
+        expr.expanding,
+        getattr(expr, "literal_execute", False),
+        expr.value,
+    )
+
+
+def _constant_structure(expr: Any) -> Optional[Tuple[Any, ...]]:
+    """Gets the structure of a constant such as NULL."""
+    return ("constant", _unannotated(type(expr)))
+
+
+_STRUCTURES: Dict[type, Callable[[Any], Optional[Tuple[Any, ...]]]] = {
+    BinaryExpression: _binary_structure,
+    UnaryExpression: _unary_structure,
+    BooleanClauseList: _clause_list_structure,
+    ClauseList: _clause_list_structure,
+    Grouping: _grouping_structure,
+    Label: _label_structure,
+    Column: _column_structure,
+    ColumnClause: _column_structure,
+    BindParameter: _bind_structure,
+    Null: _constant_structure,
+    True_: _constant_structure,
+    False_: _constant_structure,
+}
+if hasattr(elements, "ExpressionClauseList"):
+    _STRUCTURES[elements.ExpressionClauseList] = _clause_list_structure
+
+
+def _same_cache_key(left: Any, right: Any) -> bool:
+    """Checks if two expressions have the same cache key and parameters.
+
+    SQLAlchemy 1.4+ computes cache keys to reuse compiled statements and
+    memoizes them per expression, so expressions with the same cache key
+    and the same bound parameter values compile to the same SQL with the
+    same parameters. Cache keys also include label names, types and ORM
+    annotations which are not rendered, hence different cache keys do not
+    mean the expressions are different.
+
+    Args:
+        left: The first SQLAlchemy expression.
+        right: The second SQLAlchemy expression.
+
+    Returns:
+        True if both expressions have the same cache key and parameters.
+
+    For example::
+
+        >>> c = column('column')
+        >>> _same_cache_key(func.lower(c) == 5, func.lower(c) == 5)
+        True
+        >>> _same_cache_key(func.lower(c) == 5, func.lower(c) == 10)
+        False
+    """
+    left_key = left._generate_cache_key()
+    if left_key is None:
+        return False
+    right_key = right._generate_cache_key()
+    if right_key is None:
+        return False
+    try:
+        if left_key.key != right_key.key:
+            return False
+    except TypeError:
+        # some cache keys contain expressions which cannot be compared
+        return False
+    return [i.effective_value for i in left_key.bindparams] == [
+        i.effective_value for i in right_key.bindparams
+    ]
 
 
 class PrettyExpression(object):
@@ -44,6 +525,8 @@ class PrettyExpression(object):
 
     Attributes:
         expr: Some kind of expression or a PrettyExpression itself.
+        dialect: The dialect or name of the dialect expressions are compiled
+            for or ``None`` for the default dialect.
 
     For example::
 
@@ -54,27 +537,34 @@ class PrettyExpression(object):
         10
         >>> PrettyExpression(PrettyExpression(15))
         15
+        >>> PrettyExpression(c.ilike('foo'), 'postgresql')
+        BinaryExpression(sql='"column" ILIKE %(column_1)s', params={'column_1': 'foo'})
     """
 
-    __slots__ = ["expr"]
+    __slots__ = ["expr", "dialect"]
+    expr: Any
+    dialect: Any
 
-    def __init__(self, e: Any) -> None:
+    def __init__(self, e: Any, dialect: Any = None) -> None:
         """Create a PrettyExpression using an expression."""
         if isinstance(e, PrettyExpression):
+            if dialect is None:
+                dialect = e.dialect
             e = e.expr
         self.expr = e
+        self.dialect = dialect
 
     def __repr__(self) -> str:
         """Get the string representation of a PrettyExpression."""
         if not isinstance(self.expr, ALCHEMY_TYPES):
             return repr(self.expr)
 
-        compiled = self.expr.compile()
+        sql, params = compile_cache.compile(self.expr, self.dialect)
 
         return "{}(sql={!r}, params={!r})".format(
             self.expr.__class__.__name__,
-            match_type(str(compiled).replace("\n", " "), str),
-            {match_type(k, str): v for k, v in compiled.params.items()},
+            match_type(sql.replace("\n", " "), str),
+            {match_type(k, str): v for k, v in params.items()},
         )
 
 
@@ -125,6 +615,24 @@ class ExpressionMatcher(PrettyExpression):
         >>> ExpressionMatcher(l1) == l4
         False
 
+    Expressions are compiled for the default dialect unless a dialect or the
+    name of one is given, so dialect specific constructs compare the same
+    as they are rendered for that dialect::
+
+        >>> r1 = c.regexp_match('foo')
+        >>> r2 = c.regexp_match('foo', flags='i')
+        >>> ExpressionMatcher(r1) == r2
+        True
+        >>> ExpressionMatcher(r1, 'postgresql') == r2
+        False
+
+    Equal expressions have equal hashes so they can be used as dict keys::
+
+        >>> hash(ExpressionMatcher(e1)) == hash(ExpressionMatcher(e2))
+        True
+        >>> {ExpressionMatcher(e1): 'found'}[ExpressionMatcher(e2)]
+        'found'
+
     It also works with nested structures::
 
         >>> ExpressionMatcher([c == 'foo']) == [c == 'foo']
@@ -157,12 +665,16 @@ class ExpressionMatcher(PrettyExpression):
         if equal is not None:
             return equal
 
-        expr_compiled = self.expr.compile()
-        other_compiled = other.compile()
+        equal = self._equals_uncompiled(other)
+        if equal is not None:
+            return equal
+
+        expr_sql, expr_params = compile_cache.compile(self.expr, self.dialect)
+        other_sql, other_params = compile_cache.compile(other, self.dialect)
 
-        if str(expr_compiled) != str(other_compiled):
+        if expr_sql != other_sql:
             return False
-        if expr_compiled.params != other_compiled.params:
+        if expr_params != other_params:
             return False
 
         return True
@@ -172,7 +684,7 @@ class ExpressionMatcher(PrettyExpression):
         if not isinstance(self.expr, ALCHEMY_TYPES):
 
             def _(v: Any) -> Any:
-                return type(self)(v)
+                return type(self)(v, self.dialect)
 
             if isinstance(self.expr, (list, tuple)):
                 return all(
@@ -188,6 +700,25 @@ class ExpressionMatcher(PrettyExpression):
             else:
                 return self.expr is other or self.expr == other
 
+    def _equals_uncompiled(self, other: Any) -> Optional[bool]:
+        """Compares ALCHEMY_TYPES for equality without compiling them."""
+        # simple expressions are compared by walking them and only
+        # expressions with other constructs have to be compiled
+        structure = _structure(self.expr)
+        if structure is not None:
+            other_structure = _structure(other)
+            if other_structure is not None:
+                return structure == other_structure
+
+        if _HAS_CACHE_KEYS and _same_cache_key(self.expr, other):
+            return True
+
+        return None
+
     def __ne__(self, other: Any) -> bool:
         """Compares an expression to determine inequality."""
         return not (self == other)
+
+    def __hash__(self) -> int:
+        """Hashes the expression consistently with its equality."""
+        return hash(fingerprint(self.expr, self.dialect))
@@ -0,0 +1,823 @@
+"""A module for evaluating SQLAlchemy criteria against mocked objects."""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import heapq
+import operator
+import re
+import threading
+from collections import OrderedDict
+from functools import total_ordering
+from itertools import islice
+from operator import attrgetter
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import CompileError
+from sqlalchemy.exc import NoInspectionAvailable
+from sqlalchemy.orm.exc import UnmappedColumnError
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.sql.elements import BooleanClauseList
+from sqlalchemy.sql.elements import ClauseList
+from sqlalchemy.sql.elements import ColumnClause
+from sqlalchemy.sql.elements import False_
+from sqlalchemy.sql.elements import Grouping
+from sqlalchemy.sql.elements import Null
+from sqlalchemy.sql.elements import True_
+from sqlalchemy.sql.elements import UnaryExpression
+
+from .comparison import CacheInfo
+from .comparison import fingerprint
+
+Predicate = Callable[[Any], bool]
+# criteria evaluated in three-valued logic with None as the unknown value
+Condition = Callable[[Any], Optional[bool]]
+Getter = Callable[[Any], Any]
+SortKey = Callable[[Any], Tuple[Any, ...]]
+
+_COMPARISONS = {
+    operators.eq: operator.eq,
+    operators.ne: operator.ne,
+    operators.lt: operator.lt,
+    operators.le: operator.le,
+    operators.gt: operator.gt,
+    operators.ge: operator.ge,
+}
+# operators were renamed in SQLAlchemy 1.4
+_IS_NOT = getattr(operators, "is_not", None) or operators.isnot
+_NOT_IN = getattr(operators, "not_in_op", None) or operators.notin_op
+_LIKE = {operators.like_op: 0, operators.ilike_op: re.IGNORECASE}
+# operators were renamed in SQLAlchemy 1.4
+_NULLS_FIRST = getattr(operators, "nulls_first_op", None) or operators.nullsfirst_op
+_NULLS_LAST = getattr(operators, "nulls_last_op", None) or operators.nullslast_op
+
+# criteria methods of a query and whether they take keyword arguments
+CRITERIA = {"filter": False, "where": False, "filter_by": True}
+
+
+class UnsupportedExpressionError(Exception):
+    """Raised when an expression cannot be evaluated in Python."""
+
+
+class PredicateCache(object):
+    """Bounded cache of compiled predicates.
+
+    Compiling a predicate walks the expression tree and resolves its columns
+    to model attributes once so that evaluating it against objects only
+    costs plain function calls. Predicates are cached per model and
+    expression fingerprint, hence equal expressions built anew for every
+    query are compiled only once. Expressions which cannot be evaluated are
+    cached as well.
+    The cache is guarded by a lock so that it can be shared by threads.
+
+    Attributes:
+        compiler: The function compiling an expression for a model.
+        maxsize: The maximum number of predicates to keep compiled.
+        hits: The number of lookups answered from the cache.
+        misses: The number of lookups which required compiling, by all
+            threads.
+
+    For example::
+
+        >>> from sqlalchemy import Column, Integer
+        >>> from sqlalchemy.ext.declarative import declarative_base
+
+        >>> Base = declarative_base()
+
+        >>> class Model(Base):
+        ...     __tablename__ = 'model_table'
+        ...     pk1 = Column(Integer, primary_key=True)
+
+        >>> cache = PredicateCache()
+        >>> predicate = cache.compile(Model.pk1 > 1, Model)
+        >>> predicate(Model(pk1=1)), predicate(Model(pk1=2))
+        (False, True)
+        >>> cache.compile(Model.pk1 > 1, Model) is predicate
+        True
+        >>> cache.info()
+        CacheInfo(hits=1, misses=1, maxsize=4096, currsize=1)
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 4096,
+        compiler: Optional[Callable[[Any, Any], Any]] = None,
+    ) -> None:
+        """Creates an empty PredicateCache."""
+        self.compiler = compiler or compile_predicate
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[Hashable, Optional[Getter]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def compile(self, expr: Any, model: Any) -> Optional[Getter]:
+        """Compiles an expression into a predicate or gets it from the cache.
+
+        Args:
+            expr: The SQLAlchemy criteria expression.
+            model: The SQLAlchemy model the predicate is evaluated against.
+
+        Returns:
+            A function telling whether an object satisfies the expression or
+            ``None`` if the expression cannot be evaluated.
+        """
+        try:
+            key: Optional[Hashable] = (model, fingerprint(expr))
+        except TypeError:
+            key = None
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            self.misses += 1
+        self._local.misses = self.thread_misses() + 1
+
+        try:
+            predicate: Optional[Getter] = self.compiler(expr, model)
+        except UnsupportedExpressionError:
+            predicate = None
+        if key is not None:
+            with self._lock:
+                self._cache[key] = predicate
+                if len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        return predicate
+
+    def thread_misses(self) -> int:
+        """Gets the number of lookups of the current thread which required compiling.
+
+        Unlike ``misses``, the count is kept per thread and is never reset,
+        hence the compiles caused by an operation are the difference of the
+        counts before and after it, whichever threads use the cache meanwhile.
+
+        Returns:
+            The number of misses of the current thread.
+        """
+        misses: int = getattr(self._local, "misses", 0)
+        return misses
+
+    def info(self) -> CacheInfo:
+        """Gets the hit and miss statistics of the cache."""
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._cache))
+
+    def clear(self) -> None:
+        """Empties the cache and resets its statistics."""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def compile_predicate(expr: Any, model: Any) -> Predicate:
+    """Compiles a SQLAlchemy criteria expression into a Python predicate.
+
+    Supports comparisons, ``IS``, ``IN`` and ``LIKE`` of mapped columns
+    with literal values or other mapped columns, combined with ``and_``,
+    ``or_`` and ``not_``. Same as in SQL, comparisons involving ``NULL``
+    are unknown rather than false, which ``not_`` keeps unknown, and only
+    objects for which the criteria are true are matched.
+
+    Args:
+        expr: The SQLAlchemy criteria expression.
+        model: The SQLAlchemy model the predicate is evaluated against.
+
+    Returns:
+        A function telling whether an object satisfies the expression.
+
+    Raises:
+        UnsupportedExpressionError: If the expression cannot be evaluated in
+            Python, e.g. because it uses SQL functions or columns which
+            are not mapped by the model.
+
+    For example::
+
+        >>> from sqlalchemy import Column, Integer, String, or_
+        >>> from sqlalchemy.ext.declarative import declarative_base
+
+        >>> Base = declarative_base()
+
+        >>> class Model(Base):
+        ...     __tablename__ = 'model_table'
+        ...     pk1 = Column(Integer, primary_key=True)
+        ...     name = Column(String)
+
+        >>> predicate = compile_predicate(
+        ...     or_(Model.pk1.in_([1, 2]), Model.name.like('f%')), Model
+        ... )
+        >>> predicate(Model(pk1=2)), predicate(Model(pk1=3, name='foo'))
+        (True, True)
+        >>> predicate(Model(pk1=3, name='bar'))
+        False
+        >>> compile_predicate(~(Model.name == 'foo'), Model)(Model(pk1=3))
+        False
+    """
+    try:
+        mapper = inspect(model).mapper
+    except (NoInspectionAvailable, AttributeError) as e:
+        raise UnsupportedExpressionError(
+            "{!r} is not a mapped class".format(model)
+        ) from e
+    condition = _compile(expr, mapper)
+    return lambda row: condition(row) is True
+
+
+def compile_sort_key(exprs: Sequence[Any], model: Any) -> SortKey:
+    """Compiles the expressions of an ``order_by`` call into a sort key.
+
+    Supports mapped columns optionally modified by ``asc``, ``desc``,
+    ``nulls_first`` and ``nulls_last``. Same as in PostgreSQL, ``NULL``
+    values sort last in ascending and first in descending order unless
+    specified otherwise.
+
+    Args:
+        exprs: The SQLAlchemy ordering expressions.
+        model: The SQLAlchemy model whose objects are sorted.
+
+    Returns:
+        A function getting the key an object is sorted by.
+
+    Raises:
+        UnsupportedExpressionError: If the expressions cannot be evaluated
+            in Python, e.g. because they are labels or SQL functions.
+
+    For example::
+
+        >>> from sqlalchemy import Column, Integer, String
+        >>> from sqlalchemy.ext.declarative import declarative_base
+
+        >>> Base = declarative_base()
+
+        >>> class Model(Base):
+        ...     __tablename__ = 'model_table'
+        ...     pk1 = Column(Integer, primary_key=True)
+        ...     name = Column(String)
+
+        >>> rows = [Model(pk1=1, name='b'), Model(pk1=2), Model(pk1=3, name='b')]
+        >>> key = compile_sort_key((Model.name, Model.pk1.desc()), Model)
+        >>> [i.pk1 for i in sorted(rows, key=key)]
+        [3, 1, 2]
+    """
+    try:
+        mapper = inspect(model).mapper
+    except (NoInspectionAvailable, AttributeError) as e:
+        raise UnsupportedExpressionError(
+            "{!r} is not a mapped class".format(model)
+        ) from e
+    columns = [_sort_column(i, mapper) for i in exprs]
+
+    def key(row: Any) -> Tuple[Any, ...]:
+        values: List[Tuple[Any, ...]] = []
+        for getter, descending, nulls in columns:
+            value = getter(row)
+            if value is None:
+                values.append((nulls,))
+            else:
+                values.append((0, _Descending(value) if descending else value))
+        return tuple(values)
+
+    return key
+
+
+predicate_cache = PredicateCache()
+sort_key_cache = PredicateCache(compiler=compile_sort_key)
+
+
+def chain_predicate(model: Any, calls: Sequence[Any]) -> Optional[Predicate]:
+    """Combines the criteria of a chain of query calls into one predicate.
+
+    Args:
+        model: The SQLAlchemy model the predicate is evaluated against.
+        calls: The calls of the query chain, of which only ``filter``,
+            ``where`` and ``filter_by`` calls are considered.
+
+    Returns:
+        A predicate satisfied by objects matching all criteria or ``None``
+        if there are no criteria or any of them cannot be evaluated.
+    """
+    predicates = []
+    for name, args, kwargs in calls:
+        if name not in CRITERIA:
+            continue
+        if CRITERIA[name]:
+            try:
+                predicates.extend(_compile_filter_by(kwargs, model))
+            except UnsupportedExpressionError:
+                return None
+        for i in args:
+            predicate = predicate_cache.compile(i, model)
+            if predicate is None:
+                return None
+            predicates.append(predicate)
+
+    if not predicates:
+        return None
+    if len(predicates) == 1:
+        return predicates[0]
+    return lambda row: all(p(row) for p in predicates)
+
+
+def chain_equalities(model: Any, calls: Sequence[Any]) -> List[Tuple[str, Any]]:
+    """Gets the attribute values required by the criteria of query calls.
+
+    Finds the criteria comparing a mapped column for equality with a
+    hashable literal value, also within ``and_``, which can be looked up
+    in a hash index of the objects.
+
+    Args:
+        model: The SQLAlchemy model the criteria are evaluated against.
+        calls: The calls of the query chain.
+
+    Returns:
+        A list of attribute names and the values they are required to equal.
+
+    For example::
+
+        >>> from sqlalchemy import Column, Integer, String, and_
+        >>> from sqlalchemy.ext.declarative import declarative_base
+
+        >>> Base = declarative_base()
+
+        >>> class Model(Base):
+        ...     __tablename__ = 'model_table'
+        ...     pk1 = Column(Integer, primary_key=True)
+        ...     name = Column(String)
+
+        >>> chain_equalities(Model, [
+        ...     ('filter', (and_(Model.pk1 == 1, Model.name > 'a'),), {}),
+        ...     ('filter_by', (), {'name': 'b'}),
+        ... ])
+        [('pk1', 1), ('name', 'b')]
+    """
+    try:
+        mapper = inspect(model).mapper
+    except (NoInspectionAvailable, AttributeError):
+        return []
+    equalities: List[Tuple[str, Any]] = []
+    for name, args, kwargs in calls:
+        if name not in CRITERIA:
+            continue
+        if CRITERIA[name]:
+            equalities.extend(
+                (k, v) for k, v in kwargs.items() if v is not None and _hashable(v)
+            )
+        for i in args:
+            equalities.extend(_equalities(i, mapper))
+    return equalities
+
+
+def chain_sort_key(model: Any, calls: Sequence[Any]) -> Optional[SortKey]:
+    """Gets the sort key of the ``order_by`` calls of a query chain.
+
+    Args:
+        model: The SQLAlchemy model whose objects are sorted.
+        calls: The calls of the query chain.
+
+    Returns:
+        A function getting the key an object is sorted by or ``None`` if
+        the query is not ordered or its ordering cannot be evaluated.
+    """
+    exprs = chain_order_by(calls)
+    if not exprs:
+        return None
+    return sort_key_cache.compile(exprs, model)
+
+
+def chain_order_by(calls: Sequence[Any]) -> Tuple[Any, ...]:
+    """Gets the ordering expressions of the ``order_by`` calls of a query chain.
+
+    Args:
+        calls: The calls of the query chain.
+
+    Returns:
+        The expressions the query is ordered by, empty if it is not ordered.
+
+    For example::
+
+        >>> chain_order_by([
+        ...     ('order_by', ('a', 'b'), {}),
+        ...     ('order_by', (None, 'c'), {}),
+        ... ])
+        ('c',)
+    """
+    exprs: List[Any] = []
+    for name, args, _kwargs in calls:
+        if name != "order_by":
+            continue
+        for i in args:
+            # order_by(None) cancels the ordering so far
+            if i is None:
+                del exprs[:]
+            else:
+                exprs.append(i)
+    return tuple(exprs)
+
+
+def chain_slice(calls: Sequence[Any]) -> Tuple[int, Optional[int]]:
+    """Gets the offset and limit of a query chain.
+
+    Args:
+        calls: The calls of the query chain, of which the last arguments of
+            ``offset`` and ``limit`` calls are considered.
+
+    Returns:
+        The number of rows to skip and the maximum number of rows to return
+        or ``None`` if the number of rows is not limited.
+
+    For example::
+
+        >>> chain_slice([('offset', (5,), {}), ('limit', (10, 2), {})])
+        (5, 2)
+    """
+    offset, limit = 0, None
+    for name, args, _kwargs in calls:
+        if name not in ("offset", "limit") or not args:
+            continue
+        value = args[-1]
+        if value is not None and not isinstance(value, int):
+            continue
+        if name == "offset":
+            offset = value or 0
+        else:
+            limit = value
+    return offset, limit
+
+
+def iter_rows(
+    rows: Iterable[Any],
+    predicate: Optional[Predicate] = None,
+    key: Optional[SortKey] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+) -> Iterator[Any]:
+    """Filters, sorts and slices rows the way a database would.
+
+    Rows are filtered lazily, hence only as many rows as consumed are
+    evaluated when the rows are not sorted. Sorted and limited rows are
+    selected with a heap instead of sorting all of them.
+
+    Args:
+        rows: The rows to select from.
+        predicate: The predicate rows have to satisfy.
+        key: The key to sort rows by.
+        offset: The number of rows to skip.
+        limit: The maximum number of rows to return.
+
+    Returns:
+        An iterator over the selected rows.
+
+    For example::
+
+        >>> rows = iter_rows(range(10**9), lambda i: i % 2, offset=1)
+        >>> next(rows), next(rows)
+        (3, 5)
+    """
+    if predicate is not None:
+        rows = filter(predicate, rows)
+    if key is not None:
+        if limit is None:
+            rows = sorted(rows, key=key)
+        else:
+            rows = heapq.nsmallest(offset + limit, rows, key=key)
+    if offset or limit is not None:
+        rows = islice(rows, offset, None if limit is None else offset + limit)
+    return iter(rows)
+
+
+def select_rows(
+    rows: Iterable[Any],
+    predicate: Optional[Predicate] = None,
+    key: Optional[SortKey] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+) -> List[Any]:
+    """Filters, sorts and slices rows into a list as done by ``iter_rows``.
+
+    Args:
+        rows: The rows to select from.
+        predicate: The predicate rows have to satisfy.
+        key: The key to sort rows by.
+        offset: The number of rows to skip.
+        limit: The maximum number of rows to return.
+
+    Returns:
+        A list of the selected rows.
+
+    For example::
+
+        >>> select_rows(range(10), lambda i: i % 2, key=lambda i: -i, offset=1, limit=2)
+        [7, 5]
+    """
+    return list(iter_rows(rows, predicate, key, offset, limit))
+
+
+def statement_calls(
+    stmt: Any,
+) -> Optional[List[Tuple[str, Tuple[Any, ...], Dict[str, Any]]]]:
+    """Translates an ORM ``select`` of a single model into query calls.
+
+    Args:
+        stmt: The statement given to ``execute``.
+
+    Returns:
+        The names, arguments and keyword arguments of the ``query``,
+        ``filter``, ``order_by``, ``limit`` and ``offset`` calls building
+        the same query or ``None`` if the statement does not select a model.
+
+    For example::
+
+        >>> from sqlalchemy import Column, Integer, select
+        >>> from sqlalchemy.ext.declarative import declarative_base
+
+        >>> Base = declarative_base()
+
+        >>> class Model(Base):
+        ...     __tablename__ = 'model_table'
+        ...     pk1 = Column(Integer, primary_key=True)
+
+        >>> [i[0] for i in statement_calls(select(Model).where(Model.pk1 > 1))]
+        ['query', 'filter']
+        >>> statement_calls(select(Model.pk1)) is None
+        True
+    """
+    descriptions = getattr(stmt, "column_descriptions", None)
+    if not isinstance(descriptions, list) or len(descriptions) != 1:
+        return None
+    entity = descriptions[0].get("entity")
+    if entity is None or descriptions[0].get("expr") is not entity:
+        return None
+    calls: List[Tuple[str, Tuple[Any, ...], Dict[str, Any]]] = [
+        ("query", (entity,), {})
+    ]
+    if stmt.whereclause is not None:
+        calls.append(("filter", (stmt.whereclause,), {}))
+    if stmt._order_by_clauses:
+        calls.append(("order_by", tuple(stmt._order_by_clauses), {}))
+    for name in ("limit", "offset"):
+        try:
+            value = getattr(stmt, "_" + name)
+        except CompileError:
+            # not a literal integer
+            continue
+        if value is not None:
+            calls.append((name, (value,), {}))
+    return calls
+
+
+def _equalities(expr: Any, mapper: Any) -> List[Tuple[str, Any]]:
+    """Gets the column equalities of a boolean expression."""
+    if isinstance(expr, Grouping):
+        return _equalities(expr.element, mapper)
+    if isinstance(expr, (BooleanClauseList, ClauseList)):
+        if expr.operator is not operators.and_:
+            return []
+        return [j for i in expr.clauses for j in _equalities(i, mapper)]
+    if not isinstance(expr, BinaryExpression) or expr.operator is not operators.eq:
+        return []
+    column, value = expr.left, expr.right
+    if not isinstance(column, ColumnClause):
+        column, value = value, column
+    if not isinstance(column, ColumnClause) or not isinstance(value, BindParameter):
+        return []
+    try:
+        key = mapper.get_property_by_column(column).key
+    except UnmappedColumnError:
+        return []
+    effective = value.effective_value
+    if effective is None or not _hashable(effective):
+        return []
+    return [(key, effective)]
+
+
+def _hashable(value: Any) -> bool:
+    """Checks whether a value can be looked up in a hash index."""
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _compile_filter_by(kwargs: Any, model: Any) -> List[Predicate]:
+    """Compiles ``filter_by`` keyword arguments into predicates."""
+    try:
+        attrs = inspect(model).mapper.column_attrs
+    except (NoInspectionAvailable, AttributeError) as e:
+        raise UnsupportedExpressionError(
+            "{!r} is not a mapped class".format(model)
+        ) from e
+    predicates: List[Predicate] = []
+    for key, value in kwargs.items():
+        if key not in attrs:
+            raise UnsupportedExpressionError("{} is not a mapped column".format(key))
+        predicates.append(_equals(attrgetter(key), value))
+    return predicates
+
+
+def _equals(getter: Getter, value: Any) -> Predicate:
+    """Compiles a ``filter_by`` comparison of an attribute into a predicate."""
+    if value is None:
+        return lambda row: getter(row) is None
+    return lambda row: bool(getter(row) == value)
+
+
+def _compile(expr: Any, mapper: Any) -> Condition:
+    """Compiles a boolean expression into a three-valued condition."""
+    if isinstance(expr, Grouping):
+        return _compile(expr.element, mapper)
+
+    if isinstance(expr, (True_, False_)):
+        value = isinstance(expr, True_)
+        return lambda row: value
+
+    # not a ClauseList since SQLAlchemy 2.0
+    if isinstance(expr, (BooleanClauseList, ClauseList)) and (
+        expr.operator is operators.and_ or expr.operator is operators.or_
+    ):
+        # the value deciding the conjunction regardless of the other clauses
+        decisive = expr.operator is operators.or_
+        clauses = [_compile(i, mapper) for i in expr.clauses]
+        return lambda row: _conjunction(clauses, row, decisive)
+
+    if isinstance(expr, UnaryExpression) and expr.operator is operators.inv:
+        inner = _compile(expr.element, mapper)
+
+        def negated(row: Any) -> Optional[bool]:
+            value = inner(row)
+            return None if value is None else not value
+
+        return negated
+
+    if isinstance(expr, BinaryExpression):
+        return _compile_binary(expr, mapper)
+
+    raise UnsupportedExpressionError("{!r} cannot be evaluated".format(expr))
+
+
+def _conjunction(clauses: List[Condition], row: Any, decisive: bool) -> Optional[bool]:
+    """Evaluates ``AND`` or ``OR`` of conditions in three-valued logic."""
+    result: Optional[bool] = not decisive
+    for condition in clauses:
+        value = condition(row)
+        if value is decisive:
+            return decisive
+        if value is None:
+            result = None
+    return result
+
+
+def _compile_binary(expr: Any, mapper: Any) -> Condition:
+    """Compiles a comparison into a three-valued condition."""
+    op = expr.operator
+    left = _operand(expr.left, mapper)
+
+    if op in _COMPARISONS:
+        compare = _COMPARISONS[op]
+        right = _operand(expr.right, mapper)
+
+        def condition(row: Any) -> Optional[bool]:
+            a, b = left(row), right(row)
+            if a is None or b is None:
+                return None
+            return bool(compare(a, b))
+
+        return condition
+
+    if op is operators.is_ or op is _IS_NOT:
+        right = _operand(expr.right, mapper)
+        if op is _IS_NOT:
+            return lambda row: bool(left(row) != right(row))
+        return lambda row: bool(left(row) == right(row))
+
+    if op is operators.in_op or op is _NOT_IN:
+        values = _values(expr.right)
+        found = op is operators.in_op
+        return _nullable(left, lambda value: (value in values) is found)
+
+    if op in _LIKE:
+        escape = (expr.modifiers or {}).get("escape")
+        pattern = _like(_values(expr.right), _LIKE[op], escape)
+        # other values are matched as text same as SQLite and MySQL cast them
+        return _nullable(left, lambda value: bool(pattern.match(_text(value))))
+
+    raise UnsupportedExpressionError("{!r} cannot be evaluated".format(op))
+
+
+def _nullable(left: Getter, test: Predicate) -> Condition:
+    """Makes a condition on an operand unknown when the operand is ``NULL``."""
+
+    def condition(row: Any) -> Optional[bool]:
+        value = left(row)
+        return None if value is None else test(value)
+
+    return condition
+
+
+def _text(value: Any) -> str:
+    """Gets a value matched by ``LIKE`` as text."""
+    return value if isinstance(value, str) else str(value)
+
+
+def _operand(expr: Any, mapper: Any) -> Getter:
+    """Compiles a column or a literal into a function getting its value."""
+    if isinstance(expr, Grouping):
+        return _operand(expr.element, mapper)
+    if isinstance(expr, ColumnClause):
+        try:
+            key = mapper.get_property_by_column(expr).key
+        except UnmappedColumnError as e:
+            raise UnsupportedExpressionError("{!r} is not mapped".format(expr)) from e
+        return attrgetter(key)
+    value = _values(expr)
+    return lambda row: value
+
+
+def _values(expr: Any) -> Any:
+    """Gets the literal value of a bound parameter or a list of them."""
+    if isinstance(expr, Grouping):
+        return _values(expr.element)
+    if isinstance(expr, BindParameter):
+        value = expr.effective_value
+        return tuple(value) if isinstance(value, (list, tuple)) else value
+    if isinstance(expr, Null):
+        return None
+    if isinstance(expr, (True_, False_)):
+        return isinstance(expr, True_)
+    if isinstance(expr, ClauseList):
+        return tuple(_values(i) for i in expr.clauses)
+    raise UnsupportedExpressionError("{!r} is not a literal".format(expr))
+
+
+@total_ordering
+class _Descending(object):
+    """Wrapper reversing the order of a value within sort keys."""
+
+    __slots__ = ["value"]
+
+    def __init__(self, value: Any) -> None:
+        """Wraps a value."""
+        self.value = value
+
+    def __eq__(self, other: Any) -> bool:
+        """Compares the wrapped values for equality."""
+        return bool(self.value == other.value)
+
+    def __lt__(self, other: Any) -> bool:
+        """Orders greater wrapped values first."""
+        return bool(other.value < self.value)
+
+
+def _sort_column(expr: Any, mapper: Any) -> Tuple[Getter, bool, int]:
+    """Compiles an ordering expression into a getter, direction and nulls rank."""
+    nulls = None
+    if isinstance(expr, UnaryExpression) and expr.modifier in (
+        _NULLS_FIRST,
+        _NULLS_LAST,
+    ):
+        nulls = -1 if expr.modifier is _NULLS_FIRST else 1
+        expr = expr.element
+    descending = False
+    if isinstance(expr, UnaryExpression) and expr.modifier in (
+        operators.asc_op,
+        operators.desc_op,
+    ):
+        descending = expr.modifier is operators.desc_op
+        expr = expr.element
+    if hasattr(expr, "__clause_element__"):
+        expr = expr.__clause_element__()
+    if not isinstance(expr, ColumnClause):
+        raise UnsupportedExpressionError("{!r} cannot be sorted by".format(expr))
+    if nulls is None:
+        nulls = -1 if descending else 1
+    return _operand(expr, mapper), descending, nulls
+
+
+def _like(pattern: str, flags: int, escape: Optional[str] = None) -> Any:
+    """Converts a SQL ``LIKE`` pattern and its escape character into a regex."""
+    parts: List[str] = []
+    chars = iter(pattern)
+    for i in chars:
+        if i == escape:
+            escaped = next(chars, None)
+            if escaped is None:
+                raise UnsupportedExpressionError(
+                    "{!r} ends with its escape character".format(pattern)
+                )
+            parts.append(re.escape(escaped))
+        else:
+            parts.append(".*" if i == "%" else "." if i == "_" else re.escape(i))
+    return re.compile("".join(parts) + r"\Z", flags | re.DOTALL)
@@ -3,40 +3,81 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import asyncio
+import pickle  # noqa: S403
+import threading
+from collections import Counter
+from collections import deque
 from functools import partial
+from functools import wraps
 from itertools import chain
-from itertools import takewhile
+from itertools import islice
 from typing import Any
 from typing import Callable
+from typing import Collection
+from typing import Deque
 from typing import Dict
+from typing import Hashable
+from typing import Iterable
 from typing import Iterator
 from typing import List
+from typing import MutableSequence
 from typing import Optional
 from typing import Sequence
 from typing import Set
+from typing import Tuple
+from typing import Type
 from typing import overload
 from unittest import mock
 
+from sqlalchemy import inspect
 from sqlalchemy.orm.exc import MultipleResultsFound
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.orm.state import InstanceState
 
 from .comparison import ExpressionMatcher
+from .comparison import compile_cache
+from .comparison import fingerprint
+from .evaluation import chain_equalities
+from .evaluation import chain_order_by
+from .evaluation import chain_predicate
+from .evaluation import chain_slice
+from .evaluation import chain_sort_key
+from .evaluation import iter_rows
+from .evaluation import predicate_cache
+from .evaluation import statement_calls
+from .store import DataEntry
+from .store import DataStore
+from .utils import Stats
 from .utils import build_identity_map
+from .utils import build_objects
 from .utils import copy_and_update
+from .utils import gc_paused
 from .utils import get_item_attr
 from .utils import get_scalar
-from .utils import indexof
+from .utils import iter_chunks
 from .utils import raiser
 from .utils import setattr_tmp
 
-Call = type(mock.call)
+Call = mock._Call
+
+
+def _fingerprint_or_none(value: Any) -> Optional[Hashable]:
+    """Gets the fingerprint of a value or ``None`` if it has none."""
+    try:
+        return fingerprint(value)
+    except TypeError:
+        return None
 
 
 class UnorderedTuple(tuple):
     """Same as tuple except in comparison order does not matter.
 
-    A tuple in which order does not matter for equality. It compares
-    by remove elements from the other tuple.
+    A tuple in which order does not matter for equality. Elements of both
+    tuples are grouped by their fingerprints so that equal elements are
+    paired up in linear time. Only elements which cannot be fingerprinted,
+    or are left without a pair, are compared by removing them from the
+    other tuple one by one.
 
     For example::
 
@@ -49,10 +90,27 @@ class UnorderedTuple(tuple):
         if len(self) != len(other):
             return False
 
-        other = list(other)
+        buckets: Dict[Hashable, List[Any]] = {}
+        leftovers = []
         for i in self:
+            key = _fingerprint_or_none(i)
+            if key is None:
+                leftovers.append(i)
+            else:
+                buckets.setdefault(key, []).append(i)
+
+        unpaired = []
+        for i in other:
+            bucket = buckets.get(_fingerprint_or_none(i))
+            if bucket:
+                bucket.pop()
+            else:
+                unpaired.append(i)
+
+        leftovers.extend(chain.from_iterable(buckets.values()))
+        for i in leftovers:
             try:
-                other.remove(i)
+                unpaired.remove(i)
             except ValueError:
                 return False
 
@@ -75,19 +133,342 @@ class UnorderedCall(Call):
         True
     """
 
-    def __eq__(self, other: Call) -> bool:
+    def __eq__(self, other: object) -> bool:
         """Compares another call for equality."""
-        _other = list(other)
-        _other[-2] = UnorderedTuple(other[-2])
-        other = Call(
-            tuple(_other),
-            **{k.replace("_mock_", ""): v for k, v in vars(other).items()},
-        )
+        if not isinstance(other, tuple) or len(other) < 2:
+            return super(UnorderedCall, self).__eq__(other)
+
+        # same check as in Call.__eq__ which is skipped for the plain tuple below
+        self_parent = getattr(self, "_mock_parent", None)
+        other_parent = getattr(other, "_mock_parent", None)
+        if self_parent and other_parent and self_parent != other_parent:
+            return False
+
+        _other = tuple(other)
+        other = _other[:-2] + (UnorderedTuple(_other[-2]), _other[-1])
 
         return super(UnorderedCall, self).__eq__(other)
 
 
-def sqlalchemy_call(call: Call, with_name: bool = False, base_call: Any = Call) -> Any:
+class BoundedCallList(Deque[Any]):
+    """A call list which only keeps the most recent calls.
+
+    Used as a ring buffer for ``mock_calls``, ``method_calls`` and
+    ``call_args_list`` of mocks with a bounded call history, as well as for
+    call records which are asserted on. Once more than ``maxlen`` calls are
+    recorded the oldest calls are evicted in constant time. An ``observer``
+    can be given which is called with every recorded call. The calls
+    compare equal to lists of the same calls and, same as the call lists
+    of mocks, contain the lists of calls they recorded consecutively.
+
+    Once asserted on, the calls are also kept wrapped by ``sqlalchemy_call``
+    along with their fingerprints and are updated as calls are recorded or
+    evicted. Hence every call is wrapped and fingerprinted only once no
+    matter how many assertions are made against the history.
+
+    For example::
+
+        >>> calls = BoundedCallList(maxlen=2)
+        >>> calls.extend([mock.call.query(1), mock.call.filter(2)])
+        >>> calls.append(mock.call.all())
+        >>> calls
+        [call.filter(2), call.all()]
+        >>> expected = [mock.call(2), mock.call()]
+        >>> calls.has_calls([sqlalchemy_call(i) for i in expected])
+        True
+        >>> calls.has_calls([sqlalchemy_call(mock.call(1))])
+        False
+    """
+
+    def __init__(
+        self,
+        iterable: Iterable[Any] = (),
+        maxlen: Optional[int] = None,
+        observer: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        """Creates a BoundedCallList from the most recent of the given calls."""
+        super(BoundedCallList, self).__init__((), maxlen)
+        self.observer = observer
+        self._wrapped: Optional[BoundedCallList] = None
+        self._wrapped_dialect: Any = None
+        self._fingerprints: Deque[Optional[Hashable]] = deque(maxlen=maxlen)
+        self._fingerprint_counts: "Counter[Optional[Hashable]]" = Counter()
+        self.extend(iterable)
+
+    def __eq__(self, other: object) -> bool:
+        """Compares the calls with a list or deque of calls."""
+        if not isinstance(other, (list, deque)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other: object) -> bool:
+        """Compares the calls with a list or deque of calls for inequality."""
+        return not self == other
+
+    def __contains__(self, value: object) -> bool:
+        """Checks for a call or for a list of consecutively recorded calls."""
+        return value in mock._CallList(self)
+
+    def __getitem__(self, index: Any) -> Any:
+        """Gets a call or a list of calls by their positions."""
+        if isinstance(index, slice):
+            return mock._CallList(list(self)[index])
+        return super(BoundedCallList, self).__getitem__(index)
+
+    def __repr__(self) -> str:
+        """Gets the calls formatted the same as a call list."""
+        return repr(mock._CallList(self))
+
+    def append(self, value: Any) -> None:
+        """Records a call evicting the oldest call if needed."""
+        wrapped = self._wrapped
+        if wrapped is not None and self._fingerprints and len(self) == self.maxlen:
+            # the fingerprint of the evicted call leaves the counts
+            self._fingerprint_counts[self._fingerprints[0]] -= 1
+        super(BoundedCallList, self).append(value)
+        if self.observer is not None:
+            self.observer(value)
+        if wrapped is not None:
+            self._wrap(wrapped, value)
+
+    def extend(self, values: Iterable[Any]) -> None:
+        """Records several calls evicting the oldest calls if needed."""
+        for i in values:
+            self.append(i)
+
+    def remove_at(self, index: int) -> None:
+        """Removes the call at a position along with its wrapped version.
+
+        Args:
+            index: The position of the call, negative from the most recent.
+        """
+        wrapped = self._wrapped
+        synced = wrapped is not None and len(wrapped) == len(self)
+        del self[index]
+        if wrapped is not None and synced:
+            del wrapped[index]
+            self._fingerprint_counts[self._fingerprints[index]] -= 1
+            del self._fingerprints[index]
+
+    def wrapped(self, dialect: Any = None) -> "BoundedCallList":
+        """Gets the calls wrapped by ``sqlalchemy_call`` for comparison.
+
+        Args:
+            dialect: The dialect or name of the dialect to compare for.
+
+        Returns:
+            The wrapped calls in the same order as the recorded calls.
+        """
+        wrapped = self._wrapped
+        if (
+            wrapped is None
+            or len(wrapped) != len(self)
+            or self._wrapped_dialect is not dialect
+        ):
+            # calls are wrapped from the first assertion on so that mocks
+            # which are never asserted on do not pay for it
+            self._wrapped = wrapped = BoundedCallList(maxlen=self.maxlen)
+            self._wrapped_dialect = dialect
+            self._fingerprints = deque(maxlen=self.maxlen)
+            self._fingerprint_counts = Counter()
+            for i in self:
+                self._wrap(wrapped, i)
+        return wrapped
+
+    def has_calls(
+        self, calls: Sequence[Call], dialect: Any = None, any_order: bool = False
+    ) -> bool:
+        """Tells whether the calls certainly contain the given wrapped calls.
+
+        Compares fingerprints instead of comparing the given calls with
+        every recorded call. The calls are contained if they were recorded
+        consecutively or, with ``any_order``, recorded at all. When calls
+        cannot be fingerprinted, e.g. as they contain ``mock.ANY``, they
+        are not certainly contained and have to be compared one by one.
+
+        Args:
+            calls: The calls wrapped by ``sqlalchemy_call`` to look for.
+            dialect: The dialect or name of the dialect to compare for.
+            any_order: Whether the calls may have been recorded in any order.
+
+        Returns:
+            True if the calls are contained, False if they may not be.
+        """
+        try:
+            expected = [_wrapped_fingerprint(i) for i in calls]
+        except TypeError:
+            return False
+        self.wrapped(dialect)
+        if any_order:
+            counts = self._fingerprint_counts
+            return all(counts[k] >= v for k, v in Counter(expected).items())
+        if not expected:
+            return True
+        fingerprints = list(self._fingerprints)
+        start = 0
+        while True:
+            try:
+                start = fingerprints.index(expected[0], start)
+            except ValueError:
+                return False
+            end = start + len(expected)
+            if fingerprints[start:end] == expected:
+                return True
+            start += 1
+
+    def _wrap(self, wrapped_calls: "BoundedCallList", call: Call) -> None:
+        """Wraps and fingerprints a recorded call."""
+        wrapped = sqlalchemy_call(call, dialect=self._wrapped_dialect)
+        try:
+            fingerprint = _wrapped_fingerprint(wrapped)
+        except TypeError:
+            fingerprint = None
+        wrapped_calls.append(wrapped)
+        self._fingerprints.append(fingerprint)
+        self._fingerprint_counts[fingerprint] += 1
+
+
+class QueryChain(object):
+    """The calls of the query a session is currently building.
+
+    Tracks the calls of a session since the end of its previous query so
+    that they do not have to be found again by scanning the call history.
+    A chain is opened by the first call after the previous chain ended,
+    typically ``query`` or ``execute``, and is ended by any call named in
+    ``enders``. The calls of an ended chain stay available until the next
+    call is recorded so that the ending call can look up its data.
+
+    Calls are kept in the order they were made and are also indexed by
+    name so that merging a call into the previous call of the same name,
+    as done when unifying, does not depend on the length of the chain or
+    of the call history.
+
+    Calls named in ``fetchers`` end a chain as well but keep an ended chain
+    along with its ``cursor``, the iterator over the rows of its result, so
+    that consecutive fetches continue where the previous one stopped.
+
+    For example::
+
+        >>> chain = QueryChain(enders={'all'})
+        >>> for i in [mock.call.query(1), mock.call.filter(2), mock.call.filter(3)]:
+        ...     chain.record(i)
+        >>> chain.merge('filter')
+        (call.filter(2), call.filter(3))
+        >>> chain.record(mock.call.filter(2, 3))
+        >>> chain.record(mock.call.all())
+        >>> chain.calls
+        [call.query(1), call.filter(2, 3)]
+        >>> chain.record(mock.call.query(4))
+        >>> chain.calls
+        [call.query(4)]
+    """
+
+    def __init__(self, enders: Collection[str], fetchers: Collection[str] = ()) -> None:
+        """Creates an empty QueryChain ended by the given call names."""
+        self.enders = enders
+        self.fetchers = fetchers
+        self.ended = False
+        self.cursor: Optional[Iterator[Any]] = None
+        self._calls: Dict[int, Call] = {}
+        self._names: Dict[str, List[int]] = {}
+        self._count = 0
+
+    def __len__(self) -> int:
+        """Gets the number of calls in the chain."""
+        return len(self._calls)
+
+    @property
+    def calls(self) -> List[Call]:
+        """Gets the calls of the chain in the order they were made."""
+        return list(self._calls.values())
+
+    def record(self, call: Call) -> None:
+        """Adds a call to the chain starting a new chain if the last one ended.
+
+        Args:
+            call: The call as recorded in ``mock_calls`` of the session.
+        """
+        name = call[0]
+        if self.ended and name in self.fetchers:
+            return
+        if self.ended:
+            self.ended = False
+            self.cursor = None
+            self._calls = {}
+            self._names = {}
+        if name in self.enders or name in self.fetchers:
+            self.ended = True
+            return
+        self._count += 1
+        self._calls[self._count] = call
+        self._names.setdefault(name, []).append(self._count)
+
+    def merge(self, name: str) -> Optional[Tuple[Call, Call]]:
+        """Removes the last two calls of the given name to be merged.
+
+        Args:
+            name: The name of the calls to merge.
+
+        Returns:
+            The previous and the last call of the given name or ``None``
+            if the chain has less than two calls of the given name.
+        """
+        keys = self._names.get(name)
+        if not keys or len(keys) < 2:
+            return None
+        current = self._calls.pop(keys.pop())
+        previous = self._calls.pop(keys.pop())
+        return previous, current
+
+
+def _remove_call(calls: "MutableSequence[Call]", kwargs: Dict[str, Any]) -> None:
+    """Removes a call by identity of its kwargs searching from the most recent."""
+    for i in range(len(calls) - 1, -1, -1):
+        if calls[i][-1] is kwargs:
+            if isinstance(calls, BoundedCallList):
+                calls.remove_at(i)
+            else:
+                del calls[i]
+            return
+
+
+def _timed(method: Callable[..., Any]) -> Callable[..., Any]:
+    """Collects the stats of a session method if the session collects stats."""
+
+    @wraps(method)
+    def timed(self: Any, *args: Any, **kwargs: Any) -> Any:
+        stats = self._mock_stats
+        if stats is None:
+            return method(self, *args, **kwargs)
+        # caches are shared by all sessions, hence only the misses of the
+        # calling thread, which runs the whole operation, are counted
+        compiles = compile_cache.thread_misses()
+        predicates = predicate_cache.thread_misses()
+        try:
+            with stats.timed(kwargs["_mock_name"]):
+                return method(self, *args, **kwargs)
+        finally:
+            compiles = compile_cache.thread_misses() - compiles
+            predicates = predicate_cache.thread_misses() - predicates
+            stats.counts["compiles"] += compiles
+            stats.counts["predicate_compiles"] += predicates
+
+    return timed
+
+
+def _current_owner() -> Tuple[int, Any]:
+    """Gets the thread and the asyncio task running the current code."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        # no running event loop
+        task = None
+    return threading.get_ident(), task
+
+
+def sqlalchemy_call(
+    call: Call, with_name: bool = False, base_call: Any = Call, dialect: Any = None
+) -> Any:
     """Convert ``mock.call()`` into call.
 
     Convert ``mock.call()`` into call with all parameters
@@ -98,6 +479,7 @@ def sqlalchemy_call(call: Call, with_name: bool = False, base_call: Any = Call)
         call: The call to convert.
         with_name: Whether to convert the name of the call.
         base_call: The type of call to convert into.
+        dialect: The dialect or name of the dialect to compare for.
 
     Returns:
         Returns the converted call of the type ``base_call``.
@@ -117,8 +499,8 @@ def sqlalchemy_call(call: Call, with_name: bool = False, base_call: Any = Call)
     else:
         name = ""
 
-    args = tuple([ExpressionMatcher(i) for i in args])
-    kwargs = {k: ExpressionMatcher(v) for k, v in kwargs.items()}
+    args = tuple([ExpressionMatcher(i, dialect) for i in args])
+    kwargs = {k: ExpressionMatcher(v, dialect) for k, v in kwargs.items()}
 
     if with_name:
         return base_call((name, args, kwargs))
@@ -126,11 +508,64 @@ def sqlalchemy_call(call: Call, with_name: bool = False, base_call: Any = Call)
         return base_call((args, kwargs), two=True)
 
 
+def call_fingerprint(call: Tuple[Any, ...]) -> Hashable:
+    """Gets the fingerprint of a call converted by ``sqlalchemy_call``.
+
+    Computes a hashable value which is equal for two converted calls exactly
+    when they compare equal. Arguments of an ``UnorderedCall`` are
+    fingerprinted as a multiset so that their order does not matter.
+    Same as ``fingerprint``, a ``TypeError`` is raised when any argument of
+    the call cannot be fingerprinted.
+
+    Args:
+        call: The converted call to fingerprint including its name.
+
+    Returns:
+        A hashable fingerprint of the call.
+
+    For example::
+
+        >>> from sqlalchemy.sql.expression import column
+        >>> c = column('column')
+        >>> a = sqlalchemy_call(
+        ...     mock.call.filter(c == 1, c == 2), with_name=True,
+        ...     base_call=UnorderedCall,
+        ... )
+        >>> b = sqlalchemy_call(
+        ...     mock.call.filter(c == 2, c == 1), with_name=True,
+        ...     base_call=UnorderedCall,
+        ... )
+        >>> call_fingerprint(a) == call_fingerprint(b)
+        True
+    """
+    name, args, kwargs = call
+    args = tuple(fingerprint(i) for i in args)
+    if isinstance(call, UnorderedCall):
+        args = frozenset(Counter(args).items())
+    return name, args, frozenset((k, fingerprint(v)) for k, v in kwargs.items())
+
+
+def _wrapped_fingerprint(call: Call) -> Hashable:
+    """Gets the fingerprint of a call converted without its name."""
+    args, kwargs = call[-2:]
+    return call_fingerprint(("", args, kwargs))
+
+
 class AlchemyMagicMock(mock.MagicMock):
     """Compares SQLAlchemy expressions for simple asserts.
 
     MagicMock for SQLAlchemy which can compare alchemys expressions in assertions.
 
+    The call history can be bounded by ``max_history`` in which case
+    ``mock_calls``, ``method_calls`` and ``call_args_list`` of the mock and of
+    all its children only keep the most recent calls. Call counts are not
+    bounded and are aggregated per method by ``call_counts``.
+
+    Expressions are compiled for the default dialect to be compared unless
+    a ``dialect``, or the name of one such as ``postgresql``, is given.
+    Dialect specific constructs are then compared as they are rendered for
+    that dialect and compiled once per dialect.
+
     For example::
 
         >>> from sqlalchemy import or_
@@ -154,6 +589,26 @@ class AlchemyMagicMock(mock.MagicMock):
         params={'column_1': 10}))
         Actual: filter(BinaryExpression(sql='"column" = :column_1', \
         params={'column_1': 5}))
+
+        >>> s = AlchemyMagicMock(max_history=2)
+        >>> for i in range(1000):
+        ...     _ = s.filter(c == i)
+        >>> len(s.mock_calls), len(s.filter.call_args_list)
+        (2, 2)
+        >>> _ = s.filter.assert_called_with(c == 999)
+        >>> s.call_counts
+        Counter({'filter': 1000})
+
+        >>> s = AlchemyMagicMock(dialect='postgresql')
+        >>> _ = s.filter(c.regexp_match('foo', flags='i'))
+        >>> s.filter.assert_called_with(c.regexp_match('foo'))
+        Traceback (most recent call last):
+        ...
+        AssertionError: expected call not found.
+        Expected: filter(BinaryExpression(sql='"column" ~ %(column_1)s', \
+        params={'column_1': 'foo'}))
+        Actual: filter(BinaryExpression(sql='"column" ~* %(column_1)s', \
+        params={'column_1': 'foo'}))
     """
 
     @overload
@@ -176,39 +631,124 @@ class AlchemyMagicMock(mock.MagicMock):
     def __init__(self, *args, **kwargs) -> None:
         """Creates AlchemyMagicMock that can be used as limited SQLAlchemy session."""
         kwargs.setdefault("__name__", "Session")
+        self.__dict__["_mock_max_history"] = kwargs.pop("max_history", None)
+        self.__dict__["_mock_dialect"] = kwargs.pop("dialect", None)
         super(AlchemyMagicMock, self).__init__(*args, **kwargs)
+        self._reset_history()
+
+    @property
+    def call_counts(self) -> "Counter[str]":
+        """Gets the number of calls of every method of the mock.
+
+        Counts are collected from the children of the mock as named in
+        ``method_calls`` and, unlike the call history, are never bounded.
+
+        Returns:
+            A counter of the number of calls by method name.
+        """
+        counts: "Counter[str]" = Counter()
+        seen = {id(self)}
+        stack: List[Tuple[str, mock.NonCallableMock]] = [("", self)]
+        while stack:
+            prefix, parent = stack.pop()
+            children = list(parent._mock_children.items())
+            if isinstance(parent._mock_return_value, mock.NonCallableMock):
+                children.append(("()", parent._mock_return_value))
+            for name, child in children:
+                if not isinstance(child, mock.NonCallableMock) or id(child) in seen:
+                    continue
+                seen.add(id(child))
+                if name != "()" and prefix:
+                    name = prefix + "." + name
+                else:
+                    name = prefix + name
+                if child.call_count:
+                    counts[name] = child.call_count
+                stack.append((name, child))
+        return counts
+
+    def reset_mock(self, *args: Any, **kwargs: Any) -> None:
+        """Resets all call records keeping the call history bounded."""
+        super(AlchemyMagicMock, self).reset_mock(*args, **kwargs)
+        self._reset_history()
+
+    def _reset_history(self) -> None:
+        """Replaces call records with ring buffers if the history is bounded."""
+        max_history = self._mock_max_history
+        if max_history is not None:
+            # call records are declared as plain call lists by the stubs of mock
+            bounded: Type[Any] = BoundedCallList
+            self.call_args_list = bounded(maxlen=max_history)
+            self.method_calls = bounded(maxlen=max_history)
+            self.mock_calls = bounded(maxlen=max_history)
+
+    def _get_child_mock(self, **kwargs: Any) -> mock.NonCallableMock:
+        """Creates child mocks with the same bound and dialect."""
+        child = super(AlchemyMagicMock, self)._get_child_mock(**kwargs)
+        if not isinstance(child, AlchemyMagicMock):
+            return child
+        child.__dict__["_mock_dialect"] = self._mock_dialect
+        max_history = self._mock_max_history
+        if max_history is not None:
+            child.__dict__["_mock_max_history"] = max_history
+            child._reset_history()
+        return child
 
     def _format_mock_call_signature(self, args: Any, kwargs: Any) -> str:
         """Formats the mock call into a string."""
         name = self._mock_name or "mock"
-        args, kwargs = sqlalchemy_call(mock.call(*args, **kwargs))
+        args, kwargs = sqlalchemy_call(
+            mock.call(*args, **kwargs), dialect=self._mock_dialect
+        )
         return mock._format_call_signature(name, args, kwargs)
 
     def assert_called_with(self, *args: Any, **kwargs: Any) -> None:
         """Assert for a specific call to have happened."""
-        args, kwargs = sqlalchemy_call(mock.call(*args, **kwargs))
+        args, kwargs = sqlalchemy_call(
+            mock.call(*args, **kwargs), dialect=self._mock_dialect
+        )
         return super(AlchemyMagicMock, self).assert_called_with(*args, **kwargs)
 
     def assert_any_call(self, *args: Any, **kwargs: Any) -> None:
         """Assert for a specific call to have happened."""
-        args, kwargs = sqlalchemy_call(mock.call(*args, **kwargs))
-        with setattr_tmp(
-            self,
-            "call_args_list",
-            [sqlalchemy_call(i) for i in self.call_args_list],
-        ):
+        dialect = self._mock_dialect
+        expected = sqlalchemy_call(mock.call(*args, **kwargs), dialect=dialect)
+        history = self._history("call_args_list")
+        if self._spec_class is None and history.has_calls([expected], dialect):
+            return None
+        args, kwargs = expected
+        with setattr_tmp(self, "call_args_list", history.wrapped(dialect)):
             return super(AlchemyMagicMock, self).assert_any_call(*args, **kwargs)
 
     def assert_has_calls(self, calls: List[Call], any_order: bool = False) -> None:
         """Assert for a list of calls to have happened."""
-        calls = [sqlalchemy_call(i) for i in calls]
-        with setattr_tmp(
-            self,
-            "mock_calls",
-            type(self.mock_calls)([sqlalchemy_call(i) for i in self.mock_calls]),
-        ):
+        dialect = self._mock_dialect
+        calls = [sqlalchemy_call(i, dialect=dialect) for i in calls]
+        history = self._history("mock_calls")
+        if self._spec_class is None and history.has_calls(calls, dialect, any_order):
+            return None
+        with setattr_tmp(self, "mock_calls", history.wrapped(dialect)):
             return super(AlchemyMagicMock, self).assert_has_calls(calls, any_order)
 
+    def _history(self, name: str) -> BoundedCallList:
+        """Gets the recorded calls with the given name to assert on.
+
+        Unbounded call records are plain lists until they are first asserted
+        on so that recording calls stays cheap for mocks which never are.
+        From then on the calls are kept wrapped as they are recorded.
+
+        Args:
+            name: The name of the call records such as ``mock_calls``.
+
+        Returns:
+            The call records which keep their calls wrapped.
+        """
+        calls = getattr(self, name)
+        if not isinstance(calls, BoundedCallList):
+            calls = BoundedCallList(calls)
+            setattr(self, name, calls)
+        return calls
+
 
 class UnifiedAlchemyMagicMock(AlchemyMagicMock):
     """A MagicMock that combines SQLALchemy to mock a session.
@@ -219,6 +759,9 @@ class UnifiedAlchemyMagicMock(AlchemyMagicMock):
         boundary: A dict of SQLAlchemy functions or statements that get
             or retreive data from calls. This dictionary has values
             that are the callable functions to process the function calls.
+        stream: The names of boundary functions which get the rows lazily.
+        fetch: The names of boundary functions which consume the rows of
+            a result lazily, continuing where the previous fetch stopped.
         unify: A dict of SQLAlchemy functions or statements that are to
             unifying expressions together. This dictionary has values
             that are the callable functions to process the function calls. Note
@@ -226,7 +769,9 @@ class UnifiedAlchemyMagicMock(AlchemyMagicMock):
             Check out the examples for this class for more detail about this
             limitation.
         mutate: A set of operations that mutate data. The currently supported
-            operations include ``.delete()``, ``.add()``, and ``.add_all()``.
+            operations include ``.delete()``, ``.add()``, ``.add_all()``,
+            ``.bulk_save_objects()``, ``.bulk_insert_mappings()`` and
+            ``.bulk_update_mappings()``.
             More operations are planned and this is a future area of work.
 
     For example::
@@ -249,8 +794,10 @@ class UnifiedAlchemyMagicMock(AlchemyMagicMock):
     can be returned depending on query/filter/options criteria.
     Data is given as a list of ``(criteria, result)`` tuples where ``criteria``
     is a list of calls.
-    Reason for passing data as a list vs a dict is that calls and SQLAlchemy
-    expressions are not hashable hence cannot be dict keys.
+    Reason for passing data as a list vs a dict is that criteria are lists
+    of calls which are not hashable hence cannot be dict keys. Internally
+    the criteria are indexed by their fingerprints once when data is given
+    or mutated so that lookups do not compare against every entry.
 
     For example::
 
@@ -350,6 +897,10 @@ class UnifiedAlchemyMagicMock(AlchemyMagicMock):
         >>> s.query(SomeClass).get((3, 3))
         >>> s.query(SomeClass).filter(c == 'one').all()
         [1, 2, 4]
+        >>> s.query(SomeClass).filter(SomeClass.pk1 > 1).all()
+        [2, 4]
+        >>> s.query(SomeClass).filter_by(pk2=2).all()
+        [2]
         >>> s.query(SomeClass).get((4, 3))
         4
         >>> s.query(SomeClass).get({"pk2": 3, "pk1": 4})
@@ -420,12 +971,58 @@ class UnifiedAlchemyMagicMock(AlchemyMagicMock):
         >>> s.query(SomeClass).scalar()
         None
 
+    Criteria of ``filter``, ``where`` and ``filter_by`` are evaluated
+    against objects added with ``add`` or ``add_all``, also when deleting
+    them, as long as all criteria only use mapped columns of the queried model.
+    Otherwise all added objects are returned. Criteria are never evaluated
+    against mocked data.
+
+    Equality criteria on columns given in ``indexes``, e.g.
+    ``indexes=[SomeClass.name]``, are answered by hash indexes of the added
+    objects instead of scanning all of them. With ``auto_index=N`` a column
+    is also indexed once it was filtered on for equality ``N`` times.
+
+    For example::
+
+        >>> s = UnifiedAlchemyMagicMock(indexes=[SomeClass.name])
+        >>> s.add_all([SomeClass(pk1=i, pk2=i, name=str(i % 3)) for i in range(9)])
+        >>> s.query(SomeClass).filter(SomeClass.name == '1').all()
+        [1, 4, 7]
+        >>> s.query(SomeClass).filter_by(name='2').filter(SomeClass.pk1 > 3).all()
+        [5, 8]
+
+    Likewise ``order_by``, ``offset`` and ``limit`` are applied to added
+    objects if the ordering only uses mapped columns of the queried model.
+    Otherwise the objects are neither ordered nor sliced. Limited ordered
+    queries only select the top rows instead of sorting all of them.
+
+    For example::
+
+        >>> q = s.query(SomeClass).order_by(SomeClass.name.desc(), SomeClass.pk1)
+        >>> q.offset(1).limit(3).all()
+        [5, 8, 1]
+
+    Iterating a query or fetching the rows of a result with ``fetchone``,
+    ``fetchmany`` or ``partitions`` produces the rows lazily, so that
+    streaming large results does not copy all of them.
+
+    For example::
+
+        >>> q = s.query(SomeClass).filter(SomeClass.pk1 > 2).yield_per(2)
+        >>> next(q.partitions(2))
+        [3, 4]
+        >>> s.fetchmany(3)
+        [5, 6, 7]
+
     Also note that only within same query functions are unified.
     After ``.all()`` is called or query is iterated over, future queries
-    are not unified.
+    are not unified. Queries are tracked per thread and per asyncio task,
+    hence queries built concurrently on one session are never unified
+    with each other. The data of a session may likewise be queried and
+    changed by several threads at once.
     """
 
-    boundary: Dict[str, Callable] = {
+    boundary: Dict[str, Callable[..., Any]] = {
         "all": lambda x: x,
         "__iter__": lambda x: iter(x),
         "count": lambda x: len(x),
@@ -450,11 +1047,18 @@ class UnifiedAlchemyMagicMock(AlchemyMagicMock):
         "get": lambda x, idmap: get_item_attr(build_identity_map(x), idmap),
         "scalar": lambda x: get_scalar(x),
         "update": lambda x, *args, **kwargs: None,
+        "fetchall": lambda x: list(x),
+        "fetchmany": lambda x, size=None: list(islice(x, size or 1)),
+        "fetchone": lambda x: next(x, None),
+        "partitions": lambda x, size=None: iter_chunks(x, size or 1000),
     }
-    unify: Dict[str, Optional[UnorderedCall]] = {
+    stream: Set[str] = {"__iter__", "first"}
+    fetch: Set[str] = {"fetchall", "fetchmany", "fetchone", "partitions"}
+    unify: Dict[str, Optional[Type[UnorderedCall]]] = {
         "add_columns": None,
         "distinct": None,
         "execute": None,
+        "execution_options": None,
         "filter": UnorderedCall,
         "filter_by": UnorderedCall,
         "group_by": None,
@@ -466,9 +1070,17 @@ class UnifiedAlchemyMagicMock(AlchemyMagicMock):
         "query": None,
         "scalars": None,
         "where": None,
+        "yield_per": None,
     }
 
-    mutate: Set[str] = {"add", "add_all", "delete"}
+    mutate: Set[str] = {
+        "add",
+        "add_all",
+        "bulk_insert_mappings",
+        "bulk_save_objects",
+        "bulk_update_mappings",
+        "delete",
+    }
 
     @overload
     def __init__(
@@ -490,51 +1102,321 @@ class UnifiedAlchemyMagicMock(AlchemyMagicMock):
     def __init__(self, *args, **kwargs) -> None:
         """Creates an UnifiedAlchemyMagicMock to mock a SQLAlchemy session."""
         kwargs["_mock_default"] = kwargs.pop("default", [])
-        kwargs["_mock_data"] = kwargs.pop("data", None)
+        data = kwargs.pop("data", None)
+        indexes = kwargs.pop("indexes", ())
+        auto_index = kwargs.pop("auto_index", None)
+        stats = kwargs.pop("stats", False)
+        max_history = kwargs.get("max_history")
+        if max_history is not None and max_history < 2:
+            raise ValueError("max_history must be at least 2 to unify calls")
+        dialect = kwargs.get("dialect")
+        # magic methods are looked up on the type rather than created through
+        # __getattr__ hence they cannot be created lazily
         kwargs.update(
             {
-                k: AlchemyMagicMock(side_effect=partial(self._get_data, _mock_name=k))
-                for k in self.boundary
+                k: self._create_submock(k, max_history=max_history, dialect=dialect)
+                for k in chain(self.boundary, self.unify, self.mutate)
+                if k.startswith("__") and k.endswith("__")
             }
         )
 
-        kwargs.update(
-            {
-                k: AlchemyMagicMock(
-                    return_value=self,
-                    side_effect=partial(self._unify, _mock_name=k),
-                )
-                for k in self.unify
-            }
-        )
+        super(UnifiedAlchemyMagicMock, self).__init__(*args, **kwargs)
 
-        kwargs.update(
+        self._mock_stats = Stats() if stats else None
+        self._set_store(DataStore())
+        for calls, result in data or []:
+            self._mock_store.append(calls, *self._normalize_calls(calls), result)
+
+        self._mock_auto_index = auto_index
+        self._mock_indexed: Dict[Any, Set[str]] = {}
+        self._mock_filter_counts: "Counter[Tuple[Any, str]]" = Counter()
+        for i in indexes:
+            self._mock_indexed.setdefault(i.class_, set()).add(i.key)
+
+    def fork(self) -> "UnifiedAlchemyMagicMock":
+        """Creates an independent session from this session.
+
+        The new session starts with an empty call history and shares the
+        already indexed data of this session copy-on-write. Hence a session
+        prepared once with a lot of data can be cheaply forked for every test
+        while mutations such as ``add`` or ``delete`` in one fork never leak
+        into another fork or into the original session.
+
+        Returns:
+            A new session with the same data as this session.
+
+        For example::
+
+            >>> from sqlalchemy import Column, Integer
+            >>> from sqlalchemy.ext.declarative import declarative_base
+
+            >>> Base = declarative_base()
+
+            >>> class Model(Base):
+            ...     __tablename__ = 'model_table'
+            ...     pk1 = Column(Integer, primary_key=True)
+            ...     def __repr__(self):
+            ...         return str(self.pk1)
+
+            >>> prototype = UnifiedAlchemyMagicMock(data=[
+            ...     ([mock.call.query(Model)], [Model(pk1=1)]),
+            ... ])
+            >>> session = prototype.fork()
+            >>> session.add(Model(pk1=2))
+            >>> session.query(Model).all()
+            [1, 2]
+            >>> prototype.query(Model).all()
+            [1]
+            >>> session.query(Model).delete()
+            2
+            >>> prototype.fork().query(Model).all()
+            [1]
+        """
+        # NonCallableMock gives every instance its own subclass of the mock class
+        session: UnifiedAlchemyMagicMock = type(self).__bases__[0](
+            default=self._mock_default,
+            max_history=self._mock_max_history,
+            auto_index=self._mock_auto_index,
+            stats=self._mock_stats is not None,
+            dialect=self._mock_dialect,
+        )
+        session._set_store(self._mock_store.fork())
+        session._mock_indexed = {k: set(v) for k, v in self._mock_indexed.items()}
+        session._mock_filter_counts = self._mock_filter_counts.copy()
+        return session
+
+    def snapshot(self) -> bytes:
+        """Serializes the data of this session along with its index.
+
+        Unlike the session, which cannot be pickled, a snapshot can be sent
+        to other processes, e.g. pytest-xdist workers, or put in shared
+        memory. Since the criteria are stored already fingerprinted,
+        ``from_snapshot`` restores a ready session without comparing or
+        compiling any SQLAlchemy expression. The models of the data have to
+        be importable by the process restoring the session.
+
+        Returns:
+            The pickled data and settings of this session.
+
+        For example::
+
+            >>> session = UnifiedAlchemyMagicMock(data=[
+            ...     ([mock.call.query('foo')], [1, 2]),
+            ...     ([mock.call.query('foo'), mock.call.limit(1)], [1]),
+            ... ])
+            >>> snapshot = session.snapshot()
+            >>> restored = UnifiedAlchemyMagicMock.from_snapshot(snapshot)
+            >>> restored.query('foo').all()
+            [1, 2]
+            >>> restored.query('foo').limit(1).all()
+            [1]
+        """
+        return pickle.dumps(
             {
-                k: AlchemyMagicMock(
-                    return_value=None,
-                    side_effect=partial(self._mutate_data, _mock_name=k),
-                )
-                for k in self.mutate
-            }
+                "store": self._mock_store,
+                "default": self._mock_default,
+                "max_history": self._mock_max_history,
+                "auto_index": self._mock_auto_index,
+                "indexed": self._mock_indexed,
+                "filter_counts": self._mock_filter_counts,
+                "stats": self._mock_stats is not None,
+                "dialect": self._mock_dialect,
+            },
+            pickle.HIGHEST_PROTOCOL,
         )
 
-        super(UnifiedAlchemyMagicMock, self).__init__(*args, **kwargs)
-
-    def _get_previous_calls(self, calls: Sequence[Call]) -> Iterator:
-        """Gets the previous calls on the same line."""
-        # the calls that end lines
-        call_enders = list(self.boundary.keys()) + ["delete"]
-        return iter(takewhile(lambda i: i[0] not in call_enders, reversed(calls)))
-
-    def _get_previous_call(self, name: str, calls: Sequence[Call]) -> Optional[Call]:
-        """Gets the previous call right before the current call."""
-        # get all previous session calls within same session query
-        previous_calls = self._get_previous_calls(calls)
-
-        # skip last call
-        next(previous_calls)
+    @classmethod
+    def from_snapshot(
+        cls: Type["UnifiedAlchemyMagicMock"], snapshot: bytes
+    ) -> "UnifiedAlchemyMagicMock":
+        """Creates a session from the snapshot of another session.
+
+        Args:
+            snapshot: The snapshot as given by ``snapshot``.
+
+        Returns:
+            A new session with the data of the snapshotted session.
+        """
+        state = pickle.loads(snapshot)  # noqa: S301
+        session = cls(
+            default=state["default"],
+            max_history=state["max_history"],
+            auto_index=state["auto_index"],
+            stats=state["stats"],
+            dialect=state["dialect"],
+        )
+        session._set_store(state["store"])
+        session._mock_indexed = state["indexed"]
+        session._mock_filter_counts = state["filter_counts"]
+        return session
+
+    def stats(self, reset: bool = False) -> Stats:
+        """Gets the counters and timings collected by this session.
+
+        Stats are only collected by sessions created with ``stats=True`` so
+        that other sessions do not pay for them. Every session method which
+        is unified, looks up data or mutates data is counted and timed by
+        its name. Along with them, the following events are counted:
+
+        * ``compiles``: SQLAlchemy expressions compiled to be compared.
+        * ``predicate_compiles``: criteria compiled to filter added objects.
+        * ``entries_examined``: data entries examined to look up queries.
+        * ``merges``: calls merged into a previous call when unifying.
+        * ``identity_map_builds``: identity maps built from scratch by ``get``.
+
+        Compiled expressions are cached for all sessions, hence compiles
+        are counted by the session which compiled an expression first.
+
+        Args:
+            reset: Whether to start collecting again from zero.
+
+        Returns:
+            A copy of the stats collected so far, empty if the session does
+            not collect stats.
+
+        For example::
+
+            >>> from sqlalchemy.sql.expression import column
+            >>> c = column('column')
+
+            >>> s = UnifiedAlchemyMagicMock(stats=True, data=[
+            ...     ([mock.call.query('foo')], [1, 2]),
+            ... ])
+            >>> s.query('foo').filter(c == 1).filter(c == 2).all()
+            [1, 2]
+            >>> stats = s.stats()
+            >>> stats.counts['filter'], stats.counts['merges']
+            (2, 1)
+            >>> stats.counts['entries_examined']
+            1
+            >>> stats.timings['all'] > 0
+            True
+        """
+        stats = self._mock_stats
+        if stats is None:
+            return Stats()
+        copied = stats.copy()
+        if reset:
+            stats.counts.clear()
+            stats.timings.clear()
+        return copied
+
+    def _set_store(self, store: DataStore) -> None:
+        """Uses a data store counting its lookups in the stats of the session."""
+        if self._mock_stats is not None:
+            store.stats = self._mock_stats.counts
+        self._mock_store = store
+
+    def _get_child_mock(self, **kwargs: Any) -> mock.NonCallableMock:
+        """Creates boundary, unify and mutate submocks on first access."""
+        submock = self._create_submock(
+            kwargs.get("_new_name"),
+            max_history=self._mock_max_history,
+            dialect=self._mock_dialect,
+            **kwargs,
+        )
+        if submock is not None:
+            return submock
+        return super(UnifiedAlchemyMagicMock, self)._get_child_mock(**kwargs)
+
+    def _reset_history(self) -> None:
+        """Resets the call records along with the query chain."""
+        super(UnifiedAlchemyMagicMock, self)._reset_history()
+        chains = self.__dict__.get("_mock_chains")
+        if chains is None:
+            self.__dict__["_mock_chains_lock"] = threading.Lock()
+            self.__dict__["_mock_chains"] = {}
+        else:
+            with self._mock_chains_lock:
+                chains.clear()
+        # call records are declared as plain call lists by the stubs of mock
+        bounded: Type[Any] = BoundedCallList
+        self.mock_calls = bounded(
+            maxlen=self._mock_max_history,
+            observer=self._record_call,
+        )
 
-        return next(iter(filter(lambda i: i[0] == name, previous_calls)), None)
+    @property
+    def _mock_chain(self) -> QueryChain:
+        """Gets the query chain of the current thread or asyncio task.
+
+        Chains are kept by the session per thread and task so that queries
+        built at the same time by different threads or tasks are tracked
+        separately, and are freed along with the session. Chains of threads
+        and tasks which have finished are dropped whenever a new chain is
+        opened.
+
+        Returns:
+            The query chain of the caller.
+        """
+        owner = _current_owner()
+        thread = threading.current_thread()
+        chains: Dict[Tuple[int, Any], Tuple[threading.Thread, QueryChain]]
+        chains = self._mock_chains
+        entry = chains.get(owner)
+        # thread idents are reused hence the thread itself is checked too
+        if entry is not None and entry[0] is thread:
+            return entry[1]
+        with self._mock_chains_lock:
+            alive = {i.ident for i in threading.enumerate()}
+            for key in list(chains):
+                ident, task = key
+                if ident not in alive or (task is not None and task.done()):
+                    del chains[key]
+            chain = QueryChain(self._get_call_enders(), self.fetch)
+            chains[owner] = thread, chain
+        return chain
+
+    def _record_call(self, call: Call) -> None:
+        """Records a call of the session in the query chain of its caller."""
+        self._mock_chain.record(call)
+
+    def _get_call_enders(self) -> Set[str]:
+        """Gets the names of the calls that end query chains."""
+        return set(self.boundary) | self.mutate
+
+    def _create_submock(
+        self, method: Optional[str], **kwargs: Any
+    ) -> Optional[AlchemyMagicMock]:
+        """Creates the submock for a boundary, unify or mutate method."""
+        if method in self.boundary:
+            return AlchemyMagicMock(
+                side_effect=partial(self._get_data, _mock_name=method), **kwargs
+            )
+        if method in self.unify:
+            return AlchemyMagicMock(
+                return_value=self,
+                side_effect=partial(self._unify, _mock_name=method),
+                **kwargs,
+            )
+        if method in self.mutate:
+            return AlchemyMagicMock(
+                return_value=None,
+                side_effect=partial(self._mutate_data, _mock_name=method),
+                **kwargs,
+            )
+        return None
+
+    def _normalize_calls(
+        self, calls: Sequence[Call]
+    ) -> Tuple[List[Call], List[Optional[Hashable]]]:
+        """Converts calls for SQLAlchemy comparison and fingerprints them."""
+        wrapped = [
+            sqlalchemy_call(
+                i,
+                with_name=True,
+                base_call=self.unify.get(i[0]) or Call,
+                dialect=self._mock_dialect,
+            )
+            for i in calls
+        ]
+        fingerprints = []
+        for i in wrapped:
+            try:
+                fingerprints.append(call_fingerprint(i))
+            except TypeError:
+                fingerprints.append(None)
+        return wrapped, fingerprints
 
     @overload
     def _unify(
@@ -547,32 +1429,30 @@ class UnifiedAlchemyMagicMock(AlchemyMagicMock):
     ) -> None:
         ...  # pragma: no cover
 
+    @_timed
     def _unify(self, *args, **kwargs) -> Any:
         """Unify the SQLAlchemy expressions."""
         _mock_name = kwargs.pop("_mock_name")
         submock = getattr(self, _mock_name)
 
-        previous_method_call = self._get_previous_call(_mock_name, self.method_calls)
-        previous_mock_call = self._get_previous_call(_mock_name, self.mock_calls)
-
-        if previous_mock_call is None:
+        merged = self._mock_chain.merge(_mock_name)
+        if merged is None:
             return submock.return_value
+        previous_call, current_call = merged
+        if self._mock_stats is not None:
+            self._mock_stats.counts["merges"] += 1
 
         # remove immediate call from both filter mock as well as the parent mock object
         # as it already registered in self.__call__ before this side-effect is call
+        # calls are found by identity as other threads may have made calls since
         submock.call_count -= 1
-        submock.call_args_list.pop()
-        submock.mock_calls.pop()
-        self.method_calls.pop()
-        self.mock_calls.pop()
-
-        # remove previous call since we will be inserting new call instead
-        submock.call_args_list.pop()
-        submock.mock_calls.pop()
-        self.method_calls.pop(indexof(previous_method_call, self.method_calls))
-        self.mock_calls.pop(indexof(previous_mock_call, self.mock_calls))
-
-        name, pargs, pkwargs = previous_method_call
+        name, pargs, pkwargs = previous_call
+        for i in (current_call[-1], pkwargs):
+            _remove_call(submock.call_args_list, i)
+            _remove_call(submock.mock_calls, i)
+            _remove_call(self.method_calls, i)
+            _remove_call(self.mock_calls, i)
+
         args = pargs + args
         kwargs = copy_and_update(pkwargs, kwargs)
 
@@ -585,103 +1465,475 @@ class UnifiedAlchemyMagicMock(AlchemyMagicMock):
 
         return submock.return_value
 
+    def _get_predicate(self, entry: DataEntry) -> Optional[Callable[[Any], bool]]:
+        """Gets the predicate of the query criteria for added objects."""
+        if not entry.dynamic:
+            return None
+        # added objects are stored under mock.call.query(type(obj))
+        model = entry.calls[0][1][0]
+        return chain_predicate(model, self._mock_chain.calls)
+
+    def _get_rows(self, entry: DataEntry, calls: Sequence[Call]) -> List[Any]:
+        """Gets a new list of the rows of an entry selected by the query calls."""
+        # the rows of an entry are shared with forks of the session
+        return list(self._iter_rows(entry, calls))
+
+    def _iter_rows(self, entry: DataEntry, calls: Sequence[Call]) -> Iterable[Any]:
+        """Gets the rows of an entry selected by the query calls lazily."""
+        if not entry.dynamic:
+            return entry.rows
+        # added objects are stored under mock.call.query(type(obj))
+        model = entry.calls[0][1][0]
+        predicate = chain_predicate(model, calls)
+        key = chain_sort_key(model, calls)
+        offset, limit = chain_slice(calls)
+        if key is None and chain_order_by(calls):
+            # rows which cannot be ordered as queried cannot be sliced either
+            offset, limit = 0, None
+        rows = entry.rows
+        if predicate is not None:
+            # narrow down the rows with the smallest match of an indexed equality
+            for column, value in chain_equalities(model, calls):
+                if self._is_indexed(model, column):
+                    candidates = entry.lookup(model, column, value)
+                    if candidates is not None and len(candidates) < len(rows):
+                        rows = candidates
+        elif key is None and not offset and limit is None:
+            return rows
+        return iter_rows(rows, predicate, key, offset, limit)
+
+    def _is_indexed(self, model: Any, key: str) -> bool:
+        """Checks whether a column is indexed counting filters for auto indexes."""
+        indexed = self._mock_indexed.setdefault(model, set())
+        if key in indexed:
+            return True
+        if self._mock_auto_index is None:
+            return False
+        self._mock_filter_counts[model, key] += 1
+        if self._mock_filter_counts[model, key] < self._mock_auto_index:
+            return False
+        indexed.add(key)
+        return True
+
+    @_timed
     def _get_data(self, *args: Any, **kwargs: Any) -> Any:
         """Get the data for the SQLAlchemy expression."""
         _mock_name = kwargs.pop("_mock_name")
-        _mock_default = self._mock_default
-        _mock_data = self._mock_data
-        if _mock_data is not None:
-            previous_calls = [
-                sqlalchemy_call(
-                    i, with_name=True, base_call=self.unify.get(i[0]) or Call
-                )
-                for i in self._get_previous_calls(self.mock_calls[:-1])
-            ]
-            sorted_mock_data = sorted(_mock_data, key=lambda x: len(x[0]), reverse=True)
-            if _mock_name == "get":
-                query_call = [
-                    c for c in previous_calls if c[0] in ["query", "execute"]
-                ][0]
-                results = list(
-                    chain(
-                        *[
-                            result
-                            for calls, result in sorted_mock_data
-                            if query_call in calls
-                        ]
-                    )
-                )
-                return self.boundary[_mock_name](results, *args, **kwargs)
-
-            else:
-                for calls, result in sorted_mock_data:
-                    calls = [
-                        sqlalchemy_call(
-                            i,
-                            with_name=True,
-                            base_call=self.unify.get(i[0]) or Call,
-                        )
-                        for i in calls
-                    ]
-                    if all(c in previous_calls for c in calls):
-                        return self.boundary[_mock_name](result, *args, **kwargs)
-
-        return self.boundary[_mock_name](_mock_default, *args, **kwargs)
+        _mock_store = self._mock_store
+        calls = self._mock_chain.calls
+        if _mock_name == "get" and len(args) > 1:
+            # Session.get(entity, ident) rather than Query.get(ident)
+            calls, args, kwargs = [mock.call.query(args[0])], args[1:2], {}
+        if _mock_store and _mock_name == "get":
+            previous_calls, fingerprints = self._normalize_calls(calls)
+            query_index = [
+                i for i, c in enumerate(previous_calls) if c[0] in ["query", "execute"]
+            ][-1]
+            return _mock_store.get(
+                previous_calls[query_index], fingerprints[query_index], *args, **kwargs
+            )
 
+        if _mock_name in self.fetch:
+            # fetches continue the result of the previous fetch of a query
+            _mock_chain = self._mock_chain
+            if _mock_chain.cursor is None:
+                _mock_chain.cursor = iter(self._select_rows(lazy=True))
+            rows: Iterable[Any] = _mock_chain.cursor
+        else:
+            rows = self._select_rows(lazy=_mock_name in self.stream)
+        return self.boundary[_mock_name](rows, *args, **kwargs)
+
+    def _select_rows(self, lazy: bool = False) -> Iterable[Any]:
+        """Gets the rows selected by the current query or the default."""
+        if self._mock_store:
+            calls: Sequence[Call] = self._mock_chain.calls
+            entry = self._match(calls)
+            if entry is None:
+                # ORM statements also select objects added to the session
+                statement = self._statement_calls(calls)
+                if statement:
+                    calls = statement
+                    entry = self._match(calls)
+            if entry is not None:
+                if lazy:
+                    return self._iter_rows(entry, calls)
+                return self._get_rows(entry, calls)
+        default: Iterable[Any] = self._mock_default
+        return default
+
+    def _match(self, calls: Sequence[Call]) -> Optional[DataEntry]:
+        """Finds the most specific data entry matching the given calls."""
+        return self._mock_store.match(*self._normalize_calls(calls))
+
+    def _statement_calls(self, calls: Sequence[Call]) -> Optional[List[Call]]:
+        """Replaces an ``execute`` call of an ORM statement by query calls."""
+        for i, (name, args, _kwargs) in enumerate(calls):
+            if name != "execute" or not args:
+                continue
+            translated = statement_calls(args[0])
+            if translated is not None:
+                rest = [j for j in calls if j is not calls[i]]
+                return [Call(j) for j in translated] + rest
+        return None
+
+    @_timed
     def _mutate_data(self, *args: Any, **kwargs: Any) -> Optional[int]:
         """Alter the data for the SQLAlchemy expression."""
         _mock_name = kwargs.get("_mock_name")
-        _mock_data = self._mock_data = self._mock_data or []
+        _mock_store = self._mock_store
         if _mock_name == "add":
-            to_add = args[0]
-            query_call = mock.call.query(type(to_add))
-
-            mocked_data = next(
-                iter(filter(lambda i: i[0] == [query_call], _mock_data)), None
+            self._add_rows(args[:1])
+        elif _mock_name in ("add_all", "bulk_save_objects"):
+            self._add_rows(args[0])
+        elif _mock_name == "bulk_insert_mappings":
+            self._add_rows(build_objects(args[0], args[1]))
+        elif _mock_name == "bulk_update_mappings":
+            self._update_rows(inspect(args[0]), args[1])
+        elif args and isinstance(inspect(args[0], raiseerr=False), InstanceState):
+            # Session.delete(instance) rather than Query.delete()
+            self._delete_row(args[0])
+        # delete case
+        else:
+            previous_calls, fingerprints = self._normalize_calls(self._mock_chain.calls)
+            mocked_data = _mock_store.match(previous_calls, fingerprints)
+            if mocked_data is None:
+                return 0
+            return _mock_store.clear(mocked_data, self._get_predicate(mocked_data))
+
+    def _add_rows(self, rows: Iterable[Any]) -> None:
+        """Adds objects to the data queried by their types, once per type."""
+        _mock_store = self._mock_store
+        by_type: Dict[Any, List[Any]] = {}
+        for i in rows:
+            by_type.setdefault(type(i), []).append(i)
+        for model, to_add in by_type.items():
+            query_call = mock.call.query(model)
+            wrapped, fingerprints = self._normalize_calls([query_call])
+            _mock_store.add(query_call, wrapped[0], fingerprints[0], to_add)
+
+    def _delete_row(self, row: Any) -> None:
+        """Removes an object from all data it was added to or mocked in."""
+        wrapped, fingerprints = self._normalize_calls([mock.call.query(type(row))])
+        for entry in self._mock_store.containing(wrapped[0], fingerprints[0]):
+            if any(i is row for i in entry.rows):
+                self._mock_store.clear(entry, lambda i: i is row)
+
+    def _update_rows(self, mapper: Any, mappings: Iterable[Dict[str, Any]]) -> None:
+        """Updates the objects with the primary keys of the given mappings."""
+        mappings = list(mappings)
+        wrapped, fingerprints = self._normalize_calls([mock.call.query(mapper.class_)])
+        # identity keys are ordered by the names of the primary key attributes
+        keys = sorted(mapper.get_property_by_column(c).key for c in mapper.primary_key)
+        with gc_paused():
+            rows = self._mock_store.get_many(
+                wrapped[0],
+                fingerprints[0],
+                [tuple(i.get(k) for k in keys) for i in mappings],
             )
-            if mocked_data:
-                mocked_data[1].append(to_add)
-            else:
-                _mock_data.append(([query_call], [to_add]))
+            for i, row in enumerate(rows):
+                if row is None:
+                    continue
+                for key, value in mappings[i].items():
+                    if key not in keys:
+                        setattr(row, key, value)
 
-        elif _mock_name == "add_all":
-            to_add = args[0]
-            _kwargs = kwargs.copy()
-            _kwargs["_mock_name"] = "add"
 
-            for i in to_add:
-                self._mutate_data(i, *args[1:], **_kwargs)
-        # delete case
-        else:
-            _kwargs = kwargs.copy()
-            # pretend like all is being called to get data
-            _kwargs["_mock_name"] = "all"
-            _mock_name = _kwargs.pop("_mock_name")
-            _mock_data = self._mock_data
-            num_deleted = 0
-            previous_calls = [
-                sqlalchemy_call(
-                    i, with_name=True, base_call=self.unify.get(i[0]) or Call
-                )
-                for i in self._get_previous_calls(self.mock_calls[:-1])
-            ]
-            sorted_mock_data = sorted(_mock_data, key=lambda x: len(x[0]), reverse=True)
-            temp_mock_data = list()
-            found_query = False
-            for calls, result in sorted_mock_data:
-                calls = [
-                    sqlalchemy_call(
-                        i,
-                        with_name=True,
-                        base_call=self.unify.get(i[0]) or Call,
-                    )
-                    for i in calls
-                ]
-                if all(c in previous_calls for c in calls) and not found_query:
-                    num_deleted = len(result)
-                    temp_mock_data.append((calls, []))
-                    found_query = True
-                else:
-                    temp_mock_data.append((calls, result))
-            self._mock_data = temp_mock_data
-            return num_deleted
+class Result(object):
+    """Mocks the result of a SQLAlchemy ``execute`` call of an async session.
+
+    Produces the rows selected when the statement was executed lazily,
+    using the boundary functions of the session which selected them. The
+    result is detached from the session, hence other queries may run
+    before it is consumed.
+
+    For example::
+
+        >>> result = Result(iter(range(5)), UnifiedAlchemyMagicMock.boundary)
+        >>> result.fetchmany(2)
+        [0, 1]
+        >>> result.scalars().all()
+        [2, 3, 4]
+    """
+
+    def __init__(
+        self, rows: Iterator[Any], boundary: Dict[str, Callable[..., Any]]
+    ) -> None:
+        """Creates a Result over an iterator of rows."""
+        self._rows = rows
+        self._boundary = boundary
+
+    def __iter__(self) -> Iterator[Any]:
+        """Gets the iterator over the remaining rows."""
+        return self._rows
+
+    def scalars(self, *args: Any, **kwargs: Any) -> "Result":
+        """Gets the result itself as mocked rows are already scalars."""
+        return self
+
+    def unique(self, *args: Any, **kwargs: Any) -> "Result":
+        """Gets the result itself as mocked rows are not deduplicated."""
+        return self
+
+    def partitions(self, size: Optional[int] = None) -> Iterator[List[Any]]:
+        """Iterates over lists of the next rows."""
+        partitions: Iterator[List[Any]]
+        partitions = self._boundary["partitions"](self._rows, size)
+        return partitions
+
+    def all(self) -> List[Any]:
+        """Gets the remaining rows."""
+        return self.fetchall()
+
+    def fetchall(self) -> List[Any]:
+        """Gets the remaining rows."""
+        rows: List[Any] = self._boundary["fetchall"](self._rows)
+        return rows
+
+    def fetchmany(self, size: Optional[int] = None) -> List[Any]:
+        """Gets a list of the next rows."""
+        rows: List[Any] = self._boundary["fetchmany"](self._rows, size)
+        return rows
+
+    def fetchone(self) -> Any:
+        """Gets the next row or ``None``."""
+        return self._boundary["fetchone"](self._rows)
+
+    def first(self) -> Any:
+        """Gets the next row or ``None``."""
+        return self._boundary["first"](self._rows)
+
+    def one(self) -> Any:
+        """Gets the only remaining row."""
+        return self._boundary["one"](list(self._rows))
+
+    def one_or_none(self) -> Any:
+        """Gets the only remaining row or ``None``."""
+        return self._boundary["one_or_none"](list(self._rows))
+
+    def scalar(self) -> Any:
+        """Gets the first column of the next row."""
+        return self._boundary["scalar"](list(islice(self._rows, 1)))
+
+    scalar_one = one
+    scalar_one_or_none = one_or_none
+
+
+class AsyncResult(object):
+    """Mocks the result of a SQLAlchemy ``AsyncSession.stream`` call.
+
+    Produces the rows of a ``Result`` through asynchronous iteration and
+    awaitable fetches.
+
+    For example::
+
+        >>> import asyncio
+        >>> async def fetch(result):
+        ...     first = await result.fetchmany(2)
+        ...     return first, [i async for i in result]
+        >>> result = Result(iter(range(5)), UnifiedAlchemyMagicMock.boundary)
+        >>> asyncio.run(fetch(AsyncResult(result)))
+        ([0, 1], [2, 3, 4])
+    """
+
+    def __init__(self, result: Result) -> None:
+        """Creates an AsyncResult over a synchronous result."""
+        self._result = result
+        self._rows = iter(result)
+
+    def __aiter__(self) -> "AsyncResult":
+        """Gets the asynchronous iterator over the rows."""
+        return self
+
+    async def __anext__(self) -> Any:
+        """Gets the next row."""
+        try:
+            return next(self._rows)
+        except StopIteration:
+            raise StopAsyncIteration from None
+
+    def scalars(self, *args: Any, **kwargs: Any) -> "AsyncResult":
+        """Gets the result itself as mocked rows are already scalars."""
+        return self
+
+    def unique(self, *args: Any, **kwargs: Any) -> "AsyncResult":
+        """Gets the result itself as mocked rows are not deduplicated."""
+        return self
+
+    async def partitions(self, size: Optional[int] = None) -> Any:
+        """Iterates over lists of the next rows asynchronously.
+
+        Args:
+            size: The maximum number of rows of each list.
+
+        Yields:
+            Lists of the next rows until the rows are exhausted.
+        """
+        for i in self._result.partitions(size):
+            yield i
+
+    async def all(self) -> List[Any]:
+        """Gets the remaining rows."""
+        return self._result.all()
+
+    async def fetchall(self) -> List[Any]:
+        """Gets the remaining rows."""
+        return self._result.fetchall()
+
+    async def fetchmany(self, size: Optional[int] = None) -> List[Any]:
+        """Gets a list of the next rows."""
+        return self._result.fetchmany(size)
+
+    async def fetchone(self) -> Any:
+        """Gets the next row or ``None``."""
+        return self._result.fetchone()
+
+    async def first(self) -> Any:
+        """Gets the next row or ``None``."""
+        return self._result.first()
+
+    async def one(self) -> Any:
+        """Gets the only remaining row."""
+        return self._result.one()
+
+    async def one_or_none(self) -> Any:
+        """Gets the only remaining row or ``None``."""
+        return self._result.one_or_none()
+
+    async def scalar(self) -> Any:
+        """Gets the first column of the next row."""
+        return self._result.scalar()
+
+    scalar_one = one
+    scalar_one_or_none = one_or_none
+
+
+class AsyncUnifiedAlchemyMagicMock(AlchemyMagicMock):
+    """A MagicMock that mocks a SQLAlchemy ``AsyncSession``.
+
+    Same as ``AsyncSession`` proxies a ``Session``, this mock proxies a
+    ``UnifiedAlchemyMagicMock`` available as ``sync_session`` which takes
+    the same ``data``, ``default``, ``indexes`` and ``auto_index`` arguments
+    and unifies, matches and mutates data the same way. The methods named
+    in ``awaitable`` return awaitables. ``execute`` and ``scalars`` give a
+    synchronous ``Result`` while ``stream`` and ``stream_scalars`` give an
+    ``AsyncResult``, both producing the rows selected by the statement
+    lazily. Results are detached from the session so that many coroutines
+    can query the same session concurrently. Calls are recorded by this
+    mock as well as by the synchronous session.
+
+    Attributes:
+        awaitable: A set of session methods which return awaitables.
+        proxied: A set of synchronous session methods which are passed
+            to the synchronous session.
+
+    For example::
+
+        >>> import asyncio
+        >>> from sqlalchemy import Column, Integer, String, select
+        >>> from sqlalchemy.ext.declarative import declarative_base
+
+        >>> Base = declarative_base()
+
+        >>> class SomeClass(Base):
+        ...     __tablename__ = 'some_table'
+        ...     pk1 = Column(Integer, primary_key=True)
+        ...     name =  Column(String(50))
+        ...     def __repr__(self):
+        ...         return str(self.pk1)
+
+        >>> s = AsyncUnifiedAlchemyMagicMock(data=[
+        ...     ([mock.call.execute(select(SomeClass))], [SomeClass(pk1=1)]),
+        ... ])
+        >>> async def run():
+        ...     s.add(SomeClass(pk1=2))
+        ...     await s.commit()
+        ...     result = await s.execute(select(SomeClass))
+        ...     stream = await s.stream(select(SomeClass))
+        ...     return (
+        ...         result.scalars().all(),
+        ...         await s.get(SomeClass, 2),
+        ...         [i async for i in stream],
+        ...     )
+        >>> asyncio.run(run())
+        ([1], 2, [1])
+        >>> s.commit.call_count
+        1
+    """
+
+    awaitable: Set[str] = {
+        "close",
+        "commit",
+        "delete",
+        "execute",
+        "flush",
+        "get",
+        "refresh",
+        "rollback",
+        "run_sync",
+        "scalar",
+        "scalars",
+        "stream",
+        "stream_scalars",
+    }
+    proxied: Set[str] = {"add", "add_all", "expunge", "expunge_all"}
+    _mock_sync_session: UnifiedAlchemyMagicMock
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        """Creates AsyncUnifiedAlchemyMagicMock to mock a SQLAlchemy AsyncSession."""
+        sync_kwargs = {
+            k: kwargs.pop(k)
+            for k in ("data", "default", "indexes", "auto_index", "stats")
+            if k in kwargs
+        }
+        self.__dict__["_mock_sync_session"] = UnifiedAlchemyMagicMock(
+            max_history=kwargs.get("max_history"),
+            dialect=kwargs.get("dialect"),
+            **sync_kwargs,
+        )
+        kwargs.setdefault("__name__", "AsyncSession")
+        super(AsyncUnifiedAlchemyMagicMock, self).__init__(*args, **kwargs)
+
+    @property
+    def sync_session(self) -> UnifiedAlchemyMagicMock:
+        """Gets the synchronous session proxied by this session."""
+        return self._mock_sync_session
+
+    def _get_child_mock(self, **kwargs: Any) -> mock.NonCallableMock:
+        """Creates awaitable and proxied submocks on first access."""
+        method = kwargs.get("_new_name")
+        max_history = self._mock_max_history
+        dialect = self._mock_dialect
+        if method in self.awaitable or method == "__aenter__":
+            return AlchemyMagicMock(
+                side_effect=partial(self._await, _mock_name=method),
+                max_history=max_history,
+                dialect=dialect,
+                **kwargs,
+            )
+        if method in self.proxied:
+            return AlchemyMagicMock(
+                side_effect=getattr(self.sync_session, method),
+                max_history=max_history,
+                dialect=dialect,
+                **kwargs,
+            )
+        return super(AsyncUnifiedAlchemyMagicMock, self)._get_child_mock(**kwargs)
+
+    async def _await(self, *args: Any, **kwargs: Any) -> Any:
+        """Runs an awaitable session method on the synchronous session."""
+        _mock_name = kwargs.pop("_mock_name")
+        sync_session = self.sync_session
+        if _mock_name == "__aenter__":
+            return self
+        if _mock_name in ("execute", "scalars", "stream", "stream_scalars"):
+            # iterating ends the query so the result can outlive it
+            result = Result(
+                iter(sync_session.execute(*args, **kwargs)), sync_session.boundary
+            )
+            return AsyncResult(result) if _mock_name.startswith("stream") else result
+        if _mock_name == "scalar":
+            return sync_session.execute(*args, **kwargs).scalar()
+        if _mock_name == "run_sync":
+            return args[0](sync_session, *args[1:], **kwargs)
+        result = getattr(sync_session, _mock_name)(*args, **kwargs)
+        return result if _mock_name == "get" else None
@@ -0,0 +1,866 @@
+"""A module for indexing the mocked data of SQLAlchemy sessions."""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import copy
+import copyreg
+import io
+import pickle  # noqa: S403
+import threading
+from collections import Counter
+from functools import lru_cache
+from operator import attrgetter
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+from unittest import mock
+from weakref import WeakKeyDictionary
+from weakref import WeakSet
+from weakref import finalize
+
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy.orm import Mapper
+from sqlalchemy.orm import configure_mappers
+
+from .utils import gc_paused
+from .utils import identity_getter
+from .utils import identity_key
+from .utils import to_identity_key
+
+Call = mock._Call
+
+
+# indexes by the model attribute they index, to be notified of changes
+_watchers: "WeakKeyDictionary[Any, Dict[str, Tuple[Any, WeakSet[HashIndex]]]]"
+_watchers = WeakKeyDictionary()
+# reentrant as indexes may be collected while the lock is held
+_watchers_lock = threading.RLock()
+
+
+def _watch(model: Any, key: str, index: "HashIndex") -> None:
+    """Marks an index stale whenever the attribute of an indexed row is set."""
+    with _watchers_lock:
+        listeners = _watchers.setdefault(model, {})
+        if key not in listeners:
+            watchers: "WeakSet[HashIndex]" = WeakSet()
+
+            def invalidate(
+                target: Any, value: Any, oldvalue: Any, initiator: Any
+            ) -> None:
+                for i in list(watchers):
+                    if id(target) in i.members:
+                        i.stale = True
+
+            event.listen(getattr(model, key), "set", invalidate, propagate=True)
+            listeners[key] = invalidate, watchers
+        listeners[key][1].add(index)
+    # indexes of an attribute share its listener, removed along with the last
+    finalize(index, _unwatch, model, key).atexit = False
+
+
+def _unwatch(model: Any, key: str) -> None:
+    """Removes the listener of an attribute once none of its indexes is left."""
+    with _watchers_lock:
+        listeners = _watchers.get(model, {})
+        if key not in listeners:
+            return
+        invalidate, watchers = listeners[key]
+        # collected indexes are skipped when iterating even if not removed yet
+        if any(True for _ in watchers):
+            return
+        event.remove(getattr(model, key), "set", invalidate)
+        del listeners[key]
+        if not listeners:
+            del _watchers[model]
+
+
+@lru_cache(maxsize=None)
+def _row_factory(model: Any) -> Callable[[], Any]:
+    """Gets the function creating objects of a model without constructors."""
+    mapper = inspect(model)
+    # attributes of mappers unpickled in a new process are not set up yet
+    configure: Callable[[], None] = configure_mappers
+    configure()
+    new_instance: Callable[[], Any] = mapper.class_manager.new_instance
+    return new_instance
+
+
+def _new_row(model: Any) -> Any:
+    """Creates an object of a model without calling its constructor."""
+    return _row_factory(model)()
+
+
+def _reduce_row(row: Any) -> Tuple[Any, ...]:
+    """Reduces an object of a model to its attribute values.
+
+    SQLAlchemy pickles the whole instance state of objects, which is much
+    slower than restoring their attributes the way ``build_objects`` does.
+
+    Args:
+        row: The object to reduce.
+
+    Returns:
+        The function creating the object, its argument and its attributes.
+    """
+    state = row.__dict__.copy()
+    state.pop("_sa_instance_state", None)
+    return _new_row, (type(row),), state
+
+
+def _reduce_call(call: Any) -> Tuple[Any, Any]:
+    """Reduces a call to its type and its plain tuple as calls cannot be pickled."""
+    if isinstance(call, Call):
+        return type(call), tuple(call)
+    return None, call
+
+
+def _restore_call(call_type: Any, value: Any) -> Any:
+    """Restores a call reduced by ``_reduce_call``."""
+    if call_type is None:
+        return value
+    return call_type(value, two=len(value) == 2)
+
+
+class _RowPickler(pickle.Pickler):
+    """Pickles objects of the given models by their attribute values."""
+
+    def __init__(self, file: Any, models: Iterable[Any]) -> None:
+        """Creates a _RowPickler writing to a file."""
+        super(_RowPickler, self).__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.dispatch_table = copyreg.dispatch_table.copy()
+        for i in models:
+            if isinstance(inspect(i, raiseerr=False), Mapper):
+                self.dispatch_table[i] = _reduce_row
+
+
+class _Pickler(pickle.Pickler):
+    """Pickles mappers, which annotate ORM expressions, by their classes.
+
+    The given lists, i.e. the rows pickled by a ``_RowPickler``, are pickled
+    by their positions so that the rows are not checked for mappers.
+    """
+
+    def __init__(self, file: Any, lists: Sequence[List[Any]]) -> None:
+        """Creates a _Pickler writing to a file."""
+        super(_Pickler, self).__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.lists = {id(v): i for i, v in enumerate(lists)}
+
+    def persistent_id(self, obj: Any) -> Any:
+        """Gets the persistent id of a mapper or of a given list."""
+        if isinstance(obj, Mapper):
+            return "mapper", obj.class_
+        if type(obj) is list and id(obj) in self.lists:
+            return "list", self.lists[id(obj)]
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    """Unpickles objects pickled by ``_Pickler`` given the pickled lists."""
+
+    def __init__(self, file: Any, lists: Sequence[List[Any]]) -> None:
+        """Creates an _Unpickler reading from a file."""
+        super(_Unpickler, self).__init__(file)
+        self.lists = lists
+
+    def persistent_load(self, pid: Any) -> Any:
+        """Gets a mapper from its class or a list from its position."""
+        kind, value = pid
+        if kind == "list":
+            return self.lists[value]
+        return inspect(value)
+
+
+class HashIndex(object):
+    """Rows grouped by the value of one of their attributes.
+
+    A secondary index over the rows of an entry which answers equality
+    criteria without scanning every row. Rows appended to the indexed list
+    are indexed on the next lookup. Setting the indexed attribute of an
+    indexed row, which SQLAlchemy reports through attribute events, marks
+    the index stale so that it is rebuilt on the next lookup. Indexes of
+    the same attribute share one listener, which is removed once the last
+    of them is collected.
+
+    Attributes:
+        key: The name of the indexed attribute.
+        stale: Whether the index has to be rebuilt before the next lookup.
+        members: The ids of the indexed rows.
+
+    For example::
+
+        >>> from sqlalchemy import Column, Integer, String
+        >>> from sqlalchemy.ext.declarative import declarative_base
+
+        >>> Base = declarative_base()
+
+        >>> class Model(Base):
+        ...     __tablename__ = 'model_table'
+        ...     pk1 = Column(Integer, primary_key=True)
+        ...     name = Column(String)
+        ...     def __repr__(self):
+        ...         return str(self.pk1)
+
+        >>> rows = [Model(pk1=1, name='a'), Model(pk1=2, name='b')]
+        >>> index = HashIndex(Model, 'name')
+        >>> index.lookup(rows, 'a')
+        [1]
+        >>> rows[1].name = 'a'
+        >>> index.lookup(rows, 'a')
+        [1, 2]
+    """
+
+    __slots__ = [
+        "key",
+        "stale",
+        "members",
+        "_getter",
+        "_buckets",
+        "_indexed",
+        "_count",
+        "__weakref__",
+    ]
+
+    def __init__(self, model: Any, key: str) -> None:
+        """Creates an empty HashIndex of an attribute of a model."""
+        self.key = key
+        self.stale = True
+        self.members: Set[int] = set()
+        self._getter = attrgetter(key)
+        self._buckets: Optional[Dict[Any, List[Any]]] = None
+        self._indexed: Optional[List[Any]] = None
+        self._count = 0
+        _watch(model, key, self)
+
+    def lookup(self, rows: List[Any], value: Any) -> Optional[List[Any]]:
+        """Gets the rows whose indexed attribute equals a value.
+
+        Args:
+            rows: The rows to index, always the same list unless replaced.
+            value: The value of the indexed attribute.
+
+        Returns:
+            The matching rows in their order or ``None`` if the rows cannot
+            be indexed because some of their values are not hashable.
+        """
+        if self.stale or self._indexed is not rows or self._count > len(rows):
+            self.stale = False
+            self.members = set()
+            self._buckets = {}
+            self._indexed = rows
+            self._count = 0
+        count = self._count
+        if self._buckets is not None and count < len(rows):
+            self._index(rows[count:])
+            self._count = len(rows)
+        if self._buckets is None:
+            return None
+        return self._buckets.get(value, [])
+
+    def _index(self, rows: Sequence[Any]) -> None:
+        """Adds rows to the index."""
+        buckets = self._buckets
+        if buckets is None:
+            return
+        try:
+            for i in rows:
+                buckets.setdefault(self._getter(i), []).append(i)
+                self.members.add(id(i))
+        except TypeError:
+            self._buckets = None
+
+
+class DataEntry(object):
+    """A single ``(criteria, result)`` pair of mocked data.
+
+    Holds the criteria calls as given by the user along with their wrapped
+    versions used for comparison and their fingerprints used for indexing.
+    Calls which could not be fingerprinted have a fingerprint of ``None``
+    and are compared pairwise.
+
+    Rows are also indexed by their primary keys for ``get``. The identity
+    map is built on the first lookup and then kept up to date as rows are
+    added or deleted. The identity map is rebuilt once on a lookup miss so
+    that primary keys assigned or changed after adding an object, e.g. to
+    fake a flush, are still found.
+
+    Mutations and lookups of an entry hold its own lock so that the lazily
+    built indexes stay consistent when several threads use the entry.
+    Removing rows replaces the rows list rather than changing it in place,
+    hence readers iterating the rows are never affected by a removal.
+
+    Attributes:
+        calls: The criteria calls as given by the user.
+        wrapped: The criteria calls wrapped for SQLAlchemy comparison.
+        fingerprints: The fingerprints of the wrapped criteria calls.
+        rows: The result rows returned when the criteria match.
+        position: The position of the entry within its store.
+        dynamic: Whether the entry holds objects added to the session
+            whose rows are filtered by the criteria of a query.
+    """
+
+    __slots__ = [
+        "calls",
+        "wrapped",
+        "fingerprints",
+        "rows",
+        "position",
+        "dynamic",
+        "required",
+        "pending",
+        "_idmap",
+        "_indexed",
+        "_count",
+        "_hash_indexes",
+        "_lock",
+        "_builds",
+    ]
+
+    # lazily built indexes and locks are not pickled
+    _pickled = ("rows", "position", "dynamic")
+
+    def __init__(
+        self,
+        calls: Sequence[Any],
+        wrapped: Sequence[Any],
+        fingerprints: Sequence[Optional[Hashable]],
+        rows: List[Any],
+        position: int,
+        dynamic: bool = False,
+    ) -> None:
+        """Creates a DataEntry from its precompiled criteria."""
+        self.calls = calls
+        self.wrapped = wrapped
+        self.fingerprints = fingerprints
+        self.rows = rows
+        self.position = position
+        self.dynamic = dynamic
+        self.required = frozenset(i for i in fingerprints if i is not None)
+        self.pending = [wrapped[i] for i, f in enumerate(fingerprints) if f is None]
+        self._idmap: Optional[Dict[Tuple[Any, ...], Any]] = None
+        self._indexed: Optional[List[Any]] = None
+        self._count = 0
+        self._hash_indexes: Dict[str, HashIndex] = {}
+        self._lock = threading.Lock()
+        # number of times the identity map was built from scratch
+        self._builds = 0
+
+    def __copy__(self) -> "DataEntry":
+        """Copies the entry sharing all of its attributes."""
+        entry = DataEntry.__new__(DataEntry)
+        for i in self.__slots__:
+            setattr(entry, i, getattr(self, i))
+        return entry
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Gets the state of the entry with its calls as plain tuples."""
+        state = {k: getattr(self, k) for k in self._pickled}
+        state["calls"] = [_reduce_call(i) for i in self.calls]
+        state["wrapped"] = [_reduce_call(i) for i in self.wrapped]
+        state["fingerprints"] = self.fingerprints
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """Restores the entry from its pickled state."""
+        DataEntry.__init__(
+            self,
+            [_restore_call(*i) for i in state["calls"]],
+            [_restore_call(*i) for i in state["wrapped"]],
+            state["fingerprints"],
+            state["rows"],
+            state["position"],
+            state["dynamic"],
+        )
+
+    @property
+    def rank(self) -> Any:
+        """Gets the sort key with the most specific entries first."""
+        return -len(self.calls), self.position
+
+    def matches(self, wrapped: Sequence[Any]) -> bool:
+        """Checks whether all criteria are present in the given calls."""
+        return all(c in wrapped for c in self.wrapped)
+
+    def copy(self) -> "DataEntry":
+        """Copies the entry with its own rows and identity map."""
+        with self._lock:
+            entry = copy.copy(self)
+            entry.rows = list(self.rows)
+            if self._idmap is not None and self._indexed is self.rows:
+                entry._idmap = dict(self._idmap)
+                entry._indexed = entry.rows
+            else:
+                entry._idmap = None
+        entry._hash_indexes = {}
+        entry._lock = threading.Lock()
+        return entry
+
+    def extend(self, rows: Sequence[Any]) -> None:
+        """Adds rows to the entry updating its identity map."""
+        with self._lock:
+            self.rows.extend(rows)
+            if self._idmap is not None:
+                self._identity_map()
+
+    def clear(self, predicate: Optional[Callable[[Any], bool]] = None) -> int:
+        """Removes all rows of the entry or the rows satisfying a predicate.
+
+        Args:
+            predicate: A function telling whether a row should be removed.
+
+        Returns:
+            The number of removed rows.
+        """
+        with self._lock:
+            removed = len(self.rows)
+            if predicate is None:
+                self.rows = []
+            else:
+                self.rows = [i for i in self.rows if not predicate(i)]
+            self._idmap = None
+            return removed - len(self.rows)
+
+    def get(self, key: Tuple[Any, ...]) -> Any:
+        """Gets the row with the given identity key.
+
+        Args:
+            key: The identity key of the row as given by ``identity_key``.
+
+        Returns:
+            The last row with the given identity key or ``None``.
+        """
+        with self._lock:
+            builds = self._builds
+            row = self._identity_map().get(key)
+            if (row is None or identity_key(row) != key) and builds == self._builds:
+                # primary keys may have been assigned or changed after indexing
+                self._idmap = None
+                row = self._identity_map().get(key)
+            return row
+
+    def lookup(self, model: Any, key: str, value: Any) -> Optional[List[Any]]:
+        """Gets the rows whose attribute equals a value using a hash index.
+
+        Args:
+            model: The SQLAlchemy model of the rows.
+            key: The name of the attribute, indexed on the first lookup.
+            value: The value of the attribute.
+
+        Returns:
+            The matching rows or ``None`` if the attribute cannot be indexed.
+        """
+        with self._lock:
+            index = self._hash_indexes.get(key)
+            if index is None:
+                index = self._hash_indexes[key] = HashIndex(model, key)
+            return index.lookup(self.rows, value)
+
+    def _identity_map(self) -> Dict[Tuple[Any, ...], Any]:
+        """Gets the identity map catching up with rows changed in place."""
+        rows = self.rows
+        idmap = self._idmap
+        if idmap is None or self._indexed is not rows or self._count > len(rows):
+            self._builds += 1
+            idmap = self._idmap = {}
+            self._indexed = rows
+            self._count = 0
+        indexed = self._count
+        if indexed < len(rows):
+            self._index(idmap, rows[indexed:])
+            self._count = len(rows)
+        return idmap
+
+    def _index(self, idmap: Dict[Tuple[Any, ...], Any], rows: Sequence[Any]) -> None:
+        """Adds rows to the identity map."""
+        cls: Optional[type] = None
+        for i in rows:
+            if type(i) is not cls:
+                cls = type(i)
+                getter = identity_getter(cls)
+            idmap[getter(i)] = i
+
+
+class DataStore(object):
+    """Mocked session data indexed by criteria fingerprints.
+
+    Normalizes ``(criteria, result)`` data once so that looking up the data
+    for a chain of calls does not have to compare every criteria call with
+    every chain call. An inverted index maps each criteria call fingerprint
+    to the entries containing it, hence a lookup only visits the entries
+    sharing at least one call with the chain. Entries whose criteria cannot
+    be fingerprinted fall back to pairwise comparison.
+
+    When several entries match, the one with most criteria wins with ties
+    broken by the order in which entries were given.
+
+    A store can be forked into independent stores which share its entries
+    and index. Entries are copied by a store only when it mutates them so
+    forking is cheap regardless of the amount of data.
+
+    Stores can be used by several threads at once. Lookups do not lock as
+    the index only ever grows by appending positions and rows are removed
+    by replacing the rows of an entry. Changes of the index hold the lock
+    of the store while rows are added and removed under the lock of their
+    entry. Adding rows with ``add`` holds a lock per criteria call, i.e.
+    per mapped class for objects added to a session, so that threads
+    adding objects of different classes never wait for each other.
+
+    Stores can be pickled along with their index, e.g. to send prepared
+    data to other processes. Criteria calls are pickled with their SQLAlchemy
+    expressions whose mappers are pickled by reference to their classes,
+    hence the models have to be importable where the store is unpickled.
+
+    Attributes:
+        entries: The entries of the store by position.
+        stats: A counter of the entries examined by lookups and of the
+            identity maps built by ``get``, or ``None`` to count nothing.
+
+    For example::
+
+        >>> store = DataStore()
+        >>> _ = store.append(['a'], ['a'], ['a'], [1])
+        >>> _ = store.append(['a', 'b'], ['a', 'b'], ['a', 'b'], [2])
+        >>> store.match(['b', 'a'], ['b', 'a']).rows
+        [2]
+        >>> store.match(['a', 'c'], ['a', 'c']).rows
+        [1]
+        >>> store.match(['c'], ['c']) is None
+        True
+    """
+
+    def __init__(self) -> None:
+        """Creates an empty DataStore."""
+        self.entries: List[DataEntry] = []
+        self._index: Dict[Hashable, List[int]] = {}
+        self._buckets: Dict[Hashable, int] = {}
+        self._unindexed: List[int] = []
+        self._pending: List[int] = []
+        # positions of entries this store may mutate, None if not forked
+        self._owned: Optional[Set[int]] = None
+        self._lock = threading.Lock()
+        self._shards: Dict[Hashable, threading.Lock] = {}
+        self.stats: Optional["Counter[str]"] = None
+
+    def __len__(self) -> int:
+        """Gets the number of entries in the store."""
+        return len(self.entries)
+
+    def __copy__(self) -> "DataStore":
+        """Copies the store sharing all of its attributes."""
+        store = DataStore.__new__(DataStore)
+        store.__dict__.update(self.__dict__)
+        return store
+
+    def __reduce__(self) -> Tuple[Callable[..., "DataStore"], Tuple[bytes, bytes]]:
+        """Pickles the entries and the index of the store."""
+        rows, criteria = io.BytesIO(), io.BytesIO()
+        with self._lock:
+            state = {
+                k: v
+                for k, v in self.__dict__.items()
+                if k not in ("_owned", "_lock", "_shards", "stats")
+            }
+            lists = [i.rows for i in self.entries]
+            models = {type(j) for i in lists for j in i}
+            with gc_paused():
+                _RowPickler(rows, models).dump(lists)
+                _Pickler(criteria, lists).dump(state)
+        return _load_store, (rows.getvalue(), criteria.getvalue())
+
+    def append(
+        self,
+        calls: Sequence[Any],
+        wrapped: Sequence[Any],
+        fingerprints: Sequence[Optional[Hashable]],
+        rows: List[Any],
+        dynamic: bool = False,
+    ) -> DataEntry:
+        """Adds an entry to the store.
+
+        Args:
+            calls: The criteria calls as given by the user.
+            wrapped: The criteria calls wrapped for SQLAlchemy comparison.
+            fingerprints: The fingerprints of the wrapped calls or ``None``
+                for calls which cannot be fingerprinted.
+            rows: The result rows of the entry.
+            dynamic: Whether the rows are objects added to the session.
+
+        Returns:
+            The newly added entry.
+        """
+        with self._lock:
+            self._own_structure()
+            position = len(self.entries)
+            entry = DataEntry(calls, wrapped, fingerprints, rows, position, dynamic)
+            self.entries.append(entry)
+            if self._owned is not None:
+                self._owned.add(position)
+
+            for i in entry.required:
+                self._index.setdefault(i, []).append(position)
+            if not entry.required:
+                self._unindexed.append(position)
+            if entry.pending:
+                self._pending.append(position)
+            if len(calls) == 1 and fingerprints[0] is not None:
+                self._buckets.setdefault(fingerprints[0], position)
+
+        return entry
+
+    def add(self, call: Any, wrapped: Any, fingerprint: Any, rows: List[Any]) -> None:
+        """Adds rows to the first entry with only a given call or a new entry.
+
+        Finding the entry and adding the rows to it is atomic, hence rows
+        added at the same time by several threads all end up in one entry.
+
+        Args:
+            call: The criteria call as given by the user.
+            wrapped: The call wrapped for SQLAlchemy comparison.
+            fingerprint: The fingerprint of the call.
+            rows: The rows to add, owned by the entry if a new one is added.
+
+        For example::
+
+            >>> store = DataStore()
+            >>> store.add('a', 'a', 'a', [1])
+            >>> store.add('a', 'a', 'a', [2])
+            >>> store.match(['a'], ['a']).rows
+            [1, 2]
+            >>> store.match(['a'], ['a']).dynamic
+            True
+        """
+        if fingerprint is None:
+            shard = self._lock
+        else:
+            shard = self._shards.get(fingerprint) or self._shards.setdefault(
+                fingerprint, threading.Lock()
+            )
+        with shard:
+            entry = self.bucket(wrapped, fingerprint)
+            if entry is not None:
+                self.extend(entry, rows)
+            else:
+                self.append([call], [wrapped], [fingerprint], rows, dynamic=True)
+
+    def fork(self) -> "DataStore":
+        """Creates an independent store sharing the entries copy-on-write.
+
+        Returns:
+            A store with the same data whose mutations do not affect this
+            store and vice versa.
+
+        For example::
+
+            >>> store = DataStore()
+            >>> _ = store.append(['a'], ['a'], ['a'], [1])
+            >>> forked = store.fork()
+            >>> forked.extend(forked.bucket('a', 'a'), [2])
+            >>> forked.match(['a'], ['a']).rows
+            [1, 2]
+            >>> store.match(['a'], ['a']).rows
+            [1]
+        """
+        with self._lock:
+            self._owned = set()
+            forked = copy.copy(self)
+        forked._owned = set()
+        forked._lock = threading.Lock()
+        forked._shards = {}
+        forked.stats = None
+        return forked
+
+    def extend(self, entry: DataEntry, rows: Sequence[Any]) -> None:
+        """Adds rows to an entry of the store.
+
+        Args:
+            entry: The entry to add the rows to.
+            rows: The rows to add.
+        """
+        self._own(entry).extend(rows)
+
+    def clear(
+        self, entry: DataEntry, predicate: Optional[Callable[[Any], bool]] = None
+    ) -> int:
+        """Removes all rows of an entry or the rows satisfying a predicate.
+
+        Args:
+            entry: The entry to remove the rows of.
+            predicate: A function telling whether a row should be removed.
+
+        Returns:
+            The number of removed rows.
+        """
+        return self._own(entry).clear(predicate)
+
+    def _own(self, entry: DataEntry) -> DataEntry:
+        """Copies a shared entry before it is mutated."""
+        if self._owned is None:
+            return entry
+        with self._lock:
+            if entry.position in self._owned:
+                # another thread may have copied the entry in the meantime
+                return self.entries[entry.position]
+            self._own_structure()
+            entry = entry.copy()
+            self.entries[entry.position] = entry
+            self._owned.add(entry.position)
+            return entry
+
+    def _own_structure(self) -> None:
+        """Copies the shared entry list and index before they are mutated."""
+        # owning any entry implies the structure was already copied
+        if self._owned is None or self._owned:
+            return
+        self.entries = list(self.entries)
+        self._index = {k: list(v) for k, v in self._index.items()}
+        self._buckets = dict(self._buckets)
+        self._unindexed = list(self._unindexed)
+        self._pending = list(self._pending)
+
+    def match(
+        self, wrapped: Sequence[Any], fingerprints: Sequence[Optional[Hashable]]
+    ) -> Optional[DataEntry]:
+        """Finds the most specific entry whose criteria are all in given calls.
+
+        Args:
+            wrapped: The chain calls wrapped for SQLAlchemy comparison.
+            fingerprints: The fingerprints of the chain calls.
+
+        Returns:
+            The matching entry or ``None`` if no entry matches.
+        """
+        if any(i is None for i in fingerprints):
+            examined = len(self.entries)
+            candidates = [i for i in self.entries if i.matches(wrapped)]
+        else:
+            hits: "Counter[int]" = Counter()
+            for i in set(fingerprints):
+                hits.update(self._index.get(i, ()))
+            candidates = [
+                entry
+                for entry in (self.entries[i] for i in hits)
+                if hits[entry.position] == len(entry.required)
+            ]
+            candidates += [self.entries[i] for i in self._unindexed]
+            examined = len(hits) + len(self._unindexed)
+            candidates = [
+                entry
+                for entry in candidates
+                if all(c in wrapped for c in entry.pending)
+            ]
+        if self.stats is not None:
+            self.stats["entries_examined"] += examined
+        return min(candidates, key=lambda i: i.rank, default=None)
+
+    def containing(
+        self, wrapped: Any, fingerprint: Optional[Hashable]
+    ) -> List[DataEntry]:
+        """Finds all entries which have a given call among their criteria.
+
+        Args:
+            wrapped: The call wrapped for SQLAlchemy comparison.
+            fingerprint: The fingerprint of the call.
+
+        Returns:
+            The entries containing the call, most specific first.
+        """
+        if fingerprint is None:
+            entries = [i for i in self.entries if wrapped in i.wrapped]
+        else:
+            positions = set(self._index.get(fingerprint, ()))
+            positions.update(
+                i for i in self._pending if wrapped in self.entries[i].pending
+            )
+            entries = [self.entries[i] for i in positions]
+        return sorted(entries, key=lambda i: i.rank)
+
+    def bucket(
+        self, wrapped: Any, fingerprint: Optional[Hashable]
+    ) -> Optional[DataEntry]:
+        """Finds the first entry whose only criteria is the given call.
+
+        Args:
+            wrapped: The call wrapped for SQLAlchemy comparison.
+            fingerprint: The fingerprint of the call.
+
+        Returns:
+            The first entry with exactly the given criteria or ``None``.
+        """
+        candidates: Sequence[int]
+        if fingerprint is None:
+            candidates = range(len(self.entries))
+        else:
+            candidates = self._pending
+        positions = [
+            i
+            for i in candidates
+            if len(self.entries[i].calls) == 1 and self.entries[i].wrapped[0] == wrapped
+        ]
+        if fingerprint in self._buckets:
+            positions.append(self._buckets[fingerprint])
+        return self.entries[min(positions)] if positions else None
+
+    def get(self, wrapped: Any, fingerprint: Optional[Hashable], access: Any) -> Any:
+        """Gets a row by primary key among the entries containing a call.
+
+        Looks up the identity maps of the entries containing the call,
+        with rows of less specific entries taking precedence same as when
+        building a single identity map over all of their rows.
+
+        Args:
+            wrapped: The call wrapped for SQLAlchemy comparison.
+            fingerprint: The fingerprint of the call.
+            access: The primary key as accepted by ``get_item_attr``.
+
+        Returns:
+            The row with the given primary key or ``None``.
+        """
+        return self.get_many(wrapped, fingerprint, [to_identity_key(access)])[0]
+
+    def get_many(
+        self,
+        wrapped: Any,
+        fingerprint: Optional[Hashable],
+        keys: Iterable[Tuple[Any, ...]],
+    ) -> List[Any]:
+        """Gets rows by their identity keys among the entries containing a call.
+
+        Args:
+            wrapped: The call wrapped for SQLAlchemy comparison.
+            fingerprint: The fingerprint of the call.
+            keys: The identity keys of the rows.
+
+        Returns:
+            The row with each identity key or ``None`` if there is none.
+        """
+        entries = self.containing(wrapped, fingerprint)[::-1]
+        stats = self.stats
+        builds = 0 if stats is None else sum(i._builds for i in entries)
+        rows = []
+        for key in keys:
+            row = None
+            for entry in entries:
+                row = entry.get(key)
+                if row is not None:
+                    break
+            rows.append(row)
+        if stats is not None:
+            stats["identity_map_builds"] += sum(i._builds for i in entries) - builds
+        return rows
+
+
+def _load_store(rows: bytes, criteria: bytes) -> DataStore:
+    """Unpickles a store pickled by ``DataStore.__reduce__``."""
+    store = DataStore()
+    with gc_paused():
+        lists = pickle.loads(rows)  # noqa: S301
+        store.__dict__.update(_Unpickler(io.BytesIO(criteria), lists).load())
+    return store
@@ -3,17 +3,34 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import gc
+from collections import Counter
+from collections import defaultdict
 from contextlib import contextmanager
+from itertools import islice
+from operator import attrgetter
+from time import perf_counter
 from typing import Any
+from typing import Callable
+from typing import DefaultDict
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
 from typing import Sequence
 from typing import Tuple
 from typing import Type
 from typing import Union
+from weakref import WeakKeyDictionary
 
 from sqlalchemy import inspect
+from sqlalchemy.orm import configure_mappers
 from sqlalchemy.orm.exc import MultipleResultsFound
 
+_identity_getters: "WeakKeyDictionary[Any, Callable[[Any], Tuple[Any, ...]]]"
+_identity_getters = WeakKeyDictionary()
+
 
 def match_type(
     s: Union[bytes, str], t: Union[Type[bytes], Type[str]]
@@ -155,6 +172,98 @@ def setattr_tmp(obj: object, name: str, value: Any) -> Any:
         setattr(obj, name, original)
 
 
+@contextmanager
+def gc_paused() -> Any:
+    """Pause the garbage collector temporarily.
+
+    Utility for creating or changing many objects at once without the
+    garbage collector repeatedly scanning all of them.
+
+    Yields:
+        Used for the context manager so that this function can be used
+        as ``with gc_paused``.
+
+    For example::
+
+        >>> import gc
+        >>> with gc_paused():
+        ...     print(gc.isenabled())
+        False
+        >>> gc.isenabled()
+        True
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class Stats(object):
+    """Counters and cumulative timings of operations.
+
+    Collects how often each operation ran and for how long, along with
+    counters of events happening during the operations.
+
+    Attributes:
+        counts: The number of runs of each operation and of each event.
+        timings: The cumulative time in seconds spent in each operation.
+
+    For example::
+
+        >>> stats = Stats()
+        >>> for i in range(3):
+        ...     with stats.timed('all'):
+        ...         stats.counts['entries_examined'] += i
+        >>> stats.counts['all'], stats.counts['entries_examined']
+        (3, 3)
+        >>> stats.timings['all'] > 0
+        True
+    """
+
+    def __init__(self) -> None:
+        """Creates empty Stats."""
+        self.counts: "Counter[str]" = Counter()
+        self.timings: DefaultDict[str, float] = defaultdict(float)
+
+    def __repr__(self) -> str:
+        """Gets the representation of the counts and timings."""
+        return "Stats(counts={!r}, timings={!r})".format(
+            dict(self.counts), dict(self.timings)
+        )
+
+    @contextmanager
+    def timed(self, name: str) -> Any:
+        """Counts a run of an operation and adds its duration to its timing.
+
+        Args:
+            name: The name of the operation.
+
+        Yields:
+            Used for the context manager so that this function can be used
+            as ``with stats.timed(name)``.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += perf_counter() - start
+            self.counts[name] += 1
+
+    def copy(self) -> "Stats":
+        """Copies the counts and timings.
+
+        Returns:
+            Stats with the same counts and timings.
+        """
+        stats = Stats()
+        stats.counts.update(self.counts)
+        stats.timings.update(self.timings)
+        return stats
+
+
 def raiser(exp: Type[Exception], *args: Any, **kwargs: Any) -> Type[Exception]:
     """Raises an exception with the given args.
 
@@ -181,6 +290,114 @@ def raiser(exp: Type[Exception], *args: Any, **kwargs: Any) -> Type[Exception]:
     raise exp(*args, **kwargs)
 
 
+def identity_getter(cls: Type[Any]) -> Callable[[Any], Tuple[Any, ...]]:
+    """Gets the identity key extractor of a SQLAlchemy model.
+
+    Utility for getting a function which extracts the primary key values
+    of objects of the given model. The mapper is inspected only once per
+    model and the extractor is cached afterwards.
+
+    Args:
+        cls: A SQLAlchemy model.
+
+    Returns:
+        A function returning the identity key of an object of the model.
+
+    For example::
+
+        >>> from sqlalchemy import Column, Integer
+        >>> from sqlalchemy.ext.declarative import declarative_base
+
+        >>> Base = declarative_base()
+
+        >>> class SomeClass(Base):
+        ...     __tablename__ = 'some_table'
+        ...     pk1 = Column(Integer, primary_key=True)
+
+        >>> getter = identity_getter(SomeClass)
+        >>> getter(SomeClass(pk1=1))
+        (1,)
+        >>> identity_getter(SomeClass) is getter
+        True
+    """
+    getter = _identity_getters.get(cls)
+    if getter is None:
+        mapper = inspect(cls).mapper
+        pk_keys = sorted(
+            mapper.get_property_by_column(c).key for c in mapper.primary_key
+        )
+        getter = attrgetter(*pk_keys)
+        if len(pk_keys) == 1:
+            getter = _as_tuple(getter)
+        _identity_getters[cls] = getter
+    return getter
+
+
+def _as_tuple(getter: Callable[[Any], Any]) -> Callable[[Any], Tuple[Any, ...]]:
+    """Wraps a single attribute getter to return a tuple."""
+
+    def _getter(item: Any) -> Tuple[Any, ...]:
+        return (getter(item),)
+
+    return _getter
+
+
+def identity_key(item: Any) -> Tuple[Any, ...]:
+    """Gets the identity key of a SQLAlchemy object.
+
+    Utility for getting the primary key values of a SQLAlchemy object
+    ordered by the names of the primary key attributes.
+
+    Args:
+        item: A SQLAlchemy object.
+
+    Returns:
+        A tuple of the primary key values of the object.
+
+    For example::
+
+        >>> from sqlalchemy import Column, Integer
+        >>> from sqlalchemy.ext.declarative import declarative_base
+
+        >>> Base = declarative_base()
+
+        >>> class SomeClass(Base):
+        ...     __tablename__ = 'some_table'
+        ...     pk2 = Column(Integer, primary_key=True)
+        ...     pk1 = Column(Integer, primary_key=True)
+
+        >>> identity_key(SomeClass(pk1=1, pk2=2))
+        (1, 2)
+    """
+    return identity_getter(type(item))(item)
+
+
+def iter_chunks(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Splits items into lists of a given size lazily.
+
+    Utility for consuming an iterable chunk by chunk without materializing
+    it, e.g. to mock partitions of a streamed result.
+
+    Args:
+        items: The items to split.
+        size: The maximum number of items of each chunk.
+
+    Yields:
+        Lists of the next items until the items are exhausted.
+
+    For example::
+
+        >>> list(iter_chunks(range(5), 2))
+        [[0, 1], [2, 3], [4]]
+    """
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def build_identity_map(items: Sequence[Any]) -> Dict:
     """Builds identity map.
 
@@ -211,18 +428,96 @@ def build_identity_map(items: Sequence[Any]) -> Dict:
         {(1, 2): 1}
     """
     idmap = {}
+    cls: Optional[type] = None
 
     for i in items:
-        mapper = inspect(type(i)).mapper
-        pk_keys = tuple(
-            mapper.get_property_by_column(c).key for c in mapper.primary_key
-        )
-        pk = tuple(getattr(i, k) for k in sorted(pk_keys))
-        idmap[pk] = i
+        if type(i) is not cls:
+            cls = type(i)
+            getter = identity_getter(cls)
+        idmap[getter(i)] = i
 
     return idmap
 
 
+def build_objects(model: Any, mappings: Iterable[Dict[str, Any]]) -> List[Any]:
+    """Builds SQLAlchemy objects from mappings of their attribute values.
+
+    Utility for creating many objects at once the way ``bulk_insert_mappings``
+    treats them, i.e. without calling their constructors. Keys which are not
+    mapped attributes of the model are ignored.
+
+    Args:
+        model: A SQLAlchemy model or its mapper.
+        mappings: Dictionaries of the attribute values of each object.
+
+    Returns:
+        A list of the new objects.
+
+    For example::
+
+        >>> from sqlalchemy import Column, Integer, String
+        >>> from sqlalchemy.ext.declarative import declarative_base
+
+        >>> Base = declarative_base()
+
+        >>> class SomeClass(Base):
+        ...     __tablename__ = 'some_table'
+        ...     pk1 = Column(Integer, primary_key=True)
+        ...     name =  Column(String(50))
+
+        >>> objs = build_objects(SomeClass, [{"pk1": 1, "name": "a", "b": 2}])
+        >>> objs[0].pk1, objs[0].name, hasattr(objs[0], "b")
+        (1, 'a', False)
+    """
+    mapper = inspect(model).mapper
+    configure: Callable[[], None] = configure_mappers
+    configure()
+    new_instance = mapper.class_manager.new_instance
+    keys = frozenset(mapper.attrs.keys())
+    objs = []
+    with gc_paused():
+        for mapping in mappings:
+            obj = new_instance()
+            if keys.issuperset(mapping):
+                obj.__dict__.update(mapping)
+            else:
+                obj.__dict__.update((k, v) for k, v in mapping.items() if k in keys)
+            objs.append(obj)
+    return objs
+
+
+def to_identity_key(
+    access: Union[Dict[str, Any], Tuple[Any, ...], Any]
+) -> Tuple[Any, ...]:
+    """Converts a primary key access pattern into an identity key.
+
+    Utility for normalizing the different ways a primary key can be given
+    to ``get`` into the key used by identity maps.
+
+    Args:
+        access: The access pattern which should either be basic data type,
+            dictionary, or a tuple as described in ``get_item_attr``.
+
+    Returns:
+        A tuple of the primary key values.
+
+    For example::
+
+        >>> to_identity_key(1)
+        (1,)
+        >>> to_identity_key({"pk2": 2, "pk1": 1})
+        (1, 2)
+        >>> to_identity_key((1, 2))
+        (1, 2)
+    """
+    if isinstance(access, dict):
+        return tuple(access[names] for names in sorted(access))
+    elif isinstance(access, tuple):
+        return access
+    else:
+        return (access,)
+
+
 def get_item_attr(idmap: Dict, access: Union[Dict, Tuple, Any]) -> Any:
     """Access dictionary in different methods.
 
@@ -250,15 +545,7 @@ def get_item_attr(idmap: Dict, access: Union[Dict, Tuple, Any]) -> Any:
         >>> get_item_attr(idmap, (1,))
         2
     """
-    if isinstance(access, dict):
-        keys = []
-        for names in sorted(access):
-            keys.append(access[names])
-        return idmap.get(tuple(keys))
-    elif isinstance(access, tuple):
-        return idmap.get(access)
-    else:
-        return idmap.get((access,))
+    return idmap.get(to_identity_key(access))
 
 
 def get_scalar(rows: Sequence[Any]) -> Any:
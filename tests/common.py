@@ -1,6 +1,8 @@
 """Common data models for testing."""
 from __future__ import annotations
 
+import time
+from collections import OrderedDict
 from typing import Any
 
 from sqlalchemy import Column
@@ -92,3 +94,12 @@ class Concrete(BaseModel):
     def __eq__(self, other: Concrete) -> bool:
         """Equality override."""
         return self.id == other.id
+
+
+class YieldingDict(OrderedDict):
+    """Ordered dict letting other threads run while reordering keys."""
+
+    def move_to_end(self, key: Any, last: bool = True) -> None:
+        """Moves a key to the end of the dict after yielding to other threads."""
+        time.sleep(0)
+        super().move_to_end(key, last)
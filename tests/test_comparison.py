@@ -1,15 +1,31 @@
 """Testing the module for comparison in mock-alchemy."""
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 
 import pytest
 import sqlalchemy
 from packaging import version
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import Table
+from sqlalchemy import and_
+from sqlalchemy import bindparam
 from sqlalchemy import func
+from sqlalchemy import literal_column
+from sqlalchemy import not_
+from sqlalchemy import or_
 from sqlalchemy import select
 from sqlalchemy.sql.expression import column
 
+from mock_alchemy.comparison import CompileCache
 from mock_alchemy.comparison import ExpressionMatcher
 from mock_alchemy.comparison import PrettyExpression
+from mock_alchemy.comparison import compile_cache
+from mock_alchemy.comparison import fingerprint
+
+from .common import Model
+from .common import YieldingDict
 
 
 def test_pretty_expression() -> None:
@@ -22,6 +38,49 @@ def test_pretty_expression() -> None:
     assert str(PrettyExpression(PrettyExpression(15))) == "15"
 
 
+def test_compile_cache() -> None:
+    """Tests caching of compiled SQLAlchemy expressions."""
+    c = column("column")
+    cache = CompileCache(maxsize=2)
+    e1 = c == 5
+    e2 = c == 10
+    e3 = c.in_(["foo", "bar"])
+    assert cache.compile(e1) == ('"column" = :column_1', {"column_1": 5})
+    assert cache.compile(e1) == ('"column" = :column_1', {"column_1": 5})
+    assert cache.info() == (1, 1, 2, 1)
+    cache.compile(e2)
+    cache.compile(e1)
+    cache.compile(e3)
+    assert cache.info() == (2, 3, 2, 2)
+    cache.compile(e2)
+    assert cache.info() == (2, 4, 2, 2)
+    cache.clear()
+    assert cache.info() == (0, 0, 2, 0)
+
+
+def test_compile_cache_threads() -> None:
+    """Tests compiling and evicting expressions from several threads at once."""
+    cache = CompileCache(maxsize=2)
+    cache._cache = YieldingDict()
+    c = column("column")
+    exprs = [c == i for i in range(3)]
+
+    def compile_many(worker: int) -> int:
+        misses = cache.thread_misses()
+        for i in range(300):
+            key = (i + worker) % 3
+            assert cache.compile(exprs[key])[1] == {"column_1": key}
+        return cache.thread_misses() - misses
+
+    with ThreadPoolExecutor(8) as executor:
+        misses = list(executor.map(compile_many, range(8)))
+    info = cache.info()
+    assert info.hits + info.misses == 2400
+    assert info.currsize == 2
+    assert sum(misses) == info.misses
+    assert cache.thread_misses() == 0
+
+
 def test_expression_matcher() -> None:
     """Tests expression matching of SQLAlchemy expressions."""
     c = column("column")
@@ -54,6 +113,100 @@ def test_expression_matcher() -> None:
     )
 
 
+def test_expression_matcher_hash() -> None:
+    """Tests hashing of SQLAlchemy expressions consistently with equality."""
+    c = column("column")
+    pairs = [
+        (c == "foo", c == "foo"),
+        (c.in_(["foo", "bar"]), c.in_(["foo", "bar"])),
+        (c.label("foo"), c.label("bar")),
+        ([c == "foo", 5], [c == "foo", 5]),
+        ([c == "foo"], [c == "foo", None]),
+        ({"foo": c == "foo", "bar": 5}, {"bar": 5, "foo": c == "foo"}),
+    ]
+    for left, right in pairs:
+        assert ExpressionMatcher(left) == right
+        assert fingerprint(left) == fingerprint(right)
+        assert hash(ExpressionMatcher(left)) == hash(ExpressionMatcher(right))
+    assert fingerprint(c == "foo") != fingerprint(c == "bar")
+    assert fingerprint([c == "foo"]) != fingerprint((c == "foo",))
+    lookup = {ExpressionMatcher(c == "foo"): 1, ExpressionMatcher(c == "bar"): 2}
+    assert lookup[ExpressionMatcher(c == "bar")] == 2
+    with pytest.raises(TypeError):
+        hash(ExpressionMatcher(mock.ANY))
+    with pytest.raises(TypeError):
+        fingerprint({"foo": [mock.ANY]})
+    with pytest.raises(TypeError):
+        fingerprint([{"unhashable"}, []])
+
+
+def test_expression_matcher_structure() -> None:
+    """Tests comparing simple expressions without compiling them."""
+    c = column("column")
+    misses = compile_cache.info().misses
+    assert ExpressionMatcher(and_(c == 5, c.in_([1, 2]))) == and_(c == 5, c.in_([1, 2]))
+    assert ExpressionMatcher(Model.pk1 == 5) != (Model.pk1 == 6)
+    assert ExpressionMatcher(c.desc()) != c.asc()
+    assert ExpressionMatcher(c.label("foo") == 5) != (c == 5)
+    assert compile_cache.info().misses == misses
+
+
+def test_expression_matcher_structure_agrees() -> None:
+    """Tests comparing expressions structurally agrees with compiling them."""
+    c = column("column")
+    table = Table("model_table", MetaData(), Column("pk1", Integer))
+    keyed = Table("model_table", MetaData(), Column("pk1", Integer, key="key"))
+    expressions = [
+        c == 5,
+        c == 5.0,
+        c == True,  # noqa: E712
+        c == 1,
+        c != 5,
+        ~(c == 5),
+        c == None,  # noqa: E711
+        c.is_(None),
+        c.isnot(None),
+        c.label("foo") == 5,
+        literal_column("column") == 5,
+        literal_column("c") == 5,
+        column("c") == 5,
+        column("column", Integer) == 5,
+        c == bindparam("column_1", 5),
+        c.op("=")(5),
+        Model.pk1 == 5,
+        Model.__table__.c.pk1 == 5,
+        table.c.pk1 == 5,
+        keyed.c.key == 5,
+        c.in_([1, 2]),
+        c.in_((1, 2)),
+        c.in_([2, 1]),
+        c.notin_([1, 2]),
+        c.between(1, 2),
+        c.like("a%"),
+        c.like("a%", escape="/"),
+        func.lower(c) == "a",
+        and_(c == 1, c == 2),
+        and_(c == 1, and_(c == 2, c == 3)),
+        and_(c == 1, c == 2, c == 3),
+        and_(c == 1, or_(c == 2, c == 3)),
+        or_(c == 1, c == 2, c == 3),
+        not_(and_(c == 1, c == 2)),
+        c.asc(),
+        c.desc(),
+        Model.pk1.asc(),
+        c.asc().nulls_first(),
+        c.label("foo"),
+        c.label("bar"),
+        column("column2").label("foo"),
+    ]
+    for left in expressions:
+        for right in expressions:
+            compiled = type(left) is type(right) and compile_cache.compile(
+                left
+            ) == compile_cache.compile(right)
+            assert (ExpressionMatcher(left) == right) is compiled, (left, right)
+
+
 @pytest.mark.skipif(
     version.parse(sqlalchemy.__version__) < version.parse("1.4.0"),
     reason="requires sqlalchemy 1.4.0 or higher to run",
@@ -69,3 +222,53 @@ def test_expression_matcher_select() -> None:
     assert ExpressionMatcher(e6) != e8
     assert ExpressionMatcher(e6) != e9
     assert ExpressionMatcher(e8) != e9
+
+
+@pytest.mark.skipif(
+    version.parse(sqlalchemy.__version__) < version.parse("1.4.0"),
+    reason="requires sqlalchemy 1.4.0 or higher to run",
+)
+def test_expression_matcher_cache_key() -> None:
+    """Tests comparing expressions by their cache keys before compiling."""
+    c = column("column")
+    s1 = select(Model).where(Model.pk1 == 5, func.lower(Model.name) == "a")
+    s2 = select(Model).where(Model.pk1 == 5, func.lower(Model.name) == "a")
+    s3 = select(Model).where(Model.pk1 == 6, func.lower(Model.name) == "a")
+    misses = compile_cache.info().misses
+    assert ExpressionMatcher(s1) == s2
+    assert ExpressionMatcher(func.lower(c) == "a") == (func.lower(c) == "a")
+    assert compile_cache.info().misses == misses
+    assert ExpressionMatcher(s1) != s3
+    assert ExpressionMatcher(func.lower(column("column", Integer)) == "a") == (
+        func.lower(c) == "a"
+    )
+    assert ExpressionMatcher(func.lower(c).label("foo")) == func.lower(c).label("bar")
+    assert ExpressionMatcher(c.regexp_match("a")) == c.regexp_match("a", flags="i")
+
+
+@pytest.mark.skipif(
+    version.parse(sqlalchemy.__version__) < version.parse("1.4.0"),
+    reason="requires sqlalchemy 1.4.0 or higher to run",
+)
+def test_expression_matcher_dialect() -> None:
+    """Tests comparing expressions as compiled for a given dialect."""
+    c = column("column")
+    r1 = c.regexp_match("foo")
+    r2 = c.regexp_match("foo", flags="i")
+    assert ExpressionMatcher(r1) == r2
+    assert ExpressionMatcher(r1, "postgresql") != r2
+    assert ExpressionMatcher([r1], "postgresql") != [r2]
+    assert ExpressionMatcher(ExpressionMatcher(r1, "postgresql")).dialect == (
+        "postgresql"
+    )
+    assert fingerprint(r1) == fingerprint(r2)
+    assert fingerprint(r1, "postgresql") != fingerprint(r2, "postgresql")
+    assert fingerprint(ExpressionMatcher(r1, "postgresql")) == fingerprint(
+        r1, "postgresql"
+    )
+    assert "~" in repr(PrettyExpression(r1, "postgresql"))
+    cache = CompileCache()
+    cache.compile(r1)
+    cache.compile(r1, "postgresql")
+    cache.compile(r1, "postgresql")
+    assert cache.info() == (1, 2, 4096, 2)
@@ -0,0 +1,224 @@
+"""Testing the module for evaluation in mock-alchemy."""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import List
+
+import pytest
+from sqlalchemy import and_
+from sqlalchemy import func
+from sqlalchemy import not_
+from sqlalchemy import or_
+from sqlalchemy.sql.expression import column
+
+from mock_alchemy.evaluation import PredicateCache
+from mock_alchemy.evaluation import UnsupportedExpressionError
+from mock_alchemy.evaluation import chain_equalities
+from mock_alchemy.evaluation import chain_order_by
+from mock_alchemy.evaluation import chain_predicate
+from mock_alchemy.evaluation import chain_slice
+from mock_alchemy.evaluation import chain_sort_key
+from mock_alchemy.evaluation import compile_predicate
+from mock_alchemy.evaluation import compile_sort_key
+from mock_alchemy.evaluation import iter_rows
+from mock_alchemy.evaluation import select_rows
+
+from .common import Model
+from .common import SomeClass
+from .common import YieldingDict
+
+ROWS = [
+    SomeClass(pk1=i, pk2=i % 3, name=None if i % 4 == 0 else "n%d" % i)
+    for i in range(10)
+]
+
+
+def evaluate(expr: Any) -> List[int]:
+    """Gets the primary keys of the rows satisfying an expression."""
+    predicate = compile_predicate(expr, SomeClass)
+    return [i.pk1 for i in ROWS if predicate(i)]
+
+
+def test_compile_predicate() -> None:
+    """Tests evaluating supported expressions against objects."""
+    assert evaluate(SomeClass.pk1 >= 7) == [7, 8, 9]
+    assert evaluate(SomeClass.pk1 == SomeClass.pk2) == [0, 1, 2]
+    assert evaluate(SomeClass.name == None) == [0, 4, 8]  # noqa: E711
+    assert evaluate(SomeClass.name != "n1") == [2, 3, 5, 6, 7, 9]
+    assert evaluate(SomeClass.pk1.in_([1, 2, 3])) == [1, 2, 3]
+    assert evaluate(~SomeClass.pk1.in_([1, 2, 3])) == [0, 4, 5, 6, 7, 8, 9]
+    assert evaluate(SomeClass.name.like("n_")) == [1, 2, 3, 5, 6, 7, 9]
+    assert evaluate(SomeClass.name.ilike("N1%")) == [1]
+    assert evaluate(SomeClass.pk1.like("1%")) == [1]
+    assert evaluate(SomeClass.name.like("n/_", escape="/")) == []
+    assert evaluate(SomeClass.name.ilike("/N1%", escape="/")) == [1]
+    assert evaluate(or_(SomeClass.pk1 < 2, SomeClass.pk1 > 8)) == [0, 1, 9]
+    assert evaluate(not_(or_(SomeClass.name == "n1", SomeClass.pk1 == 5))) == [
+        2,
+        3,
+        6,
+        7,
+        9,
+    ]
+    assert evaluate(~SomeClass.name.in_(["n1"])) == [2, 3, 5, 6, 7, 9]
+    assert evaluate(or_(SomeClass.name == "n1", SomeClass.pk1 == 4)) == [1, 4]
+    assert 4 not in evaluate(not_(and_(SomeClass.name == "n1", SomeClass.pk1 == 4)))
+    assert evaluate(not_(and_(SomeClass.pk1 > 2, SomeClass.pk2 == 0))) == [
+        0,
+        1,
+        2,
+        4,
+        5,
+        7,
+        8,
+    ]
+
+
+def test_compile_predicate_unsupported() -> None:
+    """Tests rejecting expressions which cannot be evaluated."""
+    with pytest.raises(UnsupportedExpressionError):
+        compile_predicate(column("column") == 1, SomeClass)
+    with pytest.raises(UnsupportedExpressionError):
+        compile_predicate(func.lower(SomeClass.name) == "n1", SomeClass)
+    with pytest.raises(UnsupportedExpressionError):
+        compile_predicate(Model.pk1 == 1, SomeClass)
+    with pytest.raises(UnsupportedExpressionError):
+        compile_predicate(SomeClass.pk1 == 1, "foo")
+    with pytest.raises(UnsupportedExpressionError):
+        compile_predicate(SomeClass.name.like("n/", escape="/"), SomeClass)
+
+
+def test_predicate_cache() -> None:
+    """Tests caching predicates by model and expression fingerprint."""
+    cache = PredicateCache(maxsize=1)
+    predicate = cache.compile(SomeClass.pk1 == 1, SomeClass)
+    assert cache.compile(SomeClass.pk1 == 1, SomeClass) is predicate
+    assert cache.compile(column("column") == 1, SomeClass) is None
+    assert cache.compile(SomeClass.pk1 == 1, SomeClass) is not predicate
+    assert cache.info() == (1, 3, 1, 1)
+
+
+def test_predicate_cache_threads() -> None:
+    """Tests compiling and evicting predicates from several threads at once."""
+    cache = PredicateCache(maxsize=2)
+    cache._cache = YieldingDict()
+    exprs = [SomeClass.pk1 == i for i in range(3)]
+
+    def compile_many(worker: int) -> None:
+        for i in range(300):
+            key = (i + worker) % 3
+            assert cache.compile(exprs[key], SomeClass)(SomeClass(pk1=key))
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(compile_many, range(8)))
+    info = cache.info()
+    assert info.hits + info.misses == 2400
+    assert info.currsize == 2
+
+
+def test_chain_predicate() -> None:
+    """Tests combining the criteria of query calls."""
+    calls = [
+        ("query", (SomeClass,), {}),
+        ("filter", (SomeClass.pk1 > 2,), {}),
+        ("order_by", (SomeClass.pk1,), {}),
+        ("filter_by", (), {"pk2": 0}),
+    ]
+    predicate = chain_predicate(SomeClass, calls)
+    assert [i.pk1 for i in ROWS if predicate(i)] == [3, 6, 9]
+    predicate = chain_predicate(SomeClass, [("filter_by", (), {"name": None})])
+    assert [i.pk1 for i in ROWS if predicate(i)] == [0, 4, 8]
+    assert chain_predicate(SomeClass, calls[:1]) is None
+    assert chain_predicate(SomeClass, [("filter_by", (), {"foo": 1})]) is None
+    assert chain_predicate(SomeClass, [("where", (column("c") == 1,), {})]) is None
+
+
+def test_chain_equalities() -> None:
+    """Tests finding equality criteria which can use hash indexes."""
+    calls = [
+        ("query", (SomeClass,), {}),
+        ("filter", (and_(SomeClass.pk1 == 1, SomeClass.pk2 > 1),), {}),
+        ("filter", (or_(SomeClass.pk1 == 2, SomeClass.pk2 == 2),), {}),
+        ("where", (SomeClass.name.in_(["a"]), 3 == SomeClass.pk2), {}),
+        ("filter_by", (), {"name": "a", "pk2": None}),
+        ("filter", (column("column") == 1, SomeClass.name == None), {}),  # noqa
+    ]
+    assert chain_equalities(SomeClass, calls) == [
+        ("pk1", 1),
+        ("pk2", 3),
+        ("name", "a"),
+    ]
+    assert chain_equalities("foo", calls) == []
+
+
+def test_compile_sort_key() -> None:
+    """Tests sorting objects by ordering expressions."""
+
+    def order(*exprs: Any) -> List[int]:
+        key = compile_sort_key(exprs, SomeClass)
+        return [i.pk1 for i in sorted(ROWS, key=key)]
+
+    assert order(SomeClass.pk2, SomeClass.pk1.desc()) == [9, 6, 3, 0, 7, 4, 1, 8, 5, 2]
+    assert order(SomeClass.name)[-3:] == [0, 4, 8]
+    assert order(SomeClass.name.desc())[:4] == [0, 4, 8, 9]
+    assert order(SomeClass.name.asc().nullsfirst())[:4] == [0, 4, 8, 1]
+    assert order(SomeClass.name.desc().nullslast())[-4:] == [1, 0, 4, 8]
+    with pytest.raises(UnsupportedExpressionError):
+        compile_sort_key((column("column"),), SomeClass)
+    with pytest.raises(UnsupportedExpressionError):
+        compile_sort_key((func.lower(SomeClass.name),), SomeClass)
+    with pytest.raises(UnsupportedExpressionError):
+        compile_sort_key((SomeClass.pk1,), "foo")
+
+
+def test_chain_sort_key_and_slice() -> None:
+    """Tests getting the ordering, offset and limit of query calls."""
+    calls = [
+        ("query", (SomeClass,), {}),
+        ("order_by", (SomeClass.name, None, SomeClass.pk2), {}),
+        ("order_by", (SomeClass.pk1.desc(),), {}),
+        ("limit", (5, 3), {}),
+        ("offset", (2,), {}),
+    ]
+    key = chain_sort_key(SomeClass, calls)
+    assert [i.pk1 for i in sorted(ROWS, key=key)][:4] == [9, 6, 3, 0]
+    assert chain_sort_key(SomeClass, calls) is key
+    assert chain_sort_key(SomeClass, calls[:1]) is None
+    assert chain_sort_key(SomeClass, [("order_by", ("name",), {})]) is None
+    assert chain_order_by([("order_by", ("name",), {})]) == ("name",)
+    assert chain_order_by(calls[:1]) == ()
+    assert chain_slice(calls) == (2, 3)
+    assert chain_slice(calls[:1]) == (0, None)
+    assert chain_slice([("limit", (column("column"),), {})]) == (0, None)
+    assert chain_slice([("offset", (None,), {})]) == (0, None)
+
+
+def test_select_rows() -> None:
+    """Tests filtering, sorting and slicing rows."""
+    evaluated = []
+
+    def predicate(row: int) -> bool:
+        evaluated.append(row)
+        return row % 2 == 0
+
+    assert select_rows(range(100), predicate, offset=2, limit=3) == [4, 6, 8]
+    assert evaluated == list(range(9))
+    key = lambda row: (-row,)  # noqa: E731
+    assert select_rows(range(10), None, key, 1, 2) == [8, 7]
+    assert select_rows(range(10), predicate, key, 3) == [2, 0]
+    assert select_rows(range(3)) == [0, 1, 2]
+    assert select_rows(range(3), limit=0) == []
+
+
+def test_iter_rows() -> None:
+    """Tests selecting rows lazily."""
+    evaluated = []
+
+    def predicate(row: int) -> bool:
+        evaluated.append(row)
+        return row % 2 == 0
+
+    rows = iter_rows(range(100), predicate, offset=1)
+    assert next(rows) == 2
+    assert evaluated == [0, 1, 2]
+    assert next(iter_rows([3, 1, 2], key=lambda row: (row,))) == 1
+    assert list(iter_rows(range(5), offset=2, limit=2)) == [2, 3]
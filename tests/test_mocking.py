@@ -1,15 +1,33 @@
 """Testing the module for mocking in mock-alchemy."""
 from __future__ import annotations
 
+import asyncio
+import contextvars
+import gc
+import sys
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import List
 from unittest import mock
 
 import pytest
+import sqlalchemy
+from packaging import version
+from sqlalchemy import func
 from sqlalchemy import or_
+from sqlalchemy import select
 from sqlalchemy.orm.exc import MultipleResultsFound
 from sqlalchemy.sql.expression import column
 
 from mock_alchemy.comparison import ExpressionMatcher
 from mock_alchemy.mocking import AlchemyMagicMock
+from mock_alchemy.mocking import AsyncResult
+from mock_alchemy.mocking import AsyncUnifiedAlchemyMagicMock
+from mock_alchemy.mocking import BoundedCallList
+from mock_alchemy.mocking import QueryChain
+from mock_alchemy.mocking import Result
 from mock_alchemy.mocking import UnifiedAlchemyMagicMock
 from mock_alchemy.mocking import UnorderedCall
 from mock_alchemy.mocking import UnorderedTuple
@@ -33,12 +51,32 @@ def test_unorder_tuple() -> None:
     assert not UnorderedTuple((7, 2, 3)).__eq__((1, 2, 5))
 
 
+def test_unorder_tuple_expressions() -> None:
+    """Tests unordered comparison of expressions and unhashable elements."""
+    c = column("column")
+    left = UnorderedTuple([ExpressionMatcher(c == i) for i in range(20)])
+    assert left == tuple(c == i for i in reversed(range(20)))
+    assert left != tuple(c == i for i in range(1, 21))
+    e = ExpressionMatcher
+    assert UnorderedTuple((e(c == 1), e(mock.ANY), e([1]))) == (
+        e([1]),
+        e(c == 2),
+        e(c == 1),
+    )
+    assert UnorderedTuple((e(c == 1), e([1]))) != (e([2]), e(c == 1))
+    assert UnorderedTuple((1, 2)) == (2.0, 1.0)
+    assert UnorderedTuple((1, 1, 2)) != (1, 2, 2)
+
+
 def test_unorder_call() -> None:
     """Tests call in which, in comparison order does not matter."""
     call = type(mock.call)
     assert UnorderedCall(((1, 2, 3), {"hello": "world"})) == call(
         ((3, 2, 1), {"hello": "world"})
     )
+    assert UnorderedCall(("filter", (1, 2), {})) == call(("filter", (2, 1), {}))
+    assert UnorderedCall(("filter", (1, 2), {})) != call(("where", (2, 1), {}))
+    assert UnorderedCall(("filter", (1, 2), {})) != call(("filter", (2, 2), {}))
 
 
 def test_alchemy_call() -> None:
@@ -66,6 +104,150 @@ def test_alchemy_magic_mock() -> None:
         _ = s.filter.assert_called_once_with(c == 10)
 
 
+def test_bounded_call_list() -> None:
+    """Tests keeping only the most recent calls."""
+    calls = BoundedCallList(maxlen=2)
+    calls.extend([mock.call(1), mock.call(2), mock.call(3)])
+    assert calls == [mock.call(2), mock.call(3)]
+    assert calls != [mock.call(1), mock.call(2)]
+    assert calls[-1] == mock.call(3)
+    assert calls[:1] == [mock.call(2)]
+    assert [mock.call(2), mock.call(3)] in calls
+    assert [mock.call(3), mock.call(2)] not in calls
+    assert repr(calls) == "[call(2), call(3)]"
+    recorded = []
+    calls = BoundedCallList([mock.call(1)], maxlen=1, observer=recorded.append)
+    calls.append(mock.call(2))
+    assert calls == [mock.call(2)]
+    assert recorded == [mock.call(1), mock.call(2)]
+
+
+def test_bounded_call_list_wrapped() -> None:
+    """Tests keeping the calls wrapped as they are recorded and evicted."""
+    c = column("column")
+    calls = BoundedCallList(maxlen=3)
+    calls.extend([mock.call.filter(c == i) for i in range(3)])
+    wrapped = calls.wrapped()
+    assert wrapped == [sqlalchemy_call(mock.call(c == i)) for i in range(3)]
+    calls.append(mock.call.filter(c == 3))
+    assert calls.wrapped() is wrapped
+    assert wrapped == [sqlalchemy_call(mock.call(c == i)) for i in range(1, 4)]
+    expected = [sqlalchemy_call(mock.call(c == i)) for i in (2, 3)]
+    assert calls.has_calls(expected)
+    assert not calls.has_calls(expected[::-1])
+    assert calls.has_calls(expected[::-1], any_order=True)
+    assert not calls.has_calls([sqlalchemy_call(mock.call(c == 0))])
+    assert not calls.has_calls([sqlalchemy_call(mock.call(mock.ANY))])
+    assert not calls.has_calls(expected * 2, any_order=True)
+    assert calls.has_calls([])
+    calls.remove_at(1)
+    assert calls.wrapped() is wrapped
+    assert wrapped == [sqlalchemy_call(mock.call(c == i)) for i in (1, 3)]
+    assert not calls.has_calls([sqlalchemy_call(mock.call(c == 2))], any_order=True)
+    assert calls.wrapped("postgresql") is not wrapped
+
+
+def test_query_chain() -> None:
+    """Tests tracking and merging the calls of the current query."""
+    chain = QueryChain(enders={"all", "delete"})
+    assert chain.merge("filter") is None
+    for i in [mock.call.query(1), mock.call.filter(2), mock.call.order_by(3)]:
+        chain.record(i)
+    assert chain.merge("filter") is None
+    chain.record(mock.call.filter(4))
+    assert chain.merge("filter") == (mock.call.filter(2), mock.call.filter(4))
+    assert chain.calls == [mock.call.query(1), mock.call.order_by(3)]
+    chain.record(mock.call.filter(2, 4))
+    chain.record(mock.call.delete())
+    assert chain.ended
+    assert len(chain) == 3
+    chain.record(mock.call.all())
+    assert chain.calls == []
+    chain.record(mock.call.query(5))
+    assert not chain.ended
+    assert chain.calls == [mock.call.query(5)]
+
+
+def test_query_chain_fetchers() -> None:
+    """Tests keeping ended chains and their cursors for consecutive fetches."""
+    chain = QueryChain(enders={"all"}, fetchers={"fetchmany"})
+    chain.record(mock.call.query(1))
+    chain.record(mock.call.fetchmany(2))
+    assert chain.ended
+    chain.cursor = iter([1, 2])
+    chain.record(mock.call.fetchmany(2))
+    assert chain.calls == [mock.call.query(1)]
+    assert chain.cursor is not None
+    chain.record(mock.call.query(2))
+    assert chain.calls == [mock.call.query(2)]
+    assert chain.cursor is None
+    chain.record(mock.call.all())
+    chain.record(mock.call.fetchmany(2))
+    assert chain.calls == [mock.call.query(2)]
+
+
+def test_alchemy_magic_mock_bounded_history() -> None:
+    """Tests bounding the call history of mocks and their children."""
+    c = column("column")
+    s = AlchemyMagicMock(max_history=3)
+    for i in range(10):
+        s.query(Model).filter(c == i).all()
+    assert len(s.mock_calls) == 3
+    assert len(s.query.return_value.filter.call_args_list) == 3
+    s.query.return_value.filter.assert_called_with(c == 9)
+    assert s.call_counts == {
+        "query": 10,
+        "query().filter": 10,
+        "query().filter().all": 10,
+    }
+    s.reset_mock()
+    assert isinstance(s.mock_calls, BoundedCallList)
+    assert s.call_counts == {}
+    s.filter(c == 1)
+    s.filter.assert_called_once_with(c == 1)
+
+
+def test_alchemy_magic_mock_repeated_asserts() -> None:
+    """Tests asserting many times without wrapping the history again."""
+    c = column("column")
+    s = AlchemyMagicMock()
+    for i in range(100):
+        s.filter(c == i)
+    s.filter.assert_any_call(c == 0)
+    s.assert_has_calls([mock.call.filter(c == 1), mock.call.filter(c == 2)])
+    wrapped = s.filter.call_args_list.wrapped()
+    for i in range(100):
+        s.filter.assert_any_call(c == i)
+        s.assert_has_calls([mock.call.filter(c == i)])
+    s.assert_has_calls([mock.call.filter(c == i) for i in range(100)][::-1], True)
+    assert s.filter.call_args_list.wrapped() is wrapped
+    s.filter(c == 100)
+    s.filter.assert_any_call(c == 100)
+    s.filter.assert_any_call(mock.ANY)
+    s.assert_has_calls([mock.call.filter(mock.ANY), mock.call.filter(c == 1)])
+    with pytest.raises(AssertionError):
+        s.filter.assert_any_call(c == 101)
+    with pytest.raises(AssertionError):
+        s.assert_has_calls([mock.call.filter(c == 2), mock.call.filter(c == 1)])
+    s.reset_mock()
+    with pytest.raises(AssertionError):
+        s.filter.assert_any_call(c == 1)
+    s.filter.call_args_list = [mock.call(c == 1)]
+    s.filter.assert_any_call(c == 1)
+
+
+def test_unified_magic_mock_merged_asserts() -> None:
+    """Tests merging calls without wrapping the asserted history again."""
+    c = column("column")
+    s = UnifiedAlchemyMagicMock()
+    s.query(Model).filter(c == 1).all()
+    s.assert_has_calls([mock.call.query(Model), mock.call.filter(c == 1)])
+    wrapped = s.mock_calls.wrapped()
+    s.query(Model).filter(c == 2).filter(c == 3).all()
+    assert s.mock_calls.wrapped() is wrapped
+    s.assert_has_calls([mock.call.filter(c == 2, c == 3), mock.call.all()])
+
+
 def test_unified_magic_mock() -> None:
     """Tests mock for SQLAlchemy that unifies session functions for simple asserts."""
     c = column("column")
@@ -192,6 +374,473 @@ def test_unified_magic_mock() -> None:
     assert ret == 0
 
 
+def test_unified_magic_mock_lazy_submocks() -> None:
+    """Tests that session methods are created on first access."""
+    c = column("column")
+    s = UnifiedAlchemyMagicMock()
+    assert "filter" not in s._mock_children
+    assert "all" not in s._mock_children
+    assert isinstance(s.filter, AlchemyMagicMock)
+    assert s.filter is s.filter
+    assert s.query(None).filter(c == "one").filter(c == "two").all() == []
+    assert [i[0] for i in s.mock_calls] == ["query", "filter", "all"]
+    assert [i[0] for i in s.method_calls] == ["query", "filter", "all"]
+    s.assert_has_calls([mock.call.filter(c == "one", c == "two"), mock.call.all()])
+    s.filter.assert_called_once_with(c == "one", c == "two")
+    assert list(s.query(None)) == []
+    assert s.commit() is not None
+    s.reset_mock()
+    assert s.mock_calls == []
+    assert s.query(None).all() == []
+
+
+def test_unified_magic_mock_fork() -> None:
+    """Tests forking independent sessions from a prototype session."""
+    c = column("column")
+    prototype = UnifiedAlchemyMagicMock(
+        data=[
+            ([mock.call.query(Model), mock.call.filter(c == 1)], [Model(pk1=1)]),
+            ([mock.call.query(Model)], [Model(pk1=2)]),
+        ]
+    )
+    assert prototype.query(Model).filter(c == 1).all() == [Model(pk1=1)]
+    session = prototype.fork()
+    assert isinstance(session, UnifiedAlchemyMagicMock)
+    assert type(session.fork()).__bases__[0] is UnifiedAlchemyMagicMock
+    assert session.mock_calls == []
+    session.add(Model(pk1=3))
+    assert session.query(Model).filter(c == 1).delete() == 1
+    assert session.query(Model).all() == [Model(pk1=2), Model(pk1=3)]
+    assert session.query(Model).get(3) == Model(pk1=3)
+    other = prototype.fork()
+    assert other.query(Model).filter(c == 1).all() == [Model(pk1=1)]
+    assert other.query(Model).all() == [Model(pk1=2)]
+    assert other.query(Model).get(3) is None
+    prototype.add(Model(pk1=4))
+    assert session.query(Model).all() == [Model(pk1=2), Model(pk1=3)]
+    assert other.query(Model).all() == [Model(pk1=2)]
+    assert len(prototype.mock_calls) == 4
+    forked = prototype.fork()
+    forked.query(Model).all().append(Model(pk1=5))
+    assert forked.query(Model).all() == [Model(pk1=2), Model(pk1=4)]
+
+
+def test_unified_magic_mock_bounded_history() -> None:
+    """Tests unifying calls and getting data with a bounded call history."""
+    c = column("column")
+    s = UnifiedAlchemyMagicMock(
+        max_history=2,
+        data=[
+            (
+                [
+                    mock.call.query(Model),
+                    mock.call.filter(c == 1, c == 2),
+                    mock.call.order_by(c),
+                ],
+                [Model(pk1=1)],
+            ),
+        ],
+    )
+    for _ in range(10):
+        ret = s.query(Model).filter(c == 1).order_by(c).filter(c == 2).all()
+        assert ret == [Model(pk1=1)]
+    s.filter.assert_called_with(c == 1, c == 2)
+    assert len(s.mock_calls) == 2
+    assert len(s.filter.call_args_list) <= 2
+    assert s.filter.call_count == 10
+    assert s.call_counts == {"query": 10, "filter": 10, "order_by": 10, "all": 10}
+    s.add(Model(pk1=2))
+    s.commit()
+    assert s.fork().query(Model).all() == [Model(pk1=2)]
+    assert len(s.mock_calls) == 2
+    with pytest.raises(ValueError):
+        UnifiedAlchemyMagicMock(max_history=1)
+
+
+def test_unified_magic_mock_unhashable_criteria() -> None:
+    """Tests mock data criteria which can only be compared pairwise."""
+    c = column("column")
+    s = UnifiedAlchemyMagicMock(
+        data=[
+            ([mock.call.query(Model), mock.call.filter(mock.ANY)], [1]),
+            ([mock.call.query(Model), mock.call.filter(c == 1)], [2]),
+            ([mock.call.query(Model)], [3]),
+        ]
+    )
+    assert s.query(Model).filter(c == 5).all() == [1]
+    assert s.query(Model).filter(c == 1).all() == [1]
+    assert s.query(Model).all() == [3]
+    assert s.query(Model).filter({"unhashable": []}).all() == [1]
+
+
+def test_unified_magic_mock_evaluate_criteria() -> None:
+    """Tests evaluating query criteria against added objects."""
+    s = UnifiedAlchemyMagicMock(
+        data=[([mock.call.query(Model), mock.call.filter(Model.pk1 > 1)], [1])]
+    )
+    s.add_all([SomeClass(pk1=i, pk2=i, name=str(i % 2)) for i in range(6)])
+    q = s.query(SomeClass).filter(SomeClass.pk1 > 1)
+    assert [i.pk1 for i in q.filter_by(name="0").all()] == [2, 4]
+    assert s.query(SomeClass).filter(SomeClass.pk1 > 3).count() == 2
+    assert s.query(SomeClass).filter(SomeClass.pk1 == 3).one().pk1 == 3
+    assert s.query(SomeClass).filter(column("column") == 1).count() == 6
+    assert s.query(SomeClass).filter(SomeClass.name == "1").delete() == 3
+    assert [i.pk1 for i in s.query(SomeClass).all()] == [0, 2, 4]
+    assert s.query(Model).filter(Model.pk1 > 1).all() == [1]
+
+
+def test_unified_magic_mock_indexes() -> None:
+    """Tests answering equality criteria with hash indexes of added objects."""
+    s = UnifiedAlchemyMagicMock(indexes=[SomeClass.name], auto_index=2)
+    s.add_all([SomeClass(pk1=i, pk2=i % 3, name=str(i % 2)) for i in range(6)])
+    assert s._is_indexed(SomeClass, "name")
+    assert not s._is_indexed(SomeClass, "pk2")
+    q = s.query(SomeClass).filter(SomeClass.name == "1")
+    assert [i.pk1 for i in q.filter(SomeClass.pk2 == 1).all()] == [1]
+    assert s._is_indexed(SomeClass, "pk2")
+    obj = s.query(SomeClass).filter_by(pk1=4).one()
+    obj.name = "1"
+    assert s.query(SomeClass).filter_by(name="1").count() == 4
+    assert s.query(SomeClass).filter_by(name="1", pk2=1).count() == 2
+    assert s.query(SomeClass).filter(SomeClass.name == "0").delete() == 2
+    forked = s.fork()
+    assert forked._is_indexed(SomeClass, "pk2")
+    forked.add(SomeClass(pk1=6, pk2=0, name="0"))
+    assert forked.query(SomeClass).filter_by(name="0").count() == 1
+    assert s.query(SomeClass).filter_by(name="0").count() == 0
+
+
+def test_unified_magic_mock_order_limit() -> None:
+    """Tests ordering, offsetting and limiting added objects."""
+    s = UnifiedAlchemyMagicMock()
+    s.add_all([SomeClass(pk1=i, pk2=i % 3, name=str(i % 2)) for i in range(8)])
+    q = s.query(SomeClass).order_by(SomeClass.pk2.desc(), SomeClass.pk1)
+    assert [i.pk1 for i in q.limit(4).all()] == [2, 5, 1, 4]
+    q = s.query(SomeClass).order_by(SomeClass.pk2.desc()).order_by(SomeClass.pk1)
+    assert [i.pk1 for i in q.offset(2).limit(2).all()] == [1, 4]
+    q = s.query(SomeClass).filter(SomeClass.name == "0").order_by(SomeClass.pk1.desc())
+    assert [i.pk1 for i in q.all()] == [6, 4, 2, 0]
+    assert s.query(SomeClass).offset(6).count() == 2
+    assert s.query(SomeClass).limit(3).limit(1).one().pk1 == 0
+    q = s.query(SomeClass).order_by(func.random())
+    assert len(q.limit(2).all()) == 8
+    q = s.query(SomeClass).order_by(func.random()).filter(SomeClass.name == "0")
+    assert [i.pk1 for i in q.offset(1)] == [0, 2, 4, 6]
+    q = s.query(SomeClass).order_by(func.random()).order_by(None)
+    assert [i.pk1 for i in q.limit(2).all()] == [0, 1]
+    assert len(s.query(SomeClass).order_by(SomeClass.pk1).all()) == 8
+
+
+def test_unified_magic_mock_bulk() -> None:
+    """Tests bulk inserting, saving and updating objects."""
+    s = UnifiedAlchemyMagicMock(indexes=[SomeClass.name])
+    s.bulk_insert_mappings(
+        SomeClass, ({"pk1": i, "pk2": i, "name": "a"} for i in range(4))
+    )
+    s.bulk_save_objects([SomeClass(pk1=4, pk2=4, name="b"), Model(pk1=1)])
+    assert s.query(SomeClass).count() == 5
+    assert s.query(Model).one().pk1 == 1
+    assert s.query(SomeClass).filter_by(name="a").count() == 4
+    s.bulk_update_mappings(
+        SomeClass,
+        [
+            {"pk1": 1, "pk2": 1, "name": "b"},
+            {"pk1": 2, "pk2": 3, "name": "b"},
+            {"pk1": 3, "name": "b"},
+        ],
+    )
+    assert s.query(SomeClass).get((1, 1)).name == "b"
+    assert s.query(SomeClass).filter_by(name="b").count() == 2
+    s.add_all([Model(pk1=2), SomeClass(pk1=5, pk2=5), Model(pk1=3)])
+    assert [i.pk1 for i in s.query(Model).all()] == [1, 2, 3]
+    assert s.query(SomeClass).count() == 6
+    assert s.query(SomeClass).filter(SomeClass.pk1 > 3).count() == 2
+    s.bulk_save_objects.assert_called_once()
+
+
+def test_unified_magic_mock_streaming() -> None:
+    """Tests streaming rows lazily chunk by chunk."""
+    s = UnifiedAlchemyMagicMock()
+    s.add_all([SomeClass(pk1=i, pk2=i, name=str(i % 2)) for i in range(10)])
+    q = s.query(SomeClass).filter(SomeClass.name == "1").yield_per(2)
+    rows = iter(q)
+    assert next(rows).pk1 == 1
+    assert [i.pk1 for i in rows] == [3, 5, 7, 9]
+    q = s.query(SomeClass).execution_options(yield_per=3)
+    assert [len(i) for i in q.partitions(3)] == [3, 3, 3, 1]
+    q = s.query(SomeClass).order_by(SomeClass.pk1.desc())
+    assert [i.pk1 for i in q.fetchmany(2)] == [9, 8]
+    assert [i.pk1 for i in s.fetchmany(3)] == [7, 6, 5]
+    assert s.fetchone().pk1 == 4
+    assert [len(i) for i in s.partitions(2)] == [2, 2]
+    assert s.fetchall() == []
+    assert s.fetchone() is None
+    assert s.query(SomeClass).fetchone().pk1 == 0
+    assert len(s.query(SomeClass).fetchall()) == 10
+    assert s.query(Model).fetchmany() == []
+    assert s.query(Model).first() is None
+    s.query(SomeClass).yield_per.assert_called_once_with(2)
+
+
+def test_unified_magic_mock_session_get_delete() -> None:
+    """Tests getting and deleting objects through the session."""
+    obj = Model(pk1=1)
+    s = UnifiedAlchemyMagicMock(data=[([mock.call.query(Model)], [obj])])
+    s.add(Model(pk1=2))
+    assert s.get(Model, 1) is obj
+    assert s.get(Model, {"pk1": 2}).pk1 == 2
+    assert s.get(SomeClass, (1, 1)) is None
+    s.delete(obj)
+    assert [i.pk1 for i in s.query(Model).all()] == [2]
+    s.query(Model).delete("fetch")
+    assert s.query(Model).all() == []
+    assert UnifiedAlchemyMagicMock().get(Model, 1) is None
+
+
+def test_unified_magic_mock_concurrent_chains() -> None:
+    """Tests tracking queries of threads and tasks separately."""
+    s = UnifiedAlchemyMagicMock()
+    s.add_all([Model(pk1=i, name=str(i % 2)) for i in range(6)])
+    barrier = threading.Barrier(2)
+    results = {}
+
+    def query(name: str) -> None:
+        q = s.query(Model).filter(Model.name == name)
+        barrier.wait()
+        q = q.filter(Model.pk1 > 1)
+        barrier.wait()
+        results[name] = [i.pk1 for i in q.all()]
+
+    threads = [threading.Thread(target=query, args=(i,)) for i in "01"]
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    assert results == {"0": [2, 4], "1": [3, 5]}
+    assert s.filter.call_count == 2
+
+    async def query_task(name: str) -> List[int]:
+        q = s.query(Model).filter(Model.name == name)
+        await asyncio.sleep(0)
+        q = q.filter(Model.pk1 > 1)
+        await asyncio.sleep(0)
+        return [i.pk1 for i in q.all()]
+
+    async def run() -> List[Any]:
+        s.query(Model)
+        return await asyncio.gather(query_task("0"), query_task("1"))
+
+    assert asyncio.run(run()) == [[2, 4], [3, 5]]
+
+    q = s.query(Model).filter(Model.name == "0")
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(query, "1"))
+    thread.start()
+    barrier.wait()
+    barrier.wait()
+    thread.join()
+    assert [i.pk1 for i in q.all()] == [0, 2, 4]
+    assert results["1"] == [3, 5]
+    s.reset_mock()
+    assert len(s.query(Model).all()) == 6
+
+
+def test_unified_magic_mock_freed() -> None:
+    """Tests discarded sessions are freed along with their query chains."""
+    rows: List[Any] = []
+
+    def use() -> None:
+        s = UnifiedAlchemyMagicMock()
+        s.add_all([Model(pk1=i) for i in range(10)])
+        rows.extend(weakref.ref(i) for i in s.query(Model).all())
+        assert len(s.query(Model).fetchmany(2)) == 2
+
+    for _ in range(3):
+        use()
+    gc.collect()
+    assert [i() for i in rows] == [None] * 30
+
+
+def test_unified_magic_mock_snapshot() -> None:
+    """Tests restoring sessions from snapshots of their data."""
+    s = UnifiedAlchemyMagicMock(
+        data=[
+            (
+                [mock.call.query(Model), mock.call.filter(Model.name == "a")],
+                [Model(pk1=1, name="a")],
+            ),
+        ],
+        default=[0],
+        max_history=10,
+        indexes=[SomeClass.name],
+        auto_index=2,
+    )
+    s.add_all([SomeClass(pk1=i, pk2=i, name=str(i % 2)) for i in range(4)])
+    s.bulk_insert_mappings(Model, [{"pk1": 2, "name": "b"}])
+    restored = UnifiedAlchemyMagicMock.from_snapshot(s.snapshot())
+    assert restored._mock_max_history == 10
+    assert restored._mock_auto_index == 2
+    assert restored._mock_indexed == {SomeClass: {"name"}}
+    assert restored.query(Data).all() == [0]
+    assert restored.query(Model).filter(Model.name == "a").all()[0].pk1 == 1
+    rows = restored.query(SomeClass).filter(SomeClass.name == "1").all()
+    assert [i.pk1 for i in rows] == [1, 3]
+    assert restored.get(Model, 2).name == "b"
+    restored.add(Model(pk1=3))
+    assert len(restored.query(Model).all()) == 2
+    assert len(s.query(Model).all()) == 1
+
+
+def test_unified_magic_mock_stats() -> None:
+    """Tests collecting counters and timings of sessions."""
+    s = UnifiedAlchemyMagicMock(
+        stats=True,
+        data=[([mock.call.query(Model), mock.call.filter(Model.pk1 == 1)], [0])],
+    )
+    s.add_all([Model(pk1=i, name=str(i % 2)) for i in range(1, 5)])
+    assert s.query(Model).filter(Model.pk1 == 1).all() == [0]
+    q = s.query(Model).filter(Model.name == "1").filter(Model.pk1 > 1)
+    assert [i.pk1 for i in q.order_by(Model.pk1)] == [3]
+    assert s.get(Model, 2).pk1 == 2
+    assert s.query(Model).filter(Model.pk1 == 4).delete() == 1
+    s.delete(s.get(Model, 3))
+    stats = s.stats(reset=True)
+    assert stats.counts["add_all"] == 1
+    assert stats.counts["delete"] == 2
+    assert stats.counts["filter"] == 4
+    assert stats.counts["merges"] == 1
+    assert stats.counts["__iter__"] == 1
+    assert stats.counts["get"] == 2
+    assert stats.counts["identity_map_builds"] == 2
+    assert stats.counts["entries_examined"] == 6
+    assert stats.counts["compiles"] > 0
+    assert stats.counts["predicate_compiles"] > 0
+    assert set(stats.timings) == {
+        "__iter__",
+        "add_all",
+        "all",
+        "delete",
+        "filter",
+        "get",
+        "order_by",
+        "query",
+    }
+    assert s.stats().counts == {}
+    assert s.fork().stats().counts == {}
+    restored = UnifiedAlchemyMagicMock.from_snapshot(s.snapshot())
+    restored.query(Model).all()
+    assert restored.stats().counts["all"] == 1
+    s = UnifiedAlchemyMagicMock()
+    s.query(Model).all()
+    assert s.stats().counts == {}
+    assert s._mock_store.stats is None
+    s = AsyncUnifiedAlchemyMagicMock(stats=True)
+    asyncio.run(s.execute(select(Model)))
+    assert s.sync_session.stats().counts["execute"] == 1
+
+
+def test_unified_magic_mock_concurrent_mutations() -> None:
+    """Tests adding, querying and deleting objects from several threads."""
+    s = UnifiedAlchemyMagicMock()
+
+    def work(worker: int) -> None:
+        start = worker * 100
+        for i in range(start, start + 100):
+            s.add(Model(pk1=i, name=str(worker)))
+            s.add_all([SomeClass(pk1=i, pk2=0, name=str(worker))])
+            assert s.get(Model, i).pk1 == i
+        s.delete(s.get(SomeClass, (start, 0)))
+        criteria = [Model.name == str(worker), Model.pk1 < start + 50]
+        assert len(s.query(Model).filter(*criteria).all()) == 50
+        assert s.query(Model).filter(*criteria).delete() == 50
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(work, range(8)))
+    finally:
+        sys.setswitchinterval(interval)
+    assert len(s._mock_store) == 2
+    assert len(s.query(Model).all()) == 400
+    assert len(s.query(SomeClass).all()) == 792
+
+
+def test_result() -> None:
+    """Tests consuming detached results of async sessions."""
+    boundary = UnifiedAlchemyMagicMock.boundary
+    result = Result(iter(range(6)), boundary)
+    assert result.scalars().unique() is result
+    assert result.fetchone() == 0
+    assert result.first() == 1
+    assert result.fetchmany(2) == [2, 3]
+    assert list(result.partitions(1)) == [[4], [5]]
+    assert result.all() == []
+    assert Result(iter([1]), boundary).scalar_one() == 1
+    assert Result(iter([]), boundary).scalar_one_or_none() is None
+    with pytest.raises(MultipleResultsFound):
+        Result(iter([1, 2]), boundary).one()
+
+    async def consume(result: AsyncResult) -> List[Any]:
+        partition = [i async for i in result.partitions(2)][0]
+        return [await result.fetchone(), partition, [i async for i in result]]
+
+    result = AsyncResult(Result(iter(range(5)), boundary))
+    assert asyncio.run(consume(result)) == [None, [0, 1], []]
+    result = AsyncResult(Result(iter(range(5)), boundary))
+    assert asyncio.run(result.scalars().fetchmany(3)) == [0, 1, 2]
+    assert asyncio.run(result.all()) == [3, 4]
+
+
+def test_async_unified_magic_mock() -> None:
+    """Tests mocking an async session with concurrent coroutines."""
+    s = AsyncUnifiedAlchemyMagicMock(
+        data=[([mock.call.execute(select(Model))], [Model(pk1=1)])],
+        max_history=100,
+    )
+    assert s.sync_session._mock_max_history == 100
+    s.add_all([SomeClass(pk1=i, pk2=i, name=str(i % 2)) for i in range(4)])
+
+    async def query(name: str) -> List[int]:
+        async with s as session:
+            q = select(SomeClass).where(SomeClass.name == name)
+            q = q.order_by(SomeClass.pk1.desc())
+            result = await session.execute(q)
+            stream = await session.stream_scalars(q)
+            rows = await session.scalars(q.limit(1))
+            pks = [i.pk1 for i in result.scalars().all()]
+            assert [i.pk1 async for i in stream] == pks
+            assert len(rows.all()) == 1
+            await session.commit()
+        return pks
+
+    async def run() -> List[Any]:
+        return await asyncio.gather(
+            query("0"),
+            query("1"),
+            s.get(SomeClass, (1, 1)),
+            s.scalar(select(Model)),
+            s.run_sync(lambda session: session.query(SomeClass).count()),
+        )
+
+    even, odd, obj, scalar, count = asyncio.run(run())
+    assert even == [2, 0]
+    assert odd == [3, 1]
+    assert obj.pk1 == 1
+    assert scalar.pk1 == 1
+    assert count == 4
+    assert s.commit.call_count == 2
+    assert s.execute.call_count == 2
+    assert s.sync_session.commit.call_count == 2
+
+    async def delete() -> None:
+        await s.delete(obj)
+        await s.flush()
+
+    asyncio.run(delete())
+    assert s.sync_session.query(SomeClass).count() == 3
+
+
 def test_complex_session() -> None:
     """Tests mock for SQLAlchemy with more complex session."""
     s = UnifiedAlchemyMagicMock(
@@ -272,6 +921,24 @@ def test_get_singular() -> None:
     assert user is not None
 
 
+def test_get_assigned_key() -> None:
+    """Tests mock for SQLAlchemy with getting objects keyed after adding them."""
+    mock_session = UnifiedAlchemyMagicMock()
+    mock_session.add(Model(pk1=1, name="first"))
+    assert mock_session.query(Model).get(1).name == "first"
+    model = Model(name="test")
+    mock_session.add(model)
+    model.pk1 = 2
+    assert mock_session.query(Model).get(2) is model
+    mock_session.add_all([Model(pk1=3, name="third")])
+    assert mock_session.query(Model).get(3).name == "third"
+    model.pk1 = 4
+    assert mock_session.query(Model).get(4) is model
+    assert mock_session.query(Model).get(2) is None
+    assert mock_session.query(Model).delete() == 3
+    assert mock_session.query(Model).get(1) is None
+
+
 def test_scalar_singular() -> None:
     """Tests mock for SQLAlchemy with scalar when there is one row."""
     mock_session = UnifiedAlchemyMagicMock()
@@ -347,3 +1014,39 @@ def test_update_calls() -> None:
     assert 1 == deleted_count
     actual_row = mock_session.query(Model).filter(Model.pk1 == 3).all()
     assert [] == actual_row
+
+
+@pytest.mark.skipif(
+    version.parse(sqlalchemy.__version__) < version.parse("1.4.0"),
+    reason="requires sqlalchemy 1.4.0 or higher to run",
+)
+def test_unified_magic_mock_dialect() -> None:
+    """Tests sessions comparing expressions for a given dialect."""
+    c = column("column")
+    s = UnifiedAlchemyMagicMock(
+        dialect="postgresql",
+        data=[
+            ([mock.call.query(Model), mock.call.filter(c.regexp_match("a"))], [1]),
+            (
+                [
+                    mock.call.query(Model),
+                    mock.call.filter(c.regexp_match("a", flags="i")),
+                ],
+                [2],
+            ),
+        ],
+    )
+    assert s.query(Model).filter(c.regexp_match("a", flags="i")).all() == [2]
+    assert s.query(Model).filter(c.regexp_match("a")).all() == [1]
+    s.filter.assert_any_call(c.regexp_match("a", flags="i"))
+    with pytest.raises(AssertionError):
+        s.filter.assert_called_with(c.regexp_match("a", flags="i"))
+    for session in (s.fork(), UnifiedAlchemyMagicMock.from_snapshot(s.snapshot())):
+        assert session.query(Model).filter(c.regexp_match("a")).all() == [1]
+    m = AlchemyMagicMock(dialect="postgresql")
+    m.query(Model).filter(c.regexp_match("a"))
+    m.query.return_value.filter.assert_called_once_with(c.regexp_match("a"))
+    with pytest.raises(AssertionError):
+        m.query.return_value.filter.assert_called_once_with(
+            c.regexp_match("a", flags="i")
+        )
@@ -0,0 +1,242 @@
+"""Testing the module for indexing mocked data in mock-alchemy."""
+import gc
+import pickle
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from mock_alchemy.store import DataStore
+from mock_alchemy.store import HashIndex
+
+from .common import Model
+from .common import SomeClass
+
+
+def test_data_store_match() -> None:
+    """Tests looking up the most specific entry matching a chain of calls."""
+    store = DataStore()
+    store.append(["a"], ["a"], ["a"], [1])
+    store.append(["a", "b"], ["a", "b"], ["a", "b"], [2])
+    store.append(["b", "a"], ["b", "a"], ["b", "a"], [3])
+    store.append([], [], [], [4])
+    assert len(store) == 4
+    assert store.match(["a", "b"], ["a", "b"]).rows == [2]
+    assert store.match(["c", "a"], ["c", "a"]).rows == [1]
+    assert store.match(["c"], ["c"]).rows == [4]
+    assert store.match([], []).rows == [4]
+
+
+def test_data_store_pending() -> None:
+    """Tests entries and chains which cannot be fingerprinted."""
+    store = DataStore()
+    store.append(["a", mock.ANY], ["a", mock.ANY], ["a", None], [1])
+    store.append(["b"], ["b"], ["b"], [2])
+    assert store.match([], []) is None
+    assert store.match(["a"], ["a"]).rows == [1]
+    assert store.match(["a", "c"], ["a", "c"]).rows == [1]
+    assert store.match(["b", "c"], ["b", None]).rows == [2]
+    assert store.match(["a", "b"], ["a", None]).rows == [1]
+    assert store.match(["c"], [None]) is None
+
+
+def test_data_store_containing() -> None:
+    """Tests finding the entries containing a given call."""
+    store = DataStore()
+    store.append(["a"], ["a"], ["a"], [1])
+    store.append(["a", "b"], ["a", "b"], ["a", "b"], [2])
+    store.append([mock.ANY], [mock.ANY], [None], [3])
+    store.append(["b"], ["b"], ["b"], [4])
+    assert [i.rows for i in store.containing("a", "a")] == [[2], [1], [3]]
+    assert [i.rows for i in store.containing("b", None)] == [[2], [3], [4]]
+
+
+def test_data_store_bucket() -> None:
+    """Tests finding the first entry with exactly one given call."""
+    store = DataStore()
+    store.append(["a", "b"], ["a", "b"], ["a", "b"], [1])
+    assert store.bucket("a", "a") is None
+    store.append(["a"], ["a"], ["a"], [2])
+    store.append(["a"], ["a"], ["a"], [3])
+    assert store.bucket("a", "a").rows == [2]
+    assert store.bucket("a", None).rows == [2]
+    store = DataStore()
+    store.append([mock.ANY], [mock.ANY], [None], [1])
+    store.append(["a"], ["a"], ["a"], [2])
+    assert store.bucket("a", "a").rows == [1]
+
+
+def test_data_store_get() -> None:
+    """Tests getting rows by primary key through the identity maps."""
+    store = DataStore()
+    first = Model(pk1=1, name="first")
+    store.append(["a", "b"], ["a", "b"], ["a", "b"], [first])
+    entry = store.append(["a"], ["a"], ["a"], [Model(pk1=2, name="second")])
+    assert store.get("a", "a", 1) is first
+    assert store.get("a", "a", (2,)).name == "second"
+    assert store.get("a", "a", {"pk1": 3}) is None
+    third = Model(pk1=1, name="third")
+    entry.extend([third])
+    assert store.get("a", "a", 1) is third
+    entry.rows.append(Model(pk1=4, name="fourth"))
+    assert store.get("a", None, 4).name == "fourth"
+    assert entry.clear() == 3
+    assert store.get("a", "a", 1) is first
+    assert store.get("b", "b", 4) is None
+    assert store.get_many("a", "a", [(1,), (3,)]) == [first, None]
+
+
+def test_data_entry_changed_keys() -> None:
+    """Tests identity maps when primary keys change after adding rows."""
+    store = DataStore()
+    pending = Model(name="pending")
+    changed = Model(pk1=1, name="changed")
+    entry = store.append(["a"], ["a"], ["a"], [pending, changed])
+    assert entry.get((1,)) is changed
+    assert entry.get((2,)) is None
+    pending.pk1 = 2
+    changed.pk1 = 3
+    assert entry.get((2,)) is pending
+    assert entry.get((1,)) is None
+    assert entry.get((3,)) is changed
+
+
+def test_data_store_fork() -> None:
+    """Tests forking stores which share their entries copy-on-write."""
+    rows = [Model(pk1=1)]
+    store = DataStore()
+    entry = store.append(["a"], ["a"], ["a"], rows)
+    forked = store.fork()
+    assert forked.match(["a"], ["a"]) is entry
+    forked.extend(forked.bucket("a", "a"), [Model(pk1=2)])
+    forked.append(["b"], ["b"], ["b"], [3])
+    forked.append(["a", "c"], ["a", "c"], ["a", "c"], [4])
+    assert forked.match(["a", "c"], ["a", "c"]).rows == [4]
+    assert store.match(["a", "c"], ["a", "c"]) is entry
+    assert len(forked.match(["a"], ["a"]).rows) == 2
+    assert forked.get("a", "a", 2) is not None
+    assert forked.match(["b"], ["b"]).rows == [3]
+    assert store.match(["a"], ["a"]).rows == rows
+    assert store.get("a", "a", 2) is None
+    assert store.match(["b"], ["b"]) is None
+    assert len(store) == 1
+    other = store.fork()
+    assert store.clear(store.bucket("a", "a")) == 1
+    assert store.match(["a"], ["a"]).rows == []
+    assert other.match(["a"], ["a"]).rows == rows
+    assert len(rows) == 1
+
+
+def test_data_store_concurrent_add() -> None:
+    """Tests adding and getting rows from several threads at once."""
+    store = DataStore()
+    forked = store.fork()
+
+    def add(worker: int) -> None:
+        for i in range(200):
+            for target in (store, forked):
+                target.add(worker % 2, worker % 2, worker % 2, [Model(pk1=i)])
+            assert store.get(worker % 2, worker % 2, i) is not None
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(add, range(8)))
+    finally:
+        sys.setswitchinterval(interval)
+    for target in (store, forked):
+        assert len(target) == 2
+        assert [len(target.match([i], [i]).rows) for i in (0, 1)] == [800, 800]
+        assert target.get_many(0, 0, [(199,), (200,)])[1] is None
+
+
+def test_data_store_pickle() -> None:
+    """Tests pickling stores along with their index."""
+    first = Model(pk1=1, name="first")
+    criteria = [mock.call.query(Model), mock.call.filter(Model.pk1 == 1)]
+    store = DataStore()
+    store.append(criteria, criteria, ["a", "b"], [first])
+    store.append(["c", mock.ANY], ["c", mock.ANY], ["c", None], [first, 2])
+    forked = store.fork()
+    forked.add("d", "d", "d", [Model(pk1=2, name="second")])
+    restored = pickle.loads(pickle.dumps(forked))
+    assert len(restored) == 3
+    assert restored.match(["a", "b"], ["a", "b"]).rows == [first]
+    assert restored.match(["c", "e"], ["c", "e"]).rows == [first, 2]
+    assert restored.entries[0].rows[0] is restored.entries[1].rows[0]
+    assert restored.entries[0].calls[0] == mock.call.query(Model)
+    assert restored.get("d", "d", 2).name == "second"
+    assert restored.bucket("d", "d").dynamic
+    restored.add("d", "d", "d", [Model(pk1=3)])
+    assert len(restored.bucket("d", "d").rows) == 2
+    assert len(forked.bucket("d", "d").rows) == 1
+
+
+def test_data_store_stats() -> None:
+    """Tests counting examined entries and identity map builds."""
+    store = DataStore()
+    store.stats = Counter()
+    store.append(["a"], ["a"], ["a"], [Model(pk1=1)])
+    store.append(["a", "b"], ["a", "b"], ["a", "b"], [Model(pk1=2)])
+    store.append(["c", mock.ANY], ["c", mock.ANY], ["c", None], [])
+    store.match(["a"], ["a"])
+    assert store.stats["entries_examined"] == 2
+    store.match(["a", "d"], ["a", None])
+    assert store.stats["entries_examined"] == 5
+    assert store.get("a", "a", 1).pk1 == 1
+    assert store.stats["identity_map_builds"] == 1
+    assert store.get("a", "a", 2).pk1 == 2
+    assert store.stats["identity_map_builds"] == 4
+    store.extend(store.bucket("a", "a"), [Model(pk1=3)])
+    assert store.get("a", "a", 3).pk1 == 3
+    assert store.stats["identity_map_builds"] == 4
+    assert store.fork().stats is None
+    assert pickle.loads(pickle.dumps(store)).stats is None
+
+
+def test_hash_index() -> None:
+    """Tests looking up rows by attribute values through hash indexes."""
+    rows = [SomeClass(pk1=i, pk2=i, name=str(i % 2)) for i in range(4)]
+    index = HashIndex(SomeClass, "name")
+    assert index.lookup(rows, "0") == [rows[0], rows[2]]
+    assert index.lookup(rows, "2") == []
+    rows.append(SomeClass(pk1=4, pk2=4, name="0"))
+    assert index.lookup(rows, "0") == [rows[0], rows[2], rows[4]]
+    rows[0].name = "1"
+    assert index.stale
+    assert index.lookup(rows, "0") == [rows[2], rows[4]]
+    SomeClass(pk1=5, pk2=5, name="0")
+    assert not index.stale
+    assert index.lookup(rows[:1], "1") == [rows[0]]
+    assert index.lookup([SomeClass(name=[])], "0") is None
+
+
+def test_hash_index_listeners() -> None:
+    """Tests removing the attribute listener along with the last hash index."""
+    gc.collect()
+    assert not SomeClass.name.dispatch.set
+    index = HashIndex(SomeClass, "name")
+    assert len(SomeClass.name.dispatch.set) == 1
+    assert HashIndex(SomeClass, "name").key == index.key
+    gc.collect()
+    assert len(SomeClass.name.dispatch.set) == 1
+    del index
+    gc.collect()
+    assert not SomeClass.name.dispatch.set
+
+
+def test_data_entry_lookup() -> None:
+    """Tests hash indexes of entries as their rows change."""
+    store = DataStore()
+    entry = store.append(["a"], ["a"], ["a"], [Model(pk1=1, name="a")], True)
+    assert entry.dynamic
+    assert entry.lookup(Model, "name", "a") == entry.rows
+    store.extend(entry, [Model(pk1=2, name="a")])
+    assert len(entry.lookup(Model, "name", "a")) == 2
+    assert store.clear(entry, lambda i: i.pk1 == 1) == 1
+    assert entry.lookup(Model, "name", "a") == entry.rows
+    forked = store.fork()
+    forked.extend(forked.bucket("a", "a"), [Model(pk1=3, name="a")])
+    assert len(forked.bucket("a", "a").lookup(Model, "name", "a")) == 2
+    assert len(entry.lookup(Model, "name", "a")) == 1
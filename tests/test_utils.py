@@ -1,17 +1,28 @@
 """Testing the module for utils in mock-alchemy."""
+import gc
+
 import pytest
+from sqlalchemy import inspect
 from sqlalchemy.orm.exc import MultipleResultsFound
 
 from mock_alchemy.sql_alchemy_imports import declarative_base
+from mock_alchemy.utils import Stats
 from mock_alchemy.utils import build_identity_map
+from mock_alchemy.utils import build_objects
 from mock_alchemy.utils import copy_and_update
+from mock_alchemy.utils import gc_paused
 from mock_alchemy.utils import get_item_attr
 from mock_alchemy.utils import get_scalar
+from mock_alchemy.utils import identity_getter
+from mock_alchemy.utils import identity_key
 from mock_alchemy.utils import indexof
+from mock_alchemy.utils import iter_chunks
 from mock_alchemy.utils import match_type
 from mock_alchemy.utils import raiser
 from mock_alchemy.utils import setattr_tmp
+from mock_alchemy.utils import to_identity_key
 
+from .common import Model
 from .common import SomeClass
 
 Base = declarative_base()
@@ -57,6 +68,43 @@ def test_setattr_tmp() -> None:
         assert Foo.foo is None
 
 
+def test_gc_paused() -> None:
+    """Tests temporarily pausing the garbage collector."""
+    with gc_paused():
+        assert not gc.isenabled()
+        with gc_paused():
+            pass
+        assert not gc.isenabled()
+    assert gc.isenabled()
+
+
+def test_stats() -> None:
+    """Tests counting and timing operations."""
+    stats = Stats()
+    with pytest.raises(ValueError):
+        with stats.timed("all"):
+            raise ValueError()
+    with stats.timed("all"):
+        stats.counts["compiles"] += 2
+    assert stats.counts == {"all": 2, "compiles": 2}
+    assert set(stats.timings) == {"all"}
+    copied = stats.copy()
+    stats.counts.clear()
+    assert copied.counts["all"] == 2
+    assert copied.timings == stats.timings
+    assert repr(Stats()) == "Stats(counts={}, timings={})"
+
+
+def test_iter_chunks() -> None:
+    """Tests splitting items into chunks lazily."""
+    assert list(iter_chunks([1, 2, 3], 2)) == [[1, 2], [3]]
+    assert list(iter_chunks([], 2)) == []
+    items = iter(range(10))
+    chunks = iter_chunks(items, 3)
+    assert next(chunks) == [0, 1, 2]
+    assert next(items) == 3
+
+
 def test_raiser() -> None:
     """Tests utility for raising exceptions."""
 
@@ -76,6 +124,37 @@ def test_idmap() -> None:
     assert str(expected_idmap) == str(idmap)
 
 
+def test_identity_key() -> None:
+    """Tests getting and normalizing identity keys."""
+    assert identity_key(SomeClass(pk1=1, pk2=2)) == (1, 2)
+    assert identity_key(SomeClass(pk2=2)) == (None, 2)
+    assert to_identity_key(1) == (1,)
+    assert to_identity_key((1, 2)) == (1, 2)
+    assert to_identity_key({"pk2": 2, "pk1": 1}) == (1, 2)
+
+
+def test_identity_getter() -> None:
+    """Tests caching identity key extractors per model."""
+    getter = identity_getter(SomeClass)
+    assert getter is identity_getter(SomeClass)
+    assert getter(SomeClass(pk1=1, pk2=2)) == (1, 2)
+    assert identity_getter(Model)(Model(pk1=1)) == (1,)
+    idmap = build_identity_map([SomeClass(pk1=1, pk2=2), Model(pk1=1)])
+    assert sorted(idmap) == [(1,), (1, 2)]
+
+
+def test_build_objects() -> None:
+    """Tests building objects from mappings of their attribute values."""
+    objs = build_objects(SomeClass, [{"pk1": 1, "pk2": 2}, {"name": "a", "foo": 1}])
+    assert identity_key(objs[0]) == (1, 2)
+    assert objs[1].name == "a" and objs[1].pk1 is None
+    assert not hasattr(objs[1], "foo")
+    assert inspect(objs[0]).transient
+    objs[0].name = "b"
+    assert objs[0].name == "b"
+    assert build_objects(inspect(Model), [{"pk1": 1}])[0].pk1 == 1
+
+
 def test_get_attr() -> None:
     """Tests utility for accessing dict by different key types (for get)."""
     idmap = {(1,): 2}